@@ -1,41 +1,148 @@
 from django.contrib import admin
 from django.core.exceptions import ValidationError
 from django.contrib import messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
+from .money import format_money
+from .services import (
+    complete_orders, receive_supply_items, recalculate_supply_totals, save_stocktake_lines, transition_orders,
+)
+from .variance import stock_variance
 from .models import (
     Ingredient, MenuItem, Recipe, Order, OrderItem, 
-    Modifier, Supplier, Supply, SupplyItem, Shift
+    Modifier, Supplier, Supply, SupplyItem, Shift, OrderStatusEvent, Store,
+    Stocktake, StocktakeLine
 )
+
+def money_column(field, description):
+    # MoneyField holds tiyn; list pages show tenge (edit forms convert via MoneyFormField)
+    @admin.display(description=description, ordering=field)
+    def column(obj):
+        return format_money(getattr(obj, field))
+    return column
+
+# Below this many rows an exact COUNT(*) is cheap enough
+ESTIMATE_FROM = 10000
+
+def estimated_count(model, using):
+    # Postgres keeps a row estimate in the catalog; elsewhere the id range of the table is close
+    # enough for paging (ids only grow, the archive removes the oldest rows). Both are index/catalog reads.
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] > 0 else None
+    bounds = model._default_manager.using(using).aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['high'] is None:
+        return 0
+    return bounds['high'] - bounds['low'] + 1
+
+class EstimatedCountPaginator(Paginator):
+    """Unfiltered changelists of big tables page on an estimate instead of COUNT(*) over the whole table."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATE_FROM:
+                return estimate
+        return super().count
+
+class ChoicesCacheMixin:
+    """
+    Inline rows share the FK/M2M choices of the first row for the request:
+    one query per field per page instead of one per row.
+    """
+
+    cached_choice_fields = ()
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_dbfield(db_field, request, **kwargs)
+        if db_field.name in self.cached_choice_fields and formfield is not None and request is not None:
+            cache = request.__dict__.setdefault('_admin_choices', {})
+            key = (db_field.model, db_field.name)
+            if key not in cache:
+                # A comprehension, not list(): list() asks the iterator for len() first, a COUNT(*)
+                cache[key] = [choice for choice in formfield.choices]
+            formfield.choices = cache[key]
+            # The admin wraps the select (add/change links); the inner widget renders the options
+            if hasattr(formfield.widget, 'widget'):
+                formfield.widget.widget.choices = cache[key]
+        return formfield
+
+@admin.register(Store)
+class StoreAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name', 'is_active')
+
 @admin.register(Shift)
 class ShiftAdmin(admin.ModelAdmin):
-    list_display = ('id', 'opened_at', 'is_active', 'total_sales', 'order_count')
+    list_display = ('id', 'opened_at', 'is_active', money_column('total_sales', 'Total Sales'), 'order_count')
     list_filter = ('is_active', 'opened_at')
     ordering = ('-opened_at',)
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """Autocomplete whose selected labels come from a dict shared by all inline rows, not a query per row."""
+
+    def __init__(self, field, admin_site, labels, **kwargs):
+        super().__init__(field, admin_site, **kwargs)
+        self.labels = labels
+
+    def __deepcopy__(self, memo):
+        copy = super().__deepcopy__(memo)
+        copy.labels = self.labels
+        return copy
+
+    def optgroups(self, name, value, attr=None):
+        selected = {str(v) for v in value if str(v) not in self.choices.field.empty_values}
+        if not selected <= self.labels.keys():
+            return super().optgroups(name, value, attr)
+        options = [] if self.is_required else [self.create_option(name, '', '', False, 0)]
+        for pk in sorted(selected):
+            options.append(self.create_option(name, pk, self.labels[pk], selected, len(options)))
+        return [(None, options, 0)]
+
 # --- 1. Ингредиенты и Поставщики ---
 @admin.register(Supplier)
 class SupplierAdmin(admin.ModelAdmin):
     list_display = ('name', 'contact_info')
+    search_fields = ('name',)
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'amount', 'unit', 'supplier')
+    list_select_related = ('supplier',)
     search_fields = ('name',)
     list_filter = ('unit',)
+    autocomplete_fields = ('supplier',)
 
 # --- 2. Модификаторы ---
 @admin.register(Modifier)
 class ModifierAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'ingredient', 'quantity_needed')
+    list_display = ('name', money_column('price', 'Price'), 'action', 'ingredient', 'quantity_needed')
+    list_select_related = ('ingredient',)
+    list_filter = ('type', 'action')
+    search_fields = ('name',)
+    autocomplete_fields = ('ingredient', 'target')
 
 # --- 3. Меню и Рецепты ---
 class RecipeInline(admin.TabularInline):
     model = Recipe
     extra = 1  # Показывает одну пустую строку для нового ингредиента
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
 
 @admin.register(MenuItem)
 class MenuItemAdmin(admin.ModelAdmin):
     inlines = [RecipeInline]
     # Теперь поле category есть в модели, ошибки не будет
-    list_display = ('name', 'price', 'category')
+    list_display = ('name', money_column('price', 'Base Price'), 'category')
     list_filter = ('category',)
     search_fields = ('name',)
 
@@ -44,40 +151,163 @@ class SupplyItemInline(admin.TabularInline):
     model = SupplyItem
     extra = 1
     fields = ('ingredient', 'quantity', 'unit_price', 'cost')
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
 
 @admin.register(Supply)
 class SupplyAdmin(admin.ModelAdmin):
     inlines = [SupplyItemInline]
     list_display = ('id', 'supplier', 'created_at', 'total_cost')
+    list_select_related = ('supplier',)
+    list_filter = ('supplier',)
     readonly_fields = ('total_cost', 'created_at')
+    autocomplete_fields = ('supplier',)
+    date_hierarchy = 'created_at'
+    actions = ['recalculate_totals']
+
+    @admin.action(description="Recalculate totals from the lines")
+    def recalculate_totals(self, request, queryset):
+        updated = recalculate_supply_totals(queryset.values_list('pk', flat=True))
+        messages.success(request, f"Totals recalculated for {updated} supplies")
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not SupplyItem:
+            return super().save_formset(request, form, formset, change)
+        # Whole invoice in one batch instead of SupplyItem.save() per row
+        items = formset.save(commit=False)
+        receive_supply_items(form.instance, items, formset.deleted_objects)
+
+# --- 4.1 Инвентаризация ---
+class StocktakeLineInline(admin.TabularInline):
+    model = StocktakeLine
+    extra = 5
+    fields = ('ingredient', 'counted', 'book_amount')
+    readonly_fields = ('book_amount',)
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
+@admin.register(Stocktake)
+class StocktakeAdmin(admin.ModelAdmin):
+    inlines = [StocktakeLineInline]
+    list_display = ('id', 'counted_at', 'store', 'note')
+    list_select_related = ('store',)
+    date_hierarchy = 'counted_at'
+    readonly_fields = ('variance',)
+    ordering = ('-counted_at',)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not StocktakeLine:
+            return super().save_formset(request, form, formset, change)
+        # Whole count sheet in one batch; the stock is set to the counted quantities
+        items = formset.save(commit=False)
+        save_stocktake_lines(form.instance, items, formset.deleted_objects)
+
+    @admin.display(description="Flagged variance")
+    def variance(self, obj):
+        if not obj.pk:
+            return "-"
+        rows = [row for row in stock_variance(obj) if row.flag]
+        if not rows:
+            return "Within tolerance (or no earlier stocktake). Full report: manage.py stock_variance"
+        return format_html(
+            '<table><tr><th>Ingredient</th><th>Expected</th><th>Counted</th><th>Variance</th><th>%</th><th>Cost</th></tr>{}</table>',
+            format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{} {}</td><td>{}</td><td>{}</td></tr>', (
+                (row.name, row.expected, row.counted, row.variance, row.unit, row.percent if row.percent is not None else '',
+                 format_money(row.cost, 0) if row.cost is not None else '')
+                for row in rows
+            )),
+        )
 
 # --- 5. Заказы ---
-class OrderItemInline(admin.TabularInline):
+class OrderItemInline(ChoicesCacheMixin, admin.TabularInline):
     model = OrderItem
     extra = 0
     # Чтобы не грузить список всех товаров, делаем поиск
-    raw_id_fields = ('menu_item',) 
+    autocomplete_fields = ('menu_item',)
+    # Модификаторов мало: один список на все строки заказа
+    cached_choice_fields = ('modifiers',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('menu_item').prefetch_related('modifiers')
+
+    def get_formset(self, request, obj=None, **kwargs):
+        # Names of the order's products in one query, for every row's autocomplete
+        cache = request.__dict__.setdefault('_menu_item_labels', {})
+        key = obj.pk if obj is not None else None
+        if key not in cache:
+            cache[key] = {
+                str(menu_item.pk): str(menu_item)
+                for menu_item in MenuItem.objects.filter(orderitem__order=obj).distinct()
+            } if obj is not None else {}
+        request._order_menu_items = cache[key]
+        return super().get_formset(request, obj, **kwargs)
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_dbfield(db_field, request, **kwargs)
+        labels = getattr(request, '_order_menu_items', None)
+        if db_field.name == 'menu_item' and formfield is not None and labels is not None:
+            wrapper, original = formfield.widget, formfield.widget.widget
+            wrapper.widget = PreloadedAutocompleteSelect(
+                db_field, self.admin_site, labels, attrs=original.attrs, choices=original.choices, using=original.db,
+            )
+            wrapper.widget.is_required = original.is_required
+        return formfield
+
+class OrderStatusEventInline(admin.TabularInline):
+    model = OrderStatusEvent
+    extra = 0
+    can_delete = False
+    readonly_fields = ('from_status', 'to_status', 'created_at')
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    inlines = [OrderItemInline]
-    list_display = ('id', 'created_at', 'status', 'is_completed', 'total_price')
-    readonly_fields = ('created_at',)
-    list_filter = ('status', 'is_completed', 'created_at')
+    inlines = [OrderItemInline, OrderStatusEventInline]
+    list_display = ('id', 'created_at', 'status', 'is_completed', money_column('total_price', 'Total'))
+    readonly_fields = ('created_at', 'is_completed', 'stock_written_off')
+    list_filter = ('status', 'is_completed')
+    # created_at is indexed; the hierarchy replaces the date filter
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('shift',)
+    # No second COUNT(*) over the whole table for "N total", and page numbers from an estimate
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ['complete_selected']
 
-    # Пытаемся сохранить логику списания при сохранении через Админку
+    @admin.action(description="Complete selected orders")
+    def complete_selected(self, request, queryset):
+        try:
+            completed = complete_orders(queryset.values_list('pk', flat=True))
+        except ValidationError as e:
+            messages.error(request, "; ".join(e.messages))
+            return
+        messages.success(request, f"Completed {len(completed)} orders")
+
+    # Статус в форме меняется через те же сервисы, что и у бариста (services.transition_orders):
+    # проверка переходов, история статусов, метрики, а "Completed" ещё и списывает склад
     def save_model(self, request, obj, form, change):
+        obj.status = form.initial.get('status', 'pending') if change else 'pending'
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        # После инлайнов: списание идёт по позициям заказа
+        super().save_related(request, form, formsets, change)
+        obj = form.instance
+        target = form.cleaned_data.get('status', obj.status)
+        if target == obj.status:
+            return
         try:
-            # Если поставили галочку "Выполнен" (Completed) и он еще не был списан
-            if obj.status == 'completed' and not obj.is_completed:
-                obj.finish_order() # Вызываем нашу функцию списания из models.py
-                messages.success(request, f"Заказ #{obj.id} успешно списан со склада!")
+            if target == 'completed':
+                complete_orders([obj.pk])
+                messages.success(request, f"Заказ #{obj.pk} выполнен и списан со склада!")
             else:
-                obj.save()
+                transition_orders([obj.pk], target)
         except ValidationError as e:
-            # Если на складе не хватает товара
-            messages.error(request, f"ОШИБКА СКЛАДА: {e.message}")
-            # Не даем сохранить статус completed
-            obj.status = 'pending' 
-            # (Но сам объект сохраняем, чтобы не потерять изменения)
-            super().save_model(request, obj, form, change)
\ No newline at end of file
+            messages.error(request, f"Статус не изменён: {'; '.join(e.messages)}")
+        obj.refresh_from_db(fields=['status', 'is_completed', 'stock_written_off'])
\ No newline at end of file
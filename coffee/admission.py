@@ -0,0 +1,272 @@
+import contextvars
+import math
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import CancelledError, Future, TimeoutError
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import JsonResponse
+
+from . import stock
+
+# Admission control for the write endpoints (order intake, status changes, shifts).
+#
+# SQLite has one writer. Under a rush every request thread used to open its own write
+# transaction and wait on the database lock, until "database is locked" or a gateway timeout.
+# Instead, write requests are queued and a single writer thread runs them, several per
+# transaction (group commit): each request in its own savepoint, one COMMIT (one fsync) for the
+# batch, with the stock changes of the whole batch coalesced per ingredient (coffee/stock.py).
+# The queue is bounded: when it is full the request is turned away at once with
+# 503 + Retry-After instead of joining the pile. Each client (user, session or address) also
+# has a token bucket, 429 + Retry-After when it is empty.
+#
+# Inside an open transaction (tests, management commands) the view runs inline: the writer
+# thread has its own connection and couldn't see, or would wait for, the caller's rows.
+#
+# When the COMMIT of a batch fails, every request of the batch is run again in a transaction of
+# its own, so a view may run twice. Everything a write view does outside the database (metrics,
+# caches, stamp files) therefore goes into transaction.on_commit(): it happens once, after the
+# COMMIT that made it true.
+
+DEFAULTS = {
+    'ADMISSION_CONTROL': True,
+    'ADMISSION_QUEUE': 64,
+    'ADMISSION_BATCH': 16,
+    'ADMISSION_TIMEOUT': 10,
+    'ADMISSION_RATE': 10,
+    'ADMISSION_BURST': 30,
+}
+MAX_CLIENTS = 1000
+EWMA_ALPHA = 0.2
+
+
+def option(name):
+    return getattr(settings, name, DEFAULTS[name])
+
+
+class Busy(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per client: `rate` requests per second, bursts up to `burst`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # client -> (tokens, updated_at), least recently seen first
+
+    def check(self, client):
+        """Seconds to wait before the next request is allowed, 0 if it may go now."""
+        rate, burst = option('ADMISSION_RATE'), option('ADMISSION_BURST')
+        if not rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[client] = (tokens - 1 if not wait else tokens, now)
+            while len(self._buckets) > MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionMetrics:
+    """Queue depth, batch sizes, waits and rejections since the process started."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = Counter()     # 'queue_full' / 'rate_limited' / 'timeout'
+        self.batches = Counter()      # batch size -> number of commits
+        self.max_depth = 0
+        self.commit_ms = None         # EWMA of one batch transaction
+        self.wait_ms = None           # EWMA of queueing time before the writer picked a request up
+        self.retried = 0
+
+    @staticmethod
+    def _ewma(old, new):
+        return new if old is None else old + EWMA_ALPHA * (new - old)
+
+    def queued(self, depth):
+        with self._lock:
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, depth)
+
+    def rejected_one(self, reason):
+        with self._lock:
+            self.rejected[reason] += 1
+
+    def committed(self, size, commit_ms, wait_ms):
+        with self._lock:
+            self.batches[size] += 1
+            self.commit_ms = self._ewma(self.commit_ms, commit_ms)
+            self.wait_ms = self._ewma(self.wait_ms, wait_ms)
+
+    def snapshot(self, depth):
+        with self._lock:
+            commits = sum(self.batches.values())
+            requests = sum(size * count for size, count in self.batches.items())
+            return {
+                'queue_depth': depth,
+                'queue_limit': option('ADMISSION_QUEUE'),
+                'max_depth': self.max_depth,
+                'accepted': self.accepted,
+                'rejected': dict(self.rejected),
+                'commits': commits,
+                'avg_batch': round(requests / commits, 2) if commits else None,
+                'batch_sizes': {str(size): count for size, count in sorted(self.batches.items())},
+                'commit_ms': None if self.commit_ms is None else round(self.commit_ms, 1),
+                'queue_wait_ms': None if self.wait_ms is None else round(self.wait_ms, 1),
+                'batches_retried': self.retried,
+            }
+
+
+class WriteQueue:
+    """Bounded queue of write requests drained by one writer thread in group-committed batches."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self.metrics = AdmissionMetrics()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._queue = queue.Queue(maxsize=option('ADMISSION_QUEUE'))
+                self._thread = threading.Thread(target=self._run, name='coffee-writer', daemon=True)
+                self._thread.start()
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self):
+        """Seconds until the queue has likely drained, for the Retry-After header."""
+        per_batch = (self.metrics.commit_ms or 50) / 1000
+        batches = self.depth() / max(1, option('ADMISSION_BATCH'))
+        return max(1, math.ceil(batches * per_batch))
+
+    def submit(self, func):
+        self._ensure_started()
+        future = Future()
+        # The view runs in the writer thread but must see the request's context (store, replica routing)
+        job = (contextvars.copy_context(), func, future, time.monotonic())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.metrics.rejected_one('queue_full')
+            raise Busy(self.retry_after())
+        self.metrics.queued(self.depth())
+        return future
+
+    def call(self, func):
+        """Runs func() in the writer and returns its result; Busy if it can't be admitted in time."""
+        future = self.submit(func)
+        try:
+            return future.result(timeout=option('ADMISSION_TIMEOUT'))
+        except TimeoutError:
+            # Only a request still waiting in the queue can be withdrawn; a running one is seen through
+            if future.cancel():
+                self.metrics.rejected_one('timeout')
+                raise Busy(self.retry_after())
+            return future.result()
+
+    # --- writer thread ---
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            limit = option('ADMISSION_BATCH')
+            while len(batch) < limit:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+            if batch:
+                self._commit(batch)
+            connection.close_if_unusable_or_obsolete()
+
+    def _commit(self, batch):
+        started = time.monotonic()
+        wait_ms = sum((started - queued_at) * 1000 for *_, queued_at in batch) / len(batch)
+        results = []
+        committed = []
+        try:
+            # stock.batch(): the batch's stock deltas are summed per ingredient and written just before COMMIT
+            with transaction.atomic(), stock.batch():
+                # Runs first among the on_commit callbacks: tells a failed COMMIT from a failing callback
+                transaction.on_commit(lambda: committed.append(True))
+                for context, func, future, _ in batch:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, context.run(func), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            if not committed:
+                if len(batch) > 1:
+                    # The COMMIT itself failed (e.g. the database stayed locked): nothing was
+                    # written, so each request gets its own attempt instead of sharing the failure
+                    self.metrics.retried += 1
+                    for job in batch:
+                        self._commit([job])
+                    return
+                results = [(batch[0][2], None, e)]
+        self.metrics.committed(len(batch), (time.monotonic() - started) * 1000, wait_ms)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+writer = WriteQueue()
+limiter = RateLimiter()
+
+
+def client_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f"session:{session.session_key}"
+    return f"addr:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def busy_response(message, status, retry_after):
+    response = JsonResponse({'success': False, 'error': message, 'retry_after': retry_after}, status=status)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def write_view(view):
+    """Puts a writing view behind the rate limiter and the group-commit writer."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST' or not option('ADMISSION_CONTROL') or connection.in_atomic_block:
+            return view(request, *args, **kwargs)
+
+        wait = limiter.check(client_key(request))
+        if wait:
+            writer.metrics.rejected_one('rate_limited')
+            return busy_response('Too many requests from this till, slow down', 429, max(1, math.ceil(wait)))
+        try:
+            return writer.call(lambda: view(request, *args, **kwargs))
+        except Busy as e:
+            return busy_response('Server is busy, try again', 503, e.retry_after)
+        except CancelledError:
+            return busy_response('Server is busy, try again', 503, writer.retry_after())
+
+    return wrapper
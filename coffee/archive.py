@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import re
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import hq
+from .money import to_minor
+
+# Cold storage for old orders.
+# Each order is one zlib-compressed JSON frame appended to a segment file;
+# ArchivedOrder keeps (segment, offset, length), so a single order can be read back
+# without touching the rest. DailySalesRollup keeps what analytics needs.
+# Frames carry amounts as int tiyn ('money': 'minor'); older frames hold Decimal tenge strings.
+
+
+def archive_dir():
+    return Path(getattr(settings, 'ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def parse_age(value):
+    """'90d', '12w' or a plain number of days."""
+    match = re.fullmatch(r'\s*(\d+)\s*([dw]?)\s*', str(value))
+    if not match:
+        raise ValidationError(f"Can't parse age '{value}', use e.g. 90d or 12w")
+    number, unit = int(match.group(1)), match.group(2) or 'd'
+    return timedelta(weeks=number) if unit == 'w' else timedelta(days=number)
+
+
+def archivable_orders(older_than):
+    from .models import Order
+
+    cutoff = timezone.now() - older_than
+    return Order.objects.filter(
+        created_at__lt=cutoff, status='completed'
+    ).exclude(shift__is_active=True).order_by('id')
+
+
+def _serialize(order_ids):
+    from .models import Order, OrderItem, OrderStatusEvent
+
+    orders = {
+        row['id']: dict(row, money='minor', items=[], status_events=[])
+        for row in Order.objects.filter(pk__in=order_ids).values(
+            'id', 'created_at', 'status', 'is_completed', 'stock_written_off', 'total_price', 'shift_id',
+            'ticket_number',
+        )
+    }
+    items = {}
+    for row in OrderItem.objects.filter(order_id__in=order_ids).values(
+        'id', 'order_id', 'menu_item_id', 'menu_item__name', 'quantity', 'size', 'price', 'cogs'
+    ):
+        row['modifiers'] = []
+        items[row['id']] = row
+        orders[row['order_id']]['items'].append(row)
+    for item_id, modifier_id in OrderItem.modifiers.through.objects.filter(
+        orderitem_id__in=items
+    ).values_list('orderitem_id', 'modifier_id'):
+        items[item_id]['modifiers'].append(modifier_id)
+    for row in OrderStatusEvent.objects.filter(order_id__in=order_ids).values(
+        'order_id', 'from_status', 'to_status', 'created_at'
+    ):
+        orders[row.pop('order_id')]['status_events'].append(row)
+    return orders
+
+
+def _encode(order):
+    return zlib.compress(json.dumps(order, default=str, separators=(',', ':')).encode(), 6)
+
+
+def archive_orders(older_than, batch_size=1000, log=None):
+    """
+    Moves old completed orders of closed shifts into a new segment file.
+    Per batch: frames are appended and fsync'ed first, then index rows, rollups and
+    the deletion of live rows commit together. A crash in between leaves only unused
+    bytes in the segment, never a lost order. Returns the number of archived orders.
+    """
+    from .models import ArchiveSegment, ArchivedOrder, DailySalesRollup, Order
+
+    ids = list(archivable_orders(older_than).values_list('id', flat=True))
+    if not ids:
+        return 0
+
+    root = archive_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    # The random part keeps two runs in the same second (a quick retry) apart
+    name = f"orders-{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.seg"
+    segment = ArchiveSegment.objects.create(path=name)
+    path = root / name
+
+    archived = 0
+    with path.open('xb') as f:
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            orders = _serialize(batch)
+
+            index, rollups = [], defaultdict(lambda: [None, 0, 0, 0])
+            offset = f.tell()
+            for order_id in batch:
+                order = orders[order_id]
+                frame = _encode(order)
+                f.write(frame)
+                index.append(ArchivedOrder(
+                    order_id=order_id, segment=segment, offset=offset, length=len(frame),
+                    created_at=order['created_at'], shift_id=order['shift_id'],
+                    total_price=order['total_price'],
+                ))
+                offset += len(frame)
+
+                day = timezone.localtime(order['created_at']).date()
+                for item in order['items']:
+                    rollup = rollups[(day, item['menu_item__name'])]
+                    rollup[0] = item['menu_item_id']
+                    rollup[1] += item['quantity']
+                    rollup[2] += item['price'] or 0
+                    rollup[3] += item['cogs'] or 0
+            f.flush()
+            os.fsync(f.fileno())
+
+            with transaction.atomic():
+                ArchivedOrder.objects.bulk_create(index)
+                _add_rollups(rollups)
+                Order.objects.filter(pk__in=batch).delete()
+                ArchiveSegment.objects.filter(pk=segment.pk).update(
+                    order_count=F('order_count') + len(batch), size_bytes=offset
+                )
+            archived += len(batch)
+            if log:
+                log(f"{archived}/{len(ids)} orders archived")
+
+    segment.refresh_from_db()
+    segment.sha256 = hashlib.sha256(path.read_bytes()).hexdigest()
+    segment.save(update_fields=['sha256'])
+    return archived
+
+
+def _add_rollups(rollups, sign=1):
+    from .models import DailySalesRollup
+
+    existing = {
+        (r.date, r.menu_item_name): r
+        for r in DailySalesRollup.objects.filter(
+            date__in={day for day, _ in rollups}, menu_item_name__in={n for _, n in rollups}
+        )
+    }
+    new = []
+    for (day, name), (menu_item_id, quantity, revenue, cogs) in rollups.items():
+        row = existing.get((day, name))
+        if row is None:
+            new.append(DailySalesRollup(
+                date=day, menu_item_id=menu_item_id, menu_item_name=name,
+                quantity=sign * quantity, revenue=sign * revenue, cogs=sign * cogs,
+            ))
+        else:
+            row.quantity += sign * quantity
+            row.revenue += sign * revenue
+            row.cogs += sign * cogs
+    DailySalesRollup.objects.bulk_create(new)
+    DailySalesRollup.objects.bulk_update(existing.values(), ['quantity', 'revenue', 'cogs'])
+
+
+def load_archived_order(order_id):
+    """Reads one order back from cold storage (one seek + one small read)."""
+    from .models import ArchivedOrder
+
+    entry = ArchivedOrder.objects.select_related('segment').filter(pk=order_id).first()
+    if not entry:
+        return None
+    with (archive_dir() / entry.segment.path).open('rb') as f:
+        f.seek(entry.offset)
+        return _in_minor_units(json.loads(zlib.decompress(f.read(entry.length))))
+
+
+def _in_minor_units(data):
+    if data.get('money') == 'minor':
+        return data
+    data['money'] = 'minor'
+    data['total_price'] = to_minor(data['total_price'])
+    for item in data['items']:
+        item['price'] = to_minor(item['price'])
+        item['cogs'] = to_minor(item['cogs'])
+    return data
+
+
+def verify_segment(segment):
+    path = archive_dir() / segment.path
+    return path.exists() and hashlib.sha256(path.read_bytes()).hexdigest() == segment.sha256
+
+
+@transaction.atomic
+def restore_order(order_id):
+    """Puts an archived order back into the live tables (e.g. for an audit or a refund)."""
+    from .models import ArchivedOrder, Order, OrderItem, OrderStatusEvent, Shift
+
+    data = load_archived_order(order_id)
+    if data is None:
+        raise ValidationError(f"Order #{order_id} is not in the archive")
+
+    shift_id = data['shift_id'] if Shift.objects.filter(pk=data['shift_id']).exists() else None
+    order = Order(
+        pk=data['id'], status=data['status'], is_completed=data['is_completed'],
+        # Segments written before the flag existed: their orders had their stock taken
+        stock_written_off=data.get('stock_written_off', True),
+        total_price=data['total_price'], shift_id=shift_id, ticket_number=data['ticket_number'],
+    )
+    order.save(force_insert=True)
+    # auto_now_add ignores the value we pass, put the original time back
+    Order.objects.filter(pk=order.pk).update(created_at=parse_datetime(data['created_at']))
+    # Its id is below the HQ sync watermark
+    hq.record_changes('orders', [order.pk])
+
+    rollups = defaultdict(lambda: [None, 0, 0, 0])
+    day = timezone.localtime(parse_datetime(data['created_at'])).date()
+    for item in data['items']:
+        order_item = OrderItem.objects.create(
+            pk=item['id'], order=order, menu_item_id=item['menu_item_id'], quantity=item['quantity'],
+            size=item['size'], price=item['price'], cogs=item['cogs'],
+        )
+        order_item.modifiers.set(item['modifiers'])
+        rollup = rollups[(day, item['menu_item__name'])]
+        rollup[0] = item['menu_item_id']
+        rollup[1] += item['quantity']
+        rollup[2] += item['price']
+        rollup[3] += item['cogs'] or 0
+    OrderStatusEvent.objects.bulk_create([
+        OrderStatusEvent(order=order, from_status=e['from_status'], to_status=e['to_status'],
+                         created_at=parse_datetime(e['created_at']))
+        for e in data['status_events']
+    ])
+
+    # The order is live again: take it out of the rollups so analytics doesn't count it twice
+    _add_rollups(rollups, sign=-1)
+    ArchivedOrder.objects.filter(pk=order_id).delete()
+    return order
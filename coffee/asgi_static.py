@@ -0,0 +1,110 @@
+import asyncio
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+# Serves collectstatic output straight from the ASGI layer, before Django is involved.
+# Fingerprinted files (name.<12 hex>.ext) never change, so browsers may keep them for a year;
+# anything else is revalidated with an ETag. Precompressed .br/.gz variants written by
+# coffee.staticstorage are picked by Accept-Encoding, nothing is compressed per request.
+
+FINGERPRINT = re.compile(r'\.[0-9a-f]{12}\.')
+IMMUTABLE = b'public, max-age=31536000, immutable'
+REVALIDATE = b'public, max-age=0, must-revalidate'
+CHUNK = 256 * 1024
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _accepts(scope):
+    for key, value in scope.get('headers', []):
+        if key == b'accept-encoding':
+            return value.decode('latin-1')
+    return ''
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value
+    return None
+
+
+class StaticFilesApp:
+    """ASGI wrapper: GET/HEAD under STATIC_URL come from STATIC_ROOT, everything else goes to `app`."""
+
+    def __init__(self, app, root=None, prefix=None):
+        self.app = app
+        root = root or getattr(settings, 'STATIC_ROOT', None)
+        self.root = Path(root).resolve() if root else None
+        self.prefix = prefix or '/' + settings.STATIC_URL.lstrip('/')
+
+    def _find(self, relative, accept_encoding):
+        if self.root is None:
+            return None
+        path = (self.root / relative).resolve()
+        if not path.is_relative_to(self.root) or not path.is_file():
+            return None
+
+        encoding = None
+        served = path
+        for name, suffix in ENCODINGS:
+            if name in accept_encoding:
+                variant = path.with_name(path.name + suffix)
+                if variant.is_file():
+                    encoding, served = name, variant
+                    break
+        return path, served, encoding
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http'
+            or scope['method'] not in ('GET', 'HEAD')
+            or not scope['path'].startswith(self.prefix)
+        ):
+            return await self.app(scope, receive, send)
+
+        found = self._find(scope['path'][len(self.prefix):], _accepts(scope))
+        if found is None:
+            # Not collected (e.g. runserver with DEBUG): let Django's own handling decide
+            return await self.app(scope, receive, send)
+        original, served, encoding = found
+
+        stat = os.stat(served)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'.encode()
+        content_type = mimetypes.guess_type(original.name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        headers = [
+            (b'content-type', content_type.encode()),
+            (b'cache-control', IMMUTABLE if FINGERPRINT.search(original.name) else REVALIDATE),
+            (b'etag', etag),
+            (b'vary', b'Accept-Encoding'),
+        ]
+        if encoding:
+            headers.append((b'content-encoding', encoding.encode()))
+
+        if _header(scope, b'if-none-match') == etag:
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        headers.append((b'content-length', str(stat.st_size).encode()))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        with open(served, 'rb') as f:
+            if 'http.response.zerocopysend' in scope.get('extensions', {}):
+                # The server hands the file descriptor to sendfile(), no copy through Python
+                await send({'type': 'http.response.zerocopysend', 'file': f, 'more_body': False})
+                return
+            while True:
+                chunk = await asyncio.to_thread(f.read, CHUNK)
+                more = len(chunk) == CHUNK
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+                if not more:
+                    break
@@ -0,0 +1,190 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.utils import timezone
+
+from .replica import primary_path, snapshot
+
+# Online backups of the primary database.
+# The SQLite backup API copies BACKUP_STEP_PAGES pages at a time and sleeps BACKUP_PAUSE
+# between steps, so tills can commit while a backup runs. The raw copy is checked with
+# PRAGMA quick_check, gzipped, and gets a sha256 sidecar (same format as `sha256sum`).
+
+PREFIX = 'coffee-'
+SUFFIX = '.sqlite3.gz'
+# After this many restarts (the primary changed mid-copy) take the rest in one step
+MAX_RESTARTS = 5
+
+
+class _Restarted(Exception):
+    pass
+
+
+def backup_dir():
+    return Path(getattr(settings, 'BACKUP_DIR', settings.BASE_DIR / 'backups'))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _check(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _copy(target, pages, pause):
+    """Stepped copy; returns (steps, restarts). Falls back to one step if writers keep restarting it."""
+    state = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] >= MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+
+    try:
+        snapshot(str(primary_path()), str(target), pages=pages, pause=pause, progress=progress)
+    except _Restarted:
+        snapshot(str(primary_path()), str(target))
+        state['steps'] += 1
+    return state['steps'], state['restarts']
+
+
+def create_backup(pages=None, pause=None):
+    """Writes a new compressed snapshot and rotates old ones. Returns a dict with stats."""
+    pages = pages or getattr(settings, 'BACKUP_STEP_PAGES', 256)
+    pause = getattr(settings, 'BACKUP_PAUSE', 0.005) if pause is None else pause
+    root = backup_dir()
+    root.mkdir(parents=True, exist_ok=True)
+
+    started = time.perf_counter()
+    # Microseconds: backups taken in the same second get their own file and still sort by time
+    name = f"{PREFIX}{timezone.now():%Y%m%d-%H%M%S-%f}{SUFFIX}"
+    target = root / name
+    raw = root / f".{name}.{os.getpid()}.raw"
+    partial = root / f".{name}.{os.getpid()}.part"
+    try:
+        steps, restarts = _copy(raw, pages, pause)
+        copied_at = time.perf_counter()
+
+        result = _check(raw)
+        if result != 'ok':
+            raise ValidationError(f"Backup copy failed quick_check: {result}")
+        with open(raw, 'rb') as src, gzip.open(partial, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        raw_size = raw.stat().st_size
+        # link() refuses an existing target: a backup is never overwritten
+        try:
+            os.link(partial, target)
+        except FileExistsError:
+            raise ValidationError(f"Backup {name} already exists")
+    finally:
+        for leftover in (raw, partial):
+            if leftover.exists():
+                leftover.unlink()
+
+    digest = _sha256(target)
+    Path(f"{target}.sha256").write_text(f"{digest}  {name}\n")
+    removed = rotate()
+    return {
+        'path': target,
+        'sha256': digest,
+        'size': target.stat().st_size,
+        'raw_size': raw_size,
+        'steps': steps,
+        'restarts': restarts,
+        'copy_ms': (copied_at - started) * 1000,
+        'total_ms': (time.perf_counter() - started) * 1000,
+        'removed': removed,
+    }
+
+
+def list_backups():
+    root = backup_dir()
+    if not root.exists():
+        return []
+    return sorted(root.glob(f"{PREFIX}*{SUFFIX}"), reverse=True)
+
+
+def rotate(keep=None):
+    keep = keep or getattr(settings, 'BACKUP_KEEP', 14)
+    removed = []
+    for path in list_backups()[keep:]:
+        path.unlink()
+        Path(f"{path}.sha256").unlink(missing_ok=True)
+        removed.append(path.name)
+    return removed
+
+
+def resolve(name=None):
+    """Backup by file name or path; the newest one if no name is given."""
+    if not name:
+        backups = list_backups()
+        if not backups:
+            raise ValidationError("No backups found")
+        return backups[0]
+    path = Path(name)
+    if not path.exists():
+        path = backup_dir() / name
+    if not path.exists():
+        raise ValidationError(f"Backup '{name}' not found")
+    return path
+
+
+def _unpack(path):
+    fd, raw = tempfile.mkstemp(suffix='.sqlite3', prefix='coffee-restore-')
+    with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    return raw
+
+
+def verify_backup(path):
+    """Checksum against the sidecar, then an integrity check of the unpacked database."""
+    sidecar = Path(f"{path}.sha256")
+    if not sidecar.exists():
+        raise ValidationError(f"{path.name}: checksum file is missing")
+    expected = sidecar.read_text().split()[0]
+    if _sha256(path) != expected:
+        raise ValidationError(f"{path.name}: checksum mismatch")
+
+    raw = _unpack(path)
+    try:
+        result = _check(raw)
+    finally:
+        os.unlink(raw)
+    if result != 'ok':
+        raise ValidationError(f"{path.name}: integrity check failed: {result}")
+
+
+def restore_backup(path):
+    """
+    Verifies the backup and copies it over the primary through the backup API,
+    so connections that stay open see the restored data instead of a replaced file.
+    Stop the tills first: the copy holds an exclusive lock on the primary.
+    """
+    verify_backup(path)
+    raw = _unpack(path)
+    try:
+        connections['default'].close()
+        snapshot(raw, str(primary_path()))
+    finally:
+        os.unlink(raw)
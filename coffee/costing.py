@@ -0,0 +1,200 @@
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .money import to_minor
+from .rules import item_modifiers, rules
+
+
+def costing_method():
+    # 'fifo' (default) or 'average' (weighted average cost)
+    return getattr(settings, 'COGS_METHOD', 'fifo')
+
+
+class LayerQueue:
+    """Purchase lots of one ingredient, oldest first."""
+
+    def __init__(self, method):
+        self.method = method
+        self.layers = deque()
+        self.total_qty = Decimal(0)
+        self.total_value = Decimal(0)
+        self.last_cost = Decimal(0)
+        self.touched = []
+
+    def add(self, layer):
+        self.layers.append(layer)
+        self.total_qty += layer.remaining
+        self.total_value += layer.remaining * layer.unit_cost
+        self.last_cost = layer.unit_cost
+
+    def consume(self, qty):
+        if qty <= 0:
+            return Decimal(0)
+
+        average = self.total_value / self.total_qty if self.total_qty > 0 else self.last_cost
+        fifo_cost = Decimal(0)
+        left = qty
+        while left > 0 and self.layers:
+            layer = self.layers[0]
+            take = min(layer.remaining, left)
+            fifo_cost += take * layer.unit_cost
+            layer.remaining -= take
+            left -= take
+            self.touched.append(layer)
+            if layer.remaining <= 0:
+                self.layers.popleft()
+        # Stock went below zero on paper: cost the shortfall at the latest purchase price
+        fifo_cost += left * self.last_cost
+
+        cost = qty * average if self.method == 'average' else fifo_cost
+        self.total_qty = max(self.total_qty - qty, Decimal(0))
+        self.total_value = max(self.total_value - cost, Decimal(0)) if self.total_qty else Decimal(0)
+        return cost
+
+
+def layer_from_supply_item(item, received_at):
+    unit_cost = (item.cost / item.quantity) if item.cost and item.quantity else (item.unit_price or Decimal(0))
+    from .models import CostLayer
+
+    return CostLayer(
+        ingredient_id=item.ingredient_id,
+        supply_item_id=item.pk,
+        received_at=received_at,
+        quantity=item.quantity,
+        remaining=item.quantity,
+        unit_cost=unit_cost,
+    )
+
+
+def sync_supply_layers(supply, items, deleted=()):
+    """Keeps one CostLayer per SupplyItem after supply lines were created, edited or deleted."""
+    from .models import CostLayer
+
+    deleted_ids = [item.pk for item in deleted if item.pk]
+    if deleted_ids:
+        CostLayer.objects.filter(supply_item_id__in=deleted_ids).delete()
+
+    items = [item for item in items if item.pk]
+    existing = {
+        layer.supply_item_id: layer
+        for layer in CostLayer.objects.filter(supply_item_id__in=[item.pk for item in items])
+    }
+    new_layers, changed = [], []
+    for item in items:
+        fresh = layer_from_supply_item(item, supply.created_at)
+        layer = existing.get(item.pk)
+        if layer is None:
+            new_layers.append(fresh)
+            continue
+        # Keep what was already consumed, move the rest with the new quantity
+        layer.remaining = max(layer.remaining + (fresh.quantity - layer.quantity), Decimal(0))
+        layer.ingredient_id = fresh.ingredient_id
+        layer.quantity = fresh.quantity
+        layer.unit_cost = fresh.unit_cost
+        changed.append(layer)
+    CostLayer.objects.bulk_create(new_layers)
+    CostLayer.objects.bulk_update(changed, ['ingredient', 'quantity', 'remaining', 'unit_cost'])
+
+
+def assign_cogs(order_items, modifiers=None):
+    """
+    Live path: consumes open cost layers for freshly created order lines and stores OrderItem.cogs.
+    A handful of queries per order, independent of history size.
+    `modifiers` ({order_item_id: [modifier_id]}) saves the lookup when the caller already has them.
+    """
+    from .models import CostLayer, OrderItem
+
+    order_items = [item for item in order_items if item.pk]
+    if not order_items:
+        return
+
+    book = rules.current()
+    if modifiers is None:
+        modifiers = item_modifiers([item.pk for item in order_items])
+    usage = {
+        item.pk: book.consumption(item.menu_item_id, item.size, modifiers.get(item.pk, ()), item.quantity)
+        for item in order_items
+    }
+    ingredient_ids = {ing for used in usage.values() for ing in used}
+
+    method = costing_method()
+    queues = defaultdict(lambda: LayerQueue(method))
+    for layer in CostLayer.objects.filter(ingredient_id__in=ingredient_ids, remaining__gt=0):
+        queues[layer.ingredient_id].add(layer)
+    for ingredient_id in ingredient_ids - set(queues):
+        # Nothing left in stock: fall back to the latest known purchase price
+        latest = CostLayer.objects.filter(ingredient_id=ingredient_id).order_by('-received_at', '-id').first()
+        if latest:
+            queues[ingredient_id].last_cost = latest.unit_cost
+
+    for item in order_items:
+        cost = sum((queues[ing].consume(qty) for ing, qty in usage[item.pk].items()), Decimal(0))
+        # Layers are costed in Decimal tenge (purchase prices); the stored COGS is int tiyn
+        item.cogs = to_minor(cost)
+
+    with transaction.atomic():
+        OrderItem.objects.bulk_update(order_items, ['cogs'])
+        touched = {id(layer): layer for queue in queues.values() for layer in queue.touched}
+        CostLayer.objects.bulk_update(touched.values(), ['remaining'])
+
+
+def recompute_all(chunk_size=2000, log=None):
+    """
+    Rebuilds every OrderItem.cogs and the CostLayer table from scratch in one streaming pass:
+    supplies and order lines are merged by time, layers live in in-memory queues,
+    order lines are read with .iterator() and written back in chunks.
+    Returns the number of order lines processed.
+    """
+    from .models import CostLayer, OrderItem, SupplyItem
+
+    method = costing_method()
+    book = rules.current()
+
+    lots = [
+        layer_from_supply_item(item, item.supply.created_at)
+        for item in SupplyItem.objects.select_related('supply').order_by('supply__created_at', 'id')
+    ]
+    all_layers = list(lots)
+    lots = deque(lots)
+    queues = defaultdict(lambda: LayerQueue(method))
+
+    processed = 0
+    chunk = []
+
+    def flush(rows):
+        modifiers = item_modifiers([row[0] for row in rows])
+        updated = []
+        for pk, created_at, menu_item_id, size, quantity in rows:
+            while lots and lots[0].received_at <= created_at:
+                lot = lots.popleft()
+                queues[lot.ingredient_id].add(lot)
+            used = book.consumption(menu_item_id, size, modifiers[pk], quantity)
+            cost = sum((queues[ing].consume(qty) for ing, qty in used.items()), Decimal(0))
+            updated.append(OrderItem(pk=pk, cogs=to_minor(cost)))
+        OrderItem.objects.bulk_update(updated, ['cogs'], batch_size=500)
+        for queue in queues.values():
+            queue.touched.clear()
+
+    with transaction.atomic():
+        rows = OrderItem.objects.order_by('order__created_at', 'id').values_list(
+            'id', 'order__created_at', 'menu_item_id', 'size', 'quantity'
+        ).iterator(chunk_size=chunk_size)
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                processed += len(chunk)
+                chunk = []
+                if log:
+                    log(f"{processed} order lines costed")
+        if chunk:
+            flush(chunk)
+            processed += len(chunk)
+
+        CostLayer.objects.all().delete()
+        CostLayer.objects.bulk_create(all_layers, batch_size=500)
+
+    return processed
@@ -0,0 +1,254 @@
+import json
+import os
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import stores
+from .money import to_minor
+
+# Store -> HQ change feed.
+# Each store keeps a watermark per feed (SyncCursor.last_id) and ships everything above it
+# as one zlib-compressed JSON delta. HQ applies a delta in one transaction with upserts keyed
+# by (store_code, source_id), so a delta applied twice changes nothing; the store moves its
+# watermarks only after HQ (or the outbox file) has the delta.
+# Id watermarks are safe here because SQLite serializes writers: ids become visible in order.
+# They miss rows that change below the watermark: an order restored from the archive keeps its
+# old id, a supply line can be edited or deleted after it was shipped. Those are queued with
+# record_changes() (SyncChange, its own 'changes' watermark) and sent again: the current row,
+# or its deletion for supply lines. Orders are never deleted at HQ (archiving keeps them there).
+# Order amounts travel as int tiyn ('money': 'minor'); outbox files from before that hold tenge.
+
+FEEDS = ('orders', 'status', 'supplies', 'changes')
+ORDER_FIELDS = ('id', 'created_at', 'status', 'total_price', 'shift_id', 'ticket_number')
+SUPPLY_FIELDS = ('id', 'supply__created_at', 'ingredient__name', 'quantity', 'cost')
+STATUS_RANK = {'pending': 0, 'preparing': 1, 'ready': 2, 'completed': 3}
+
+
+def record_changes(feed, ids):
+    """Queues rows of `feed` ('orders' or 'supplies') to be sent again by the next sync."""
+    from .models import SyncChange
+
+    SyncChange.objects.bulk_create([SyncChange(feed=feed, source_id=pk) for pk in ids])
+
+
+def build_delta(batch_size=500):
+    """Next batch of changes of the current store (see stores.using)."""
+    from .models import Ingredient, Order, OrderItem, OrderStatusEvent, SupplyItem, SyncChange, SyncCursor
+
+    cursors = dict(SyncCursor.objects.values_list('feed', 'last_id'))
+    orders = list(Order.objects.filter(pk__gt=cursors.get('orders', 0)).order_by('pk').values(
+        *ORDER_FIELDS
+    )[:batch_size])
+    status = list(OrderStatusEvent.objects.filter(pk__gt=cursors.get('status', 0)).order_by('pk').values(
+        'id', 'order_id', 'to_status'
+    )[:batch_size])
+    supplies = list(SupplyItem.objects.filter(pk__gt=cursors.get('supplies', 0)).order_by('pk').values(
+        *SUPPLY_FIELDS
+    )[:batch_size])
+    changes = list(SyncChange.objects.filter(pk__gt=cursors.get('changes', 0)).order_by('pk').values(
+        'id', 'feed', 'source_id'
+    )[:batch_size])
+
+    new_cursors = {}
+    for feed, rows in (('orders', orders), ('status', status), ('supplies', supplies), ('changes', changes)):
+        if rows:
+            new_cursors[feed] = rows[-1]['id']
+
+    # Changed rows ride along with the new ones; HQ upserts both the same way
+    resend = {'orders': set(), 'supplies': set()}
+    for change in changes:
+        resend[change['feed']].add(change['source_id'])
+    orders += Order.objects.filter(pk__in=resend['orders'] - {o['id'] for o in orders}).values(*ORDER_FIELDS)
+    supplies += SupplyItem.objects.filter(
+        pk__in=resend['supplies'] - {row['id'] for row in supplies}
+    ).values(*SUPPLY_FIELDS)
+    supplies_deleted = sorted(resend['supplies'] - {row['id'] for row in supplies})
+
+    lines = list(OrderItem.objects.filter(order_id__in=[o['id'] for o in orders]).values(
+        'order_id', 'menu_item__name', 'quantity', 'size', 'price', 'cogs'
+    ))
+    # Stock levels are a handful of rows: always send them whole
+    stock = list(Ingredient.objects.values('id', 'name', 'unit', 'amount'))
+
+    return {
+        'store': stores.current_code(),
+        'money': 'minor',
+        'built_at': timezone.now(),
+        'orders': orders,
+        'lines': lines,
+        'status': status,
+        'supplies': supplies,
+        'supplies_deleted': supplies_deleted,
+        'changes': changes,
+        'stock': stock,
+        'cursors': new_cursors,
+    }
+
+
+def encode(delta):
+    return zlib.compress(json.dumps(delta, default=str, separators=(',', ':')).encode(), 6)
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def apply_delta(delta):
+    """HQ side. Idempotent: replaying a delta leaves the HQ tables unchanged."""
+    from .models import HQOrder, HQOrderLine, HQStockLevel, HQSupplyLine
+
+    db = stores.hq_alias()
+    code = delta['store']
+    built_at = parse_datetime(delta['built_at']) if isinstance(delta['built_at'], str) else delta['built_at']
+    amount = (lambda value: value) if delta.get('money') == 'minor' else to_minor
+
+    with transaction.atomic(using=db):
+        # Orders carry their status at build time; upsert them first
+        existing = {
+            o.source_id: o
+            for o in HQOrder.objects.using(db).filter(
+                store_code=code, source_id__in=[row['id'] for row in delta['orders']]
+            )
+        }
+        new, changed = [], []
+        for row in delta['orders']:
+            fields = dict(
+                created_at=row['created_at'], status=row['status'], total_price=amount(row['total_price']),
+                shift_id=row['shift_id'], ticket_number=row['ticket_number'],
+            )
+            order = existing.get(row['id'])
+            if order is None:
+                new.append(HQOrder(store_code=code, source_id=row['id'], **fields))
+            else:
+                for name, value in fields.items():
+                    setattr(order, name, value)
+                changed.append(order)
+        HQOrder.objects.using(db).bulk_create(new)
+        HQOrder.objects.using(db).bulk_update(
+            changed, ['created_at', 'status', 'total_price', 'shift_id', 'ticket_number']
+        )
+
+        # Order lines never change after creation, but a replay must not duplicate them
+        by_source = {o.source_id: o for o in new + changed}
+        HQOrderLine.objects.using(db).filter(order__in=changed).delete()
+        HQOrderLine.objects.using(db).bulk_create([
+            HQOrderLine(
+                order=by_source[line['order_id']], menu_item_name=line['menu_item__name'] or '',
+                quantity=line['quantity'], size=line['size'], price=amount(line['price']),
+                cogs=amount(line['cogs']),
+            )
+            for line in delta['lines']
+        ])
+
+        # Status events only ever move an order forward, so an old event can't undo a newer snapshot
+        latest = {}
+        for event in delta['status']:
+            latest[event['order_id']] = event['to_status']
+        by_status = {}
+        for order_id, status in latest.items():
+            by_status.setdefault(status, []).append(order_id)
+        for status, order_ids in by_status.items():
+            behind = [s for s, rank in STATUS_RANK.items() if rank < STATUS_RANK[status]]
+            HQOrder.objects.using(db).filter(
+                store_code=code, source_id__in=order_ids, status__in=behind
+            ).update(status=status)
+
+        # Supply lines can be edited or deleted in the store after they were shipped
+        HQSupplyLine.objects.using(db).bulk_create([
+            HQSupplyLine(
+                store_code=code, source_id=row['id'], received_at=row['supply__created_at'],
+                ingredient_name=row['ingredient__name'], quantity=Decimal(row['quantity']),
+                cost=Decimal(row['cost']) if row['cost'] is not None else None,
+            )
+            for row in delta['supplies']
+        ], update_conflicts=True, unique_fields=['store_code', 'source_id'],
+            update_fields=['received_at', 'ingredient_name', 'quantity', 'cost'])
+        HQSupplyLine.objects.using(db).filter(
+            store_code=code, source_id__in=delta.get('supplies_deleted', [])
+        ).delete()
+
+        HQStockLevel.objects.using(db).bulk_create([
+            HQStockLevel(
+                store_code=code, source_id=row['id'], ingredient_name=row['name'], unit=row['unit'],
+                amount=Decimal(row['amount']), updated_at=built_at,
+            )
+            for row in delta['stock']
+        ], update_conflicts=True, unique_fields=['store_code', 'source_id'],
+            update_fields=['ingredient_name', 'unit', 'amount', 'updated_at'])
+    return delta['cursors']
+
+
+def advance(cursors):
+    from .models import SyncChange, SyncCursor
+
+    now = timezone.now()
+    for feed, last_id in cursors.items():
+        SyncCursor.objects.update_or_create(feed=feed, defaults={'last_id': last_id, 'synced_at': now})
+    # Shipped changes are not needed any more (ids are never reused, the watermark stays valid)
+    if 'changes' in cursors:
+        SyncChange.objects.filter(pk__lte=cursors['changes']).delete()
+
+
+def sync_store(code, batch_size=500, outbox=None, log=None):
+    """
+    Pushes everything new in store `code` to HQ, batch by batch.
+    With `outbox` the compressed deltas are written to that directory instead
+    (for HQs that are not reachable from the store; apply them with apply_file).
+    """
+    stats = {'batches': 0, 'orders': 0, 'status': 0, 'supplies': 0, 'changes': 0, 'raw_bytes': 0, 'sent_bytes': 0}
+    with stores.using(code):
+        while True:
+            delta = build_delta(batch_size)
+            blob = encode(delta)
+            stats['raw_bytes'] += len(json.dumps(delta, default=str, separators=(',', ':')))
+            stats['sent_bytes'] += len(blob)
+            if outbox:
+                root = Path(outbox)
+                root.mkdir(parents=True, exist_ok=True)
+                target = root / f"{code}-{timezone.now():%Y%m%d-%H%M%S-%f}.delta"
+                with open(target, 'wb') as f:
+                    f.write(blob)
+                    f.flush()
+                    os.fsync(f.fileno())
+            else:
+                apply_delta(decode(blob))
+            advance(delta['cursors'])
+
+            stats['batches'] += 1
+            for feed in FEEDS:
+                stats[feed] += len(delta[feed])
+            if log:
+                log(f"{code}: batch {stats['batches']}, {len(delta['orders'])} orders, {len(blob)} bytes")
+            if not delta['cursors']:
+                return stats
+
+
+def apply_file(path):
+    return apply_delta(decode(Path(path).read_bytes()))
+
+
+def consolidated_sales(days=30):
+    """Completed orders per store for the last `days` days, from the HQ tables."""
+    from .models import HQOrder, HQOrderLine
+
+    db = stores.hq_alias()
+    since = timezone.now() - timedelta(days=days)
+    orders = {
+        row['store_code']: row
+        for row in HQOrder.objects.using(db).filter(status='completed', created_at__gte=since).values(
+            'store_code'
+        ).annotate(orders=Count('id'), revenue=Sum('total_price'))
+    }
+    for row in HQOrderLine.objects.using(db).filter(
+        order__status='completed', order__created_at__gte=since
+    ).values(store_code=F('order__store_code')).annotate(cogs=Sum('cogs')):
+        if row['store_code'] in orders:
+            orders[row['store_code']]['cogs'] = row['cogs'] or 0
+    return sorted(orders.values(), key=lambda row: row['store_code'])
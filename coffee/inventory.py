@@ -0,0 +1,156 @@
+import secrets
+import threading
+import time
+from decimal import Decimal
+
+SIZE_MULTIPLIERS = {'S': Decimal('0.7'), 'M': Decimal('1.0'), 'L': Decimal('1.3')}
+
+# Stock can also change in another worker process (or via queryset .update()),
+# so every few seconds we re-read the ingredient amounts and diff them.
+# That is one small query; only the menu items using a changed ingredient are recomputed.
+RESYNC_INTERVAL = 5
+
+
+class SellableIndex:
+    """
+    "How many more can we sell?" per MenuItem x size:
+    min over the ingredients of a plain portion (coffee/rules.py) of stock / quantity needed.
+
+    Kept up to date incrementally: a stock change of one ingredient only recomputes
+    the menu items whose recipe uses it (reverse index ingredient -> menu items).
+    Every recomputed item gets a new version number, so the cashier can poll
+    "what changed since version N" instead of reloading the whole menu.
+    The numbers only mean something in this process: they are handed out as "<epoch>-<N>"
+    tokens, and a token from another worker (or from before a restart) gets the full list.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._needs = {}       # menu_item_id -> {size: ((ingredient_id, quantity), ...)}
+        self._sizes = {}       # menu_item_id -> ['S', 'M', 'L'] or ['M']
+        self._users = {}       # ingredient_id -> {menu_item_id}
+        self._stock = {}       # ingredient_id -> Decimal amount
+        self._portions = {}    # menu_item_id -> {size: int or None (no recipe = unlimited)}
+        self._changed_at = {}  # menu_item_id -> version of the last change
+        self._version = 0
+        self._epoch = secrets.token_hex(4)
+        self._last_sync = 0.0
+        self._menu_version = None
+
+    # --- building ---
+
+    def _load(self):
+        from .models import Ingredient
+        from .rules import rules
+
+        # Same per-size usage as order creation and COGS, so "sold out" matches the deduction
+        book = rules.current()
+        self._menu_version = book.version
+        self._needs, self._users = {}, {}
+        self._sizes = {pk: (['S', 'M', 'L'] if is_sized else ['M']) for pk, is_sized in book.sized.items()}
+        for menu_item_id, sizes in self._sizes.items():
+            self._needs[menu_item_id] = {size: book.unit(menu_item_id, size) for size in sizes}
+            for size_needs in self._needs[menu_item_id].values():
+                for ingredient_id, _ in size_needs:
+                    self._users.setdefault(ingredient_id, set()).add(menu_item_id)
+        self._stock = dict(Ingredient.objects.values_list('id', 'amount'))
+        self._last_sync = time.monotonic()
+
+        self._version += 1
+        self._portions, self._changed_at = {}, {}
+        for menu_item_id in self._sizes:
+            self._portions[menu_item_id] = self._compute(menu_item_id)
+            self._changed_at[menu_item_id] = self._version
+        self._loaded = True
+
+    def _compute(self, menu_item_id):
+        result = {}
+        for size in self._sizes.get(menu_item_id, ['M']):
+            needs = [(ing, qty) for ing, qty in self._needs.get(menu_item_id, {}).get(size, ()) if qty > 0]
+            if not needs:
+                result[size] = None
+                continue
+            result[size] = max(0, min(int(self._stock.get(ing, 0) / qty) for ing, qty in needs))
+        return result
+
+    def _apply_stock(self, amounts):
+        """amounts: {ingredient_id: new amount}. Recomputes only the affected menu items."""
+        affected = set()
+        for ingredient_id, amount in amounts.items():
+            if self._stock.get(ingredient_id) != amount:
+                self._stock[ingredient_id] = amount
+                affected |= self._users.get(ingredient_id, set())
+
+        for menu_item_id in affected:
+            portions = self._compute(menu_item_id)
+            if portions != self._portions.get(menu_item_id):
+                self._portions[menu_item_id] = portions
+                self._version += 1
+                self._changed_at[menu_item_id] = self._version
+
+    def _ensure_fresh(self):
+        from . import menu, replica
+
+        # Stock from the primary even inside replica.reporting() (the forecast on the analytics
+        # page): the index is shared with the tills' "sold out" checks
+        with replica.primary():
+            # A menu edit in another worker shows up as a new menu version (one stat())
+            if not self._loaded or menu.version() != self._menu_version:
+                self._load()
+            elif time.monotonic() - self._last_sync >= RESYNC_INTERVAL:
+                from .models import Ingredient
+
+                self._apply_stock(dict(Ingredient.objects.values_list('id', 'amount')))
+                self._last_sync = time.monotonic()
+
+    # --- events ---
+
+    def stock_changed(self, amounts):
+        """Called with fresh amounts, e.g. from Ingredient post_save."""
+        with self._lock:
+            if self._loaded:
+                self._apply_stock(amounts)
+
+    def refresh_ingredients(self, ingredient_ids):
+        """For F() updates where we don't know the resulting amount."""
+        from . import replica
+        from .models import Ingredient
+
+        with self._lock, replica.primary():
+            if self._loaded and ingredient_ids:
+                self._apply_stock(dict(
+                    Ingredient.objects.filter(pk__in=ingredient_ids).values_list('id', 'amount')
+                ))
+
+    def invalidate(self):
+        """Recipes or the menu itself changed: rebuild on the next read."""
+        with self._lock:
+            self._loaded = False
+
+    # --- reading ---
+
+    def portions(self, menu_item_id, size='M'):
+        with self._lock:
+            self._ensure_fresh()
+            by_size = self._portions.get(menu_item_id, {})
+            return by_size.get(size, by_size.get('M'))
+
+    def changes_since(self, since=None):
+        """
+        Returns (version token, {menu_item_id: {size: portions}}) changed after the token `since`;
+        everything when `since` is empty or was issued by another process.
+        """
+        epoch, _, number = str(since or '').partition('-')
+        version = int(number) if epoch == self._epoch and number.isdigit() else 0
+        with self._lock:
+            self._ensure_fresh()
+            changed = {
+                menu_item_id: dict(self._portions[menu_item_id])
+                for menu_item_id, changed_at in self._changed_at.items()
+                if changed_at > version and menu_item_id in self._portions
+            }
+            return f"{self._epoch}-{self._version}", changed
+
+
+sellable = SellableIndex()
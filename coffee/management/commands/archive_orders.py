@@ -0,0 +1,31 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.archive import archivable_orders, archive_orders, parse_age
+
+
+class Command(BaseCommand):
+    help = "Move completed orders of closed shifts older than --older-than into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', default='90d', help="Age like 90d or 12w (default 90d)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Orders per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be archived")
+
+    def handle(self, *args, **options):
+        try:
+            older_than = parse_age(options['older_than'])
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+        if options['dry_run']:
+            count = archivable_orders(older_than).count()
+            self.stdout.write(f"{count} orders would be archived")
+            return
+
+        started = time.perf_counter()
+        archived = archive_orders(older_than, batch_size=options['batch_size'], log=self.stdout.write)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} orders in {elapsed:.2f}s"))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from coffee.backups import create_backup
+
+
+class Command(BaseCommand):
+    help = "Online, compressed, checksummed backup of the database (old backups are rotated)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0, help="Keep running, back up every N seconds")
+        parser.add_argument('--pages', type=int, help="Pages copied per step (-1 = all at once)")
+        parser.add_argument('--pause', type=float, help="Seconds to yield to writers between steps")
+
+    def handle(self, *args, **options):
+        while True:
+            info = create_backup(pages=options['pages'], pause=options['pause'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{info['path'].name}: {info['raw_size'] / 1024:.0f} KB -> {info['size'] / 1024:.0f} KB, "
+                f"copy {info['copy_ms']:.1f} ms in {info['steps']} steps "
+                f"({info['restarts']} restarts), total {info['total_ms']:.1f} ms"
+            ))
+            for name in info['removed']:
+                self.stdout.write(f"  rotated out {name}")
+            if options['every'] <= 0:
+                break
+            time.sleep(options['every'])
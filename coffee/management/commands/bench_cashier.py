@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from coffee.models import MenuItem, Modifier
+from coffee.views import cashier_view
+
+
+class Command(BaseCommand):
+    help = "Render time of the cashier page with a large menu, cold vs. fragment-cached. Nothing is saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=300, help="Menu size to test with")
+        parser.add_argument('--runs', type=int, default=50)
+
+    def _measure(self, request, runs, cold):
+        timings, queries = [], 0
+        for _ in range(runs):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = cashier_view(request)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = len(captured)
+        return timings, queries, len(response.content)
+
+    def _report(self, label, timings, queries, size):
+        timings.sort()
+        self.stdout.write(
+            f"{label:<16} mean {statistics.mean(timings):7.2f} ms   p50 {timings[len(timings) // 2]:7.2f} ms   "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms   {queries} queries   {size / 1024:.0f} KB"
+        )
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/cashier/')
+        request.user = AnonymousUser()
+
+        with transaction.atomic():
+            missing = options['items'] - MenuItem.objects.count()
+            if missing > 0:
+                categories = [c for c, _ in MenuItem.CATEGORY_CHOICES]
+                MenuItem.objects.bulk_create([
+                    MenuItem(name=f"Bench item {i}", price=(1000 + i) * 100, category=categories[i % len(categories)],
+                             has_milk_mods=i % 2 == 0, has_syrup_mods=True)
+                    for i in range(missing)
+                ])
+            if Modifier.objects.count() < 20:
+                Modifier.objects.bulk_create([Modifier(name=f"Bench mod {i}", price=10000, type='syrup') for i in range(20)])
+            self.stdout.write(f"Menu: {MenuItem.objects.count()} items, {Modifier.objects.count()} modifiers")
+
+            cashier_view(request)  # compile the template once
+            self._report('cold (no cache)', *self._measure(request, options['runs'], cold=True))
+            cache.clear()
+            cashier_view(request)
+            self._report('fragment cached', *self._measure(request, options['runs'], cold=False))
+
+            # Bench rows must not stay in the DB or in the fragment cache
+            transaction.set_rollback(True)
+        cache.clear()
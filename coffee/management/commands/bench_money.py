@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField
+from django.db.models.functions import Cast
+
+from coffee.models import MenuItem, Order, OrderItem
+from coffee.money import SIZE_PRICE_PERCENT, line_price
+
+CENT = Decimal('0.01')
+SIZE_FACTORS = {size: Decimal(percent) / 100 for size, percent in SIZE_PRICE_PERCENT.items()}
+
+
+def _decimal_pricing(lines):
+    # What pricing and summing cost with Decimal tenge: a new Decimal per step, quantize per line
+    total = Decimal(0)
+    for base, size, mods, quantity in lines:
+        unit = (base * SIZE_FACTORS[size]).quantize(CENT, rounding=ROUND_HALF_UP)
+        total += (unit + sum(mods, Decimal(0))) * quantity
+    return total
+
+
+def _int_pricing(lines):
+    total = 0
+    for base, size, mods, quantity in lines:
+        total += line_price(base, size, mods, quantity)
+    return total
+
+
+class Command(BaseCommand):
+    help = "Pricing and summing order lines as Decimal tenge vs. int tiyn (time and allocations). Nothing is saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=200000, help="Order lines to price and sum")
+        parser.add_argument('--runs', type=int, default=5)
+
+    def _measure(self, func, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, statistics.median(timings), peak
+
+    def _report(self, label, timings_ms, peak, lines):
+        self.stdout.write(
+            f"{label:<22} {timings_ms:9.1f} ms   {timings_ms * 1e6 / lines:7.0f} ns/line   "
+            f"peak {peak / 1024:9.0f} KB"
+        )
+
+    def handle(self, *args, **options):
+        count, runs = options['lines'], options['runs']
+        rng = random.Random(42)
+        int_lines = [
+            (rng.randrange(50000, 300000), rng.choice('SML'),
+             [rng.choice((0, 15000, 30000)) for _ in range(rng.randrange(3))], rng.randrange(1, 4))
+            for _ in range(count)
+        ]
+        decimal_lines = [
+            (Decimal(base) / 100, size, [Decimal(m) / 100 for m in mods], quantity)
+            for base, size, mods, quantity in int_lines
+        ]
+
+        self.stdout.write(f"Pricing {count} cart lines (size scaling, modifiers, quantity) and summing them:")
+        decimal_total, decimal_ms, decimal_peak = self._measure(lambda: _decimal_pricing(decimal_lines), runs)
+        int_total, int_ms, int_peak = self._measure(lambda: _int_pricing(int_lines), runs)
+        self._report('Decimal tenge', decimal_ms, decimal_peak, count)
+        self._report('int tiyn', int_ms, int_peak, count)
+        self.stdout.write(f"  totals agree: {decimal_total * 100 == int_total}   speedup x{decimal_ms / int_ms:.1f}")
+
+        # Loading amounts from the DB: the Decimal converter builds and quantizes a Decimal per row
+        with transaction.atomic():
+            menu_item = MenuItem.objects.first() or MenuItem.objects.create(name='Bench item', price=100000)
+            order = Order.objects.create(total_price=0)
+            OrderItem.objects.bulk_create(
+                [OrderItem(order=order, menu_item=menu_item, size=size, quantity=quantity,
+                           price=line_price(base, size, mods, quantity))
+                 for base, size, mods, quantity in int_lines],
+                batch_size=2000,
+            )
+            rows = OrderItem.objects.filter(order=order)
+            as_decimal = rows.annotate(amount=Cast('price', DecimalField(max_digits=14, decimal_places=2)))
+
+            self.stdout.write(f"Loading and summing {count} OrderItem.price values:")
+            _, decimal_ms, decimal_peak = self._measure(
+                lambda: sum(as_decimal.values_list('amount', flat=True), Decimal(0)), runs
+            )
+            _, int_ms, int_peak = self._measure(lambda: sum(rows.values_list('price', flat=True)), runs)
+            self._report('Decimal column', decimal_ms, decimal_peak, count)
+            self._report('int column', int_ms, int_peak, count)
+            self.stdout.write(f"  speedup x{decimal_ms / int_ms:.1f}")
+
+            transaction.set_rollback(True)
@@ -0,0 +1,34 @@
+import json
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from coffee.menu_io import export_menu, write_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Export ingredients, modifiers, products and recipes for import_menu. "
+        "A .json path (or '-' for stdout) writes one JSON file; any other path is a directory of CSV files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="menu.json, '-' or a directory for CSV")
+
+    def handle(self, *args, **options):
+        data = export_menu()
+        path = options['path']
+        if path == '-':
+            json.dump(data, sys.stdout, ensure_ascii=False, indent=2)
+            sys.stdout.write('\n')
+            return
+        path = Path(path)
+        if path.suffix.lower() == '.json':
+            path.write_text(json.dumps(data, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+        else:
+            write_csv(data, path)
+        self.stderr.write(self.style.SUCCESS(
+            f"{path}: {len(data['menu_items'])} products, {len(data['modifiers'])} modifiers, "
+            f"{len(data['ingredients'])} ingredients"
+        ))
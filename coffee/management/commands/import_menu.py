@@ -0,0 +1,35 @@
+import time
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.menu_io import import_menu, read_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products, recipes, modifiers and ingredients from a file of export_menu "
+        "(menu.json or a directory of CSV files). Rows are matched by name; only differences are written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="menu.json or a directory with ingredients/modifiers/menu_items/recipes.csv")
+        parser.add_argument('--dry-run', action='store_true', help="Show what would change and roll back")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"File not found: {path}")
+
+        started = time.perf_counter()
+        try:
+            stats = import_menu(read_file(path), dry_run=options['dry_run'])
+        except ValidationError as e:
+            raise CommandError("Menu rejected:\n  " + "\n  ".join(e.messages))
+        elapsed = (time.perf_counter() - started) * 1000
+
+        for table, counts in stats.items():
+            self.stdout.write(f"{table:<12} " + ", ".join(f"{key} {value}" for key, value in counts.items()))
+        verb = "Would apply" if options['dry_run'] else "Applied"
+        self.stdout.write(self.style.SUCCESS(f"{verb} in {elapsed:.0f} ms"))
@@ -0,0 +1,59 @@
+import csv
+import json
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.models import Supplier
+from coffee.services import intake_supply
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a supplier invoice as one Supply. "
+        "CSV columns: ingredient,quantity,unit_price,cost. "
+        "JSON: {\"supplier\": ..., \"items\": [...]} or a plain list of lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Invoice file (.csv or .json)")
+        parser.add_argument('--supplier', help="Supplier name or id (overrides the one in the JSON file)")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"File not found: {path}")
+
+        supplier_key = options['supplier']
+        if path.suffix.lower() == '.json':
+            payload = json.loads(path.read_text(encoding='utf-8'))
+            if isinstance(payload, dict):
+                supplier_key = supplier_key or payload.get('supplier')
+                lines = payload.get('items', [])
+            else:
+                lines = payload
+        else:
+            with path.open(newline='', encoding='utf-8-sig') as f:
+                lines = list(csv.DictReader(f))
+
+        if not supplier_key:
+            raise CommandError("Supplier is required (--supplier or \"supplier\" in the JSON file)")
+        supplier_key = str(supplier_key)
+        supplier = (
+            Supplier.objects.filter(pk=supplier_key).first() if supplier_key.isdigit()
+            else Supplier.objects.filter(name=supplier_key).first()
+        )
+        if not supplier:
+            raise CommandError(f"Unknown supplier: {supplier_key}")
+        if not lines:
+            raise CommandError("Invoice has no lines")
+
+        try:
+            supply = intake_supply(supplier, lines)
+        except ValidationError as e:
+            raise CommandError("Invoice rejected:\n  " + "\n  ".join(e.messages))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{supply}: {len(lines)} lines, total {supply.total_cost}"
+        ))
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+NEXT_STATUS = {'pending': 'preparing', 'preparing': 'ready', 'ready': 'completed'}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class AsgiClient:
+    """Calls the ASGI application directly, no sockets involved."""
+
+    def __init__(self, application, address='127.0.0.1'):
+        self.application = application
+        self.address = address
+
+    def for_user(self, number):
+        # Every virtual till gets its own address, as the per-client rate limit sees real tills
+        return AsgiClient(self.application, f"127.0.{number // 250}.{number % 250 + 1}")
+
+    async def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'content-type', b'application/json')],
+            'client': (self.address, 50000), 'server': ('localhost', 8000),
+        }
+        sent = False
+        status, chunks = 500, []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await asyncio.sleep(3600)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.application(scope, receive, send)
+        return status, b''.join(chunks)
+
+
+class HttpClient:
+    """Same interface over real HTTP, for a locally running Daphne/uvicorn."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def _request(self, method, path, payload):
+        import http.client
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def for_user(self, number):
+        return self
+
+    async def request(self, method, path, payload=None):
+        return await asyncio.get_running_loop().run_in_executor(None, self._request, method, path, payload)
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline load generator: virtual cashiers post carts, baristas poll and advance orders, "
+        "a manager cycles shifts. Reports throughput, latency percentiles and errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cashiers', type=int, default=4)
+        parser.add_argument('--baristas', type=int, default=2)
+        parser.add_argument('--analysts', type=int, default=0, help="Users reloading the analytics page non-stop")
+        parser.add_argument('--no-replica', action='store_true', help="Serve analytics from the primary database")
+        parser.add_argument('--no-admission', action='store_true', help="Write endpoints without the write queue (coffee/admission.py)")
+        parser.add_argument('--backup-every', type=float, default=0, help="Run an online backup every N seconds (0 = never)")
+        parser.add_argument('--duration', type=float, default=20, help="Seconds to run")
+        parser.add_argument('--think', type=float, default=0.2, help="Pause between actions of one user (s)")
+        parser.add_argument('--shift-every', type=float, default=0, help="Close/reopen the shift every N seconds (0 = never)")
+        parser.add_argument('--url', help="Target a running server (e.g. http://127.0.0.1:8000) instead of the in-process app")
+        parser.add_argument('--in-place', action='store_true', help="Write to the real database instead of a temporary copy")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        if options['no_replica']:
+            settings.USE_REPLICA = False
+        if options['no_admission']:
+            settings.ADMISSION_CONTROL = False
+        tmp_path = None
+        if not options['in_place'] and not options['url']:
+            tmp_path = self._use_database_copy()
+
+        try:
+            self._prepare_data(restock=tmp_path is not None)
+            menu, modifiers = self._load_menu()
+
+            if options['url']:
+                client = HttpClient(options['url'])
+            else:
+                from coffee_core.asgi import application
+                client = AsgiClient(application)
+
+            # Failed requests are counted in the report, not dumped as tracebacks
+            logging.getLogger('django.request').setLevel(logging.CRITICAL)
+            stats = asyncio.run(self._run(client, menu, modifiers, options))
+            self._report(stats, options['duration'])
+            if not options['url']:
+                from coffee.admission import writer
+
+                self.stdout.write(f"write queue: {json.dumps(writer.metrics.snapshot(writer.depth()))}")
+        finally:
+            if tmp_path:
+                for alias in connections:
+                    connections[alias].close()
+                for path in (tmp_path, tmp_path + '.replica'):
+                    if os.path.exists(path):
+                        os.unlink(path)
+                shutil.rmtree(tmp_path + '.backups', ignore_errors=True)
+
+    # --- setup ---
+
+    def _use_database_copy(self):
+        db = connections['default']
+        if db.vendor != 'sqlite':
+            raise CommandError("The temporary copy mode only supports SQLite, use --in-place")
+        fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3', prefix='coffee-loadtest-')
+        os.close(fd)
+        source = sqlite3.connect(db.settings_dict['NAME'])
+        target = sqlite3.connect(tmp_path)
+        with target:
+            source.backup(target)
+        source.close()
+        target.close()
+
+        db.close()
+        db.settings_dict['NAME'] = tmp_path
+        if 'replica' in connections:
+            connections['replica'].close()
+            connections['replica'].settings_dict['NAME'] = tmp_path + '.replica'
+        # Backups of the copy must not rotate out the real ones
+        settings.BACKUP_DIR = tmp_path + '.backups'
+        self.stdout.write(f"Running against a temporary copy: {tmp_path}")
+        return tmp_path
+
+    def _prepare_data(self, restock):
+        from coffee.models import Ingredient, MenuItem, Modifier, Recipe, Shift
+
+        if not MenuItem.objects.exists():
+            self.stdout.write("Menu is empty, generating fixtures")
+            beans = Ingredient.objects.create(name='Loadtest Beans', unit='g', amount=0)
+            milk = Ingredient.objects.create(name='Loadtest Milk', unit='ml', amount=0, is_milk=True)
+            syrup = Ingredient.objects.create(name='Loadtest Syrup', unit='g', amount=0)
+            for name, price, milk_ml in [('Espresso', 100000, 0), ('Latte', 170000, 250), ('Cappuccino', 150000, 150)]:
+                item = MenuItem.objects.create(name=name, price=price, category='coffee', has_milk_mods=bool(milk_ml), has_syrup_mods=True)
+                Recipe.objects.create(menu_item=item, ingredient=beans, quantity_needed=18)
+                if milk_ml:
+                    Recipe.objects.create(menu_item=item, ingredient=milk, quantity_needed=milk_ml)
+            Modifier.objects.create(name='Caramel', price=30000, type='syrup', ingredient=syrup, quantity_needed=20)
+
+        if restock:
+            # Sold-out rejections would hide the numbers we are after
+            Ingredient.objects.update(amount=Decimal('1000000'))
+        if not Shift.objects.filter(is_active=True).exists():
+            Shift.objects.create(is_active=True)
+
+    def _load_menu(self):
+        from coffee.models import MenuItem, Modifier
+
+        menu = list(MenuItem.objects.values(
+            'id', 'name', 'is_sized', 'has_milk_mods', 'has_syrup_mods', 'has_ice_mods', 'has_other_mods'
+        ))
+        modifiers = defaultdict(list)
+        for mod in Modifier.objects.values('id', 'type'):
+            modifiers[mod['type']].append(mod['id'])
+        return menu, modifiers
+
+    # --- virtual users ---
+
+    def _cart(self, menu, modifiers):
+        cart = []
+        for item in random.choices(menu, k=random.choice([1, 1, 2, 2, 3])):
+            mods = []
+            for mod_type in ('milk', 'syrup', 'ice', 'other'):
+                if item[f'has_{mod_type}_mods'] and modifiers[mod_type] and random.random() < 0.3:
+                    mods.append(random.choice(modifiers[mod_type]))
+            cart.append({
+                'id': item['id'],
+                'name': item['name'],
+                'size': random.choice('SML') if item['is_sized'] else 'M',
+                'modifiers': mods,
+            })
+        return cart
+
+    async def _run(self, client, menu, modifiers, options):
+        stats = defaultdict(lambda: {'latencies': [], 'errors': defaultdict(int)})
+        deadline = time.monotonic() + options['duration']
+        think = options['think']
+
+        async def call(client, name, method, path, payload=None, html=False):
+            started = time.perf_counter()
+            body = b''
+            try:
+                status, body = await client.request(method, path, payload)
+                data = json.loads(body) if status < 400 and body and not html else {}
+            except Exception as e:
+                status, data = 0, {'success': False, 'error': f"{type(e).__name__}: {e}"}
+            stats[name]['latencies'].append((time.perf_counter() - started) * 1000)
+            if status == 0 or status >= 400:
+                if b'database is locked' in body:
+                    error = 'database is locked'
+                else:
+                    error = f"HTTP {status}" if status else data['error']
+                stats[name]['errors'][error] += 1
+            elif data.get('success') is False:
+                error = str(data.get('error', 'unknown'))
+                stats[name]['errors']['database is locked' if 'locked' in error else error[:60]] += 1
+            return data
+
+        async def cashier(client):
+            while time.monotonic() < deadline:
+                await call(client, 'create_order', 'POST', '/api/order/create/', {'items': self._cart(menu, modifiers)})
+                await asyncio.sleep(random.uniform(0.5, 1.5) * think)
+
+        async def barista(client):
+            while time.monotonic() < deadline:
+                data = await call(client, 'poll_orders', 'GET', '/api/orders/')
+                for order in data.get('orders', [])[:3]:
+                    next_status = NEXT_STATUS.get(order['status'])
+                    if next_status:
+                        await call(client, 'update_status', 'POST', f"/api/order/{order['id']}/update/", {'status': next_status})
+                await asyncio.sleep(random.uniform(0.5, 1.5) * think)
+
+        async def manager(client):
+            every = options['shift_every']
+            while time.monotonic() + every < deadline:
+                await asyncio.sleep(every)
+                await call(client, 'shift_close', 'POST', '/api/shift/close/')
+                await call(client, 'shift_open', 'POST', '/api/shift/open/')
+
+        async def backup_job():
+            from coffee.backups import create_backup
+
+            every = options['backup_every']
+            loop = asyncio.get_running_loop()
+            while time.monotonic() + every < deadline:
+                await asyncio.sleep(every)
+                started = time.perf_counter()
+                await loop.run_in_executor(None, create_backup)
+                stats['backup']['latencies'].append((time.perf_counter() - started) * 1000)
+
+        async def analyst(client):
+            while time.monotonic() < deadline:
+                await call(client, 'analytics', 'GET', '/analytics/', html=True)
+
+        roles = [cashier] * options['cashiers'] + [barista] * options['baristas'] + [analyst] * options['analysts']
+        if options['shift_every'] > 0:
+            roles.append(manager)
+        users = [role(client.for_user(number)) for number, role in enumerate(roles)]
+        if options['backup_every'] > 0:
+            users.append(backup_job())
+        await asyncio.gather(*users)
+        return stats
+
+    # --- output ---
+
+    def _report(self, stats, duration):
+        self.stdout.write("")
+        self.stdout.write(f"{'endpoint':<16}{'requests':>9}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for name in sorted(stats):
+            latencies = stats[name]['latencies']
+            errors = sum(stats[name]['errors'].values())
+            self.stdout.write(
+                f"{name:<16}{len(latencies):>9}{len(latencies) / duration:>8.1f}"
+                f"{percentile(latencies, 0.50):>9.1f}{percentile(latencies, 0.95):>9.1f}"
+                f"{percentile(latencies, 0.99):>9.1f}{errors:>8}"
+            )
+        for name in sorted(stats):
+            for error, count in sorted(stats[name]['errors'].items(), key=lambda e: -e[1]):
+                self.stdout.write(self.style.WARNING(f"  {name}: {count} x {error}"))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from coffee.costing import costing_method, recompute_all
+
+
+class Command(BaseCommand):
+    help = "Rebuild cost layers from supplies and recompute COGS for every order line (one streaming pass)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Order lines per write batch")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.stdout.write(f"Costing method: {costing_method()}")
+        processed = recompute_all(chunk_size=options['chunk_size'], log=self.stdout.write)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Costed {processed} order lines in {elapsed:.2f}s"))
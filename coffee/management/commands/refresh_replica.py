@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee import replica
+
+
+class Command(BaseCommand):
+    help = "Take a fresh snapshot of the primary database for the reporting replica."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0, help="Keep running, refresh every N seconds")
+
+    def handle(self, *args, **options):
+        if not replica.enabled():
+            raise CommandError("No 'replica' database configured")
+        while True:
+            elapsed = replica.refresh()
+            self.stdout.write(f"Replica refreshed in {elapsed * 1000:.1f} ms")
+            if options['every'] <= 0:
+                break
+            time.sleep(options['every'])
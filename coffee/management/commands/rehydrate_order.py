@@ -0,0 +1,29 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.archive import load_archived_order, restore_order
+
+
+class Command(BaseCommand):
+    help = "Print an archived order, or put it back into the live tables with --restore."
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_id', type=int)
+        parser.add_argument('--restore', action='store_true', help="Move the order back out of the archive")
+
+    def handle(self, *args, **options):
+        order_id = options['order_id']
+        if options['restore']:
+            try:
+                restore_order(order_id)
+            except ValidationError as e:
+                raise CommandError(e.messages[0])
+            self.stdout.write(self.style.SUCCESS(f"Order #{order_id} restored"))
+            return
+
+        data = load_archived_order(order_id)
+        if data is None:
+            raise CommandError(f"Order #{order_id} is not in the archive")
+        self.stdout.write(json.dumps(data, indent=2, ensure_ascii=False))
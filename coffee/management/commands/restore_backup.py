@@ -0,0 +1,28 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.backups import resolve, restore_backup
+
+
+class Command(BaseCommand):
+    help = "Verify a backup and copy it over the live database. Stop the tills first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Backup file name or path")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        try:
+            path = resolve(options['name'])
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+        if options['interactive']:
+            answer = input(f"This replaces ALL current data with {path.name}. Type 'yes' to continue: ")
+            if answer != 'yes':
+                raise CommandError("Restore cancelled")
+        try:
+            restore_backup(path)
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        self.stdout.write(self.style.SUCCESS(f"Restored {path.name}"))
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.models import Stocktake
+from coffee.money import format_money
+from coffee.variance import previous_stocktake, stock_variance, tolerance
+
+
+def _qty(value):
+    return '' if value is None else f"{value:.3f}"
+
+
+class Command(BaseCommand):
+    help = "Theoretical vs. actual stock between two stocktakes (the latest one by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('stocktake', nargs='?', type=int, help="Stocktake id (default: the latest)")
+        parser.add_argument('--since', type=int, help="Stocktake the period starts at (default: the one before)")
+        parser.add_argument('--flagged', action='store_true', help="Only ingredients beyond the tolerance")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        stocktakes = Stocktake.objects.all()
+        stocktake = (
+            stocktakes.filter(pk=options['stocktake']).first() if options['stocktake']
+            else stocktakes.order_by('-counted_at', '-id').first()
+        )
+        if stocktake is None:
+            raise CommandError("No such stocktake")
+        previous = stocktakes.filter(pk=options['since']).first() if options['since'] else previous_stocktake(stocktake)
+        if options['since'] and previous is None:
+            raise CommandError(f"No such stocktake: {options['since']}")
+
+        started = time.perf_counter()
+        rows = stock_variance(stocktake, previous, chunk_size=options['chunk_size'])
+        elapsed = (time.perf_counter() - started) * 1000
+
+        if previous is None:
+            self.stdout.write(self.style.WARNING(
+                f"{stocktake}: no earlier stocktake, only the difference to the book amount is known"
+            ))
+        else:
+            self.stdout.write(f"{previous} -> {stocktake}, tolerance {tolerance()}% of usage")
+        self.stdout.write(
+            f"{'Ingredient':<24} {'Opening':>10} {'Received':>10} {'Usage':>10} {'Expected':>10} "
+            f"{'Counted':>10} {'Variance':>10} {'%':>7} {'Book':>9} {'Cost':>10}"
+        )
+        for row in rows:
+            if options['flagged'] and not row.flag:
+                continue
+            line = (
+                f"{row.name[:24]:<24} {_qty(row.opening):>10} {_qty(row.received):>10} {_qty(row.usage):>10} "
+                f"{_qty(row.expected):>10} {_qty(row.counted):>10} {_qty(row.variance):>10} "
+                f"{'' if row.percent is None else row.percent:>7} {_qty(row.book_variance):>9} "
+                f"{'' if row.cost is None else format_money(row.cost, 0):>10}"
+            )
+            if row.flag:
+                line = self.style.ERROR(f"{line}  {row.flag}")
+            self.stdout.write(line)
+
+        flagged = [row for row in rows if row.flag]
+        loss = sum(row.cost for row in rows if row.cost and row.cost < 0)
+        self.stdout.write(
+            f"{len(rows)} ingredients, {len(flagged)} flagged, shrinkage {format_money(-loss, 0)} tenge; "
+            f"computed in {elapsed:.0f} ms"
+        )
@@ -0,0 +1,71 @@
+import csv
+import json
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from coffee.services import record_stocktake
+
+
+class Command(BaseCommand):
+    help = (
+        "Record a stocktake (shelf count) and set the stock to the counted quantities. "
+        "CSV columns: ingredient,counted. "
+        "JSON: {\"note\": ..., \"counted_at\": ..., \"items\": [...]} or a plain list of lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Count sheet (.csv or .json)")
+        parser.add_argument('--note', default='')
+        parser.add_argument(
+            '--counted-at',
+            help="When the shelves were counted (ISO datetime in the shop's time zone, default now). "
+                 "Only dates the count for the variance report: the stock is still set to the counted "
+                 "quantities now, so sales and deliveries since then are not added back.",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"File not found: {path}")
+
+        note, counted_at = options['note'], options['counted_at']
+        if path.suffix.lower() == '.json':
+            payload = json.loads(path.read_text(encoding='utf-8'))
+            if isinstance(payload, dict):
+                note = note or payload.get('note', '')
+                counted_at = counted_at or payload.get('counted_at')
+                lines = payload.get('items', [])
+            else:
+                lines = payload
+        else:
+            with path.open(newline='', encoding='utf-8-sig') as f:
+                lines = list(csv.DictReader(f))
+
+        if counted_at:
+            parsed = parse_datetime(counted_at)
+            if parsed is None:
+                raise CommandError(f"Not a datetime: {counted_at}")
+            counted_at = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+            if counted_at > timezone.now():
+                raise CommandError(f"Count time is in the future: {counted_at}")
+        if not lines:
+            raise CommandError("Count sheet has no lines")
+
+        try:
+            stocktake = record_stocktake(lines, counted_at=counted_at, note=note)
+        except ValidationError as e:
+            raise CommandError("Count sheet rejected:\n  " + "\n  ".join(e.messages))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stocktake}: {len(lines)} ingredients counted. See: manage.py stock_variance {stocktake.pk}"
+        ))
+        if counted_at:
+            when = timezone.localtime(counted_at).strftime('%d.%m.%Y %H:%M')
+            self.stdout.write(self.style.WARNING(
+                f"Stock set to the counted quantities as of now, not as of {when}: "
+                "sales and deliveries recorded since the count are not replayed"
+            ))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee import hq, stores
+from coffee.money import format_money
+
+
+class Command(BaseCommand):
+    help = "Push new orders, status changes, supplies and stock levels of each store to the HQ database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', action='append', help="Store code (repeatable, default: every configured store)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per feed per delta")
+        parser.add_argument('--outbox', help="Write compressed deltas to this directory instead of applying them")
+        parser.add_argument('--apply', nargs='+', metavar='FILE', help="HQ side: apply delta files from an outbox")
+        parser.add_argument('--report', action='store_true', help="Print consolidated sales per store afterwards")
+
+    def handle(self, *args, **options):
+        if options['apply']:
+            for path in sorted(options['apply']):
+                hq.apply_file(path)
+                self.stdout.write(f"Applied {path}")
+        else:
+            known = stores.store_aliases()
+            codes = options['store'] or list(known)
+            unknown = [code for code in codes if code not in known]
+            if unknown:
+                raise CommandError(f"No database configured for store(s): {', '.join(unknown)}")
+            for code in codes:
+                stats = hq.sync_store(code, batch_size=options['batch_size'], outbox=options['outbox'])
+                ratio = stats['raw_bytes'] / stats['sent_bytes'] if stats['sent_bytes'] else 0
+                self.stdout.write(self.style.SUCCESS(
+                    f"{code}: {stats['orders']} orders, {stats['status']} status changes, "
+                    f"{stats['supplies']} supply lines, {stats['changes']} re-sent changes in {stats['batches']} batches, "
+                    f"{stats['sent_bytes'] / 1024:.1f} KB sent ({ratio:.1f}x compressed)"
+                ))
+
+        if options['report']:
+            for row in hq.consolidated_sales():
+                self.stdout.write(
+                    f"{row['store_code']:<12}{row['orders']:>8} orders{format_money(row['revenue'] or 0):>14} revenue"
+                    f"{format_money(row.get('cogs', 0)):>12} COGS"
+                )
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import urllib.request
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+VENDOR_DIR = Path(__file__).resolve().parents[2] / 'static' / 'vendor'
+LOCK_FILE = VENDOR_DIR / 'vendor.json'
+
+
+class Command(BaseCommand):
+    help = "Download the third-party JS pinned in static/vendor/vendor.json, so pages work without a CDN."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Download again even if the file is present")
+
+    def handle(self, *args, **options):
+        pins = json.loads(LOCK_FILE.read_text(encoding='utf-8'))
+        changed = False
+        for name, pin in pins.items():
+            target = VENDOR_DIR / name
+            if target.exists() and not options['force']:
+                self.stdout.write(f"{name} {pin['version']}: present")
+                continue
+
+            try:
+                with urllib.request.urlopen(pin['url'], timeout=30) as response:
+                    data = response.read()
+            except OSError as e:
+                raise CommandError(f"{name}: download failed: {e}")
+
+            digest = hashlib.sha256(data).hexdigest()
+            if pin.get('sha256') and pin['sha256'] != digest:
+                raise CommandError(f"{name}: sha256 mismatch (expected {pin['sha256']}, got {digest})")
+            if not pin.get('sha256'):
+                # First download pins the checksum, later downloads must match it
+                pin['sha256'] = digest
+                changed = True
+            target.write_bytes(data)
+            self.stdout.write(self.style.SUCCESS(f"{name} {pin['version']}: {len(data) / 1024:.0f} KB"))
+
+        if changed:
+            LOCK_FILE.write_text(json.dumps(pins, indent=2) + '\n', encoding='utf-8')
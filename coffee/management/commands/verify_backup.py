@@ -0,0 +1,29 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from coffee.backups import list_backups, resolve, verify_backup
+
+
+class Command(BaseCommand):
+    help = "Check the checksum and integrity of a backup (the newest one by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Backup file name or path")
+        parser.add_argument('--all', action='store_true', help="Verify every kept backup")
+
+    def handle(self, *args, **options):
+        try:
+            paths = list_backups() if options['all'] else [resolve(options['name'])]
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+        failed = 0
+        for path in paths:
+            try:
+                verify_backup(path)
+                self.stdout.write(self.style.SUCCESS(f"{path.name}: ok"))
+            except ValidationError as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(e.messages[0]))
+        if failed:
+            raise CommandError(f"{failed} backup(s) failed verification")
@@ -0,0 +1,28 @@
+from django.db import transaction
+
+from . import stamps
+
+# Menu version: one stamp file bumped whenever products, recipes or modifiers change.
+# Anything derived from the menu (e.g. the cashier product grid fragment) is cached under it,
+# so every worker drops its copy on the next request after a change.
+
+STAMP = 'menu'
+
+
+def version():
+    stamp = stamps.read(STAMP)
+    return f"{stamp[0]}-{stamp[1]}" if stamp else '0'
+
+
+def _bump():
+    stamps.bump(STAMP)
+
+
+def changed():
+    # Once per transaction however many rows changed (a recipe inline, an import deleting lines):
+    # skip if the bump is already queued. A rolled back savepoint drops its callbacks from the
+    # list, so a later change queues it again.
+    connection = transaction.get_connection()
+    if any(func is _bump for _, func, _ in connection.run_on_commit):
+        return
+    transaction.on_commit(_bump)
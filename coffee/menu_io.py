@@ -0,0 +1,360 @@
+import csv
+import json
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import menu
+from .inventory import sellable
+from .money import to_major, to_minor
+from .rules import rules
+from .search import menu_search
+
+# The menu as a file (manage.py export_menu / import_menu): ingredients (the catalogue, never
+# the stock amounts), modifiers, and products with their recipes. Rows are matched by name.
+#
+# Import diffs the file against the database and writes only what differs: bulk_create for new
+# rows, one bulk_update per table for changed ones, and the recipe of every product in the file
+# replaced line by line. All in one transaction; the menu version (coffee/menu.py) and the
+# compiled rules move once at the end instead of a post_save signal per row.
+# Products and modifiers missing from the file are left alone: deleting a product would take
+# its order history with it (OrderItem cascades).
+
+INGREDIENT_FIELDS = ('unit', 'is_milk', 'min_limit', 'supplier_id')
+MODIFIER_FIELDS = ('price', 'type', 'ingredient_id', 'quantity_needed', 'action', 'target_id')
+MENU_ITEM_FIELDS = (
+    'price', 'category', 'is_sized', 'has_milk_mods', 'has_syrup_mods', 'has_ice_mods', 'has_other_mods',
+)
+CSV_FILES = {
+    'ingredients': ('name', 'unit', 'is_milk', 'min_limit', 'supplier'),
+    'modifiers': ('name', 'type', 'price', 'ingredient', 'quantity_needed', 'action', 'target'),
+    'menu_items': ('name', 'category', 'price') + MENU_ITEM_FIELDS[2:],
+    'recipes': ('menu_item', 'ingredient', 'quantity', 'scales_with_size'),
+}
+
+
+# --- export ---
+
+def export_menu():
+    from .models import Ingredient, MenuItem, Modifier, Recipe
+
+    ingredient_names = dict(Ingredient.objects.values_list('id', 'name'))
+    recipes = defaultdict(list)
+    for menu_item_id, ingredient_id, quantity, scales in Recipe.objects.order_by('id').values_list(
+        'menu_item_id', 'ingredient_id', 'quantity_needed', 'scales_with_size'
+    ):
+        recipes[menu_item_id].append({
+            'ingredient': ingredient_names[ingredient_id], 'quantity': str(quantity), 'scales_with_size': scales,
+        })
+
+    return {
+        'ingredients': [
+            {
+                'name': ing.name, 'unit': ing.unit, 'is_milk': ing.is_milk,
+                'min_limit': str(ing.min_limit), 'supplier': ing.supplier.name if ing.supplier else None,
+            }
+            for ing in Ingredient.objects.select_related('supplier').order_by('name')
+        ],
+        'modifiers': [
+            {
+                'name': mod.name, 'type': mod.type, 'price': str(to_major(mod.price)),
+                'ingredient': ingredient_names.get(mod.ingredient_id), 'quantity_needed': str(mod.quantity_needed),
+                'action': mod.action, 'target': ingredient_names.get(mod.target_id),
+            }
+            for mod in Modifier.objects.order_by('type', 'name')
+        ],
+        'menu_items': [
+            {
+                'name': item.name, 'category': item.category, 'price': str(to_major(item.price)),
+                **{field: getattr(item, field) for field in MENU_ITEM_FIELDS[2:]},
+                'recipe': recipes[item.pk],
+            }
+            for item in MenuItem.objects.order_by('category', 'name')
+        ],
+    }
+
+
+def write_csv(data, directory):
+    """One file per section; recipes get their own file keyed by product name."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rows = dict(data)
+    rows['recipes'] = [
+        {'menu_item': item['name'], **line} for item in data['menu_items'] for line in item['recipe']
+    ]
+    for section, columns in CSV_FILES.items():
+        with (directory / f'{section}.csv').open('w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows[section]:
+                writer.writerow({key: '' if value is None else value for key, value in row.items()})
+
+
+def read_file(path):
+    """A .json file, or a directory with the CSV files of write_csv (missing files = sections left alone)."""
+    path = Path(path)
+    if path.is_dir():
+        data = {}
+        for section in CSV_FILES:
+            file = path / f'{section}.csv'
+            if file.exists():
+                with file.open(newline='', encoding='utf-8-sig') as f:
+                    data[section] = list(csv.DictReader(f))
+        recipes = data.pop('recipes', None)
+        if recipes is not None:
+            by_item = defaultdict(list)
+            for line in recipes:
+                by_item[(line.get('menu_item') or '').strip()].append(line)
+            items = {item['name'].strip(): item for item in data.setdefault('menu_items', [])}
+            for name, lines in by_item.items():
+                # Recipe lines of a product not in menu_items.csv: replace the recipe of the existing product
+                items.setdefault(name, {'name': name, '_recipe_only': True})['recipe'] = lines
+            data['menu_items'] = list(items.values())
+            # recipes.csv holds whole recipes: a listed product without lines ends up with none
+            for item in data['menu_items']:
+                item.setdefault('recipe', [])
+        return data
+    return json.loads(path.read_text(encoding='utf-8'))
+
+
+# --- import ---
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'да', '+')
+
+
+def _unique_by_name(model):
+    objects, duplicates = {}, set()
+    for obj in model.objects.all():
+        if obj.name in objects:
+            duplicates.add(obj.name)
+        objects[obj.name] = obj
+    return objects, duplicates
+
+
+class _Diff:
+    """Rows of one table: what to create, what to update, what was already equal."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.created, self.updated, self.unchanged = [], [], 0
+        self.changed_fields = set()
+
+    def apply(self, existing, model, name, values):
+        obj = existing.get(name)
+        if obj is None:
+            obj = existing[name] = model(name=name, **values)
+            self.created.append(obj)
+            return obj
+        changed = False
+        for field, value in values.items():
+            if getattr(obj, field) != value:
+                setattr(obj, field, value)
+                self.changed_fields.add(field)
+                changed = True
+        if changed:
+            self.updated.append(obj)
+        else:
+            self.unchanged += 1
+        return obj
+
+    def save(self, model):
+        model.objects.bulk_create(self.created)
+        if self.updated:
+            # Only the columns that differ somewhere: a repricing is one CASE over price, not over every field
+            fields = [field for field in self.fields if field in self.changed_fields]
+            model.objects.bulk_update(self.updated, fields, batch_size=500)
+
+    def stats(self):
+        return {'created': len(self.created), 'updated': len(self.updated), 'unchanged': self.unchanged}
+
+
+def import_menu(data, dry_run=False):
+    """
+    Applies a menu file (the dict of export_menu / read_file). Returns per-table counts.
+    Raises ValidationError with every problem found before anything is written.
+    """
+    from .models import Ingredient, MenuItem, Modifier, Recipe, Supplier
+
+    errors = []
+
+    def error(section, row_no, message):
+        where = f"#{row_no}" if isinstance(row_no, int) else row_no
+        errors.append(f"{section} {where}: {message}")
+
+    def text(row, key, section, row_no, default=None):
+        value = row.get(key)
+        value = value.strip() if isinstance(value, str) else value
+        if value in (None, ''):
+            if default is None:
+                error(section, row_no, f"'{key}' is required")
+            return default
+        return value
+
+    def decimal(row, key, section, row_no, default=None):
+        value = text(row, key, section, row_no, default)
+        try:
+            return Decimal(str(value).replace(',', '.'))
+        except (InvalidOperation, TypeError):
+            error(section, row_no, f"'{value}' is not a valid {key}")
+
+    def price(row, section, row_no):
+        try:
+            return to_minor(text(row, 'price', section, row_no, '0'))
+        except ValueError:
+            error(section, row_no, f"'{row.get('price')}' is not a valid price")
+
+    def choice(row, key, choices, section, row_no, default):
+        value = text(row, key, section, row_no, default)
+        if value not in dict(choices):
+            error(section, row_no, f"unknown {key} '{value}'")
+        return value
+
+    with transaction.atomic():
+        ingredients, dup_ingredients = _unique_by_name(Ingredient)
+        modifiers, dup_modifiers = _unique_by_name(Modifier)
+        menu_items, dup_items = _unique_by_name(MenuItem)
+        for label, names in (('Ingredient', dup_ingredients), ('Modifier', dup_modifiers), ('Product', dup_items)):
+            if names:
+                errors.append(f"{label} names are not unique in the database, can't match by name: {sorted(names)}")
+        suppliers = dict(Supplier.objects.values_list('name', 'id'))
+
+        file_ingredients = {str(row.get('name', '')).strip() for row in data.get('ingredients', [])}
+        known_ingredients = file_ingredients | set(ingredients)
+
+        def ingredient_ref(row, key, section, row_no, required=False):
+            name = text(row, key, section, row_no, None if required else '')
+            if name and name not in known_ingredients:
+                error(section, row_no, f"unknown ingredient '{name}'")
+            return name or None
+
+        # Parse and check everything first: a half-applied menu is worse than none
+        parsed = {'ingredients': [], 'modifiers': [], 'menu_items': []}
+        for row_no, row in enumerate(data.get('ingredients', []), start=1):
+            section = 'ingredients'
+            supplier = text(row, 'supplier', section, row_no, '')
+            if supplier and supplier not in suppliers:
+                error(section, row_no, f"unknown supplier '{supplier}'")
+            parsed[section].append((text(row, 'name', section, row_no), {
+                'unit': text(row, 'unit', section, row_no),
+                'is_milk': _bool(row.get('is_milk', False)),
+                'min_limit': decimal(row, 'min_limit', section, row_no, '0'),
+                'supplier_id': suppliers.get(supplier),
+            }))
+        for row_no, row in enumerate(data.get('modifiers', []), start=1):
+            section = 'modifiers'
+            parsed[section].append((text(row, 'name', section, row_no), {
+                'price': price(row, section, row_no),
+                'type': choice(row, 'type', Modifier.TYPE_CHOICES, section, row_no, 'other'),
+                'ingredient': ingredient_ref(row, 'ingredient', section, row_no),
+                'quantity_needed': decimal(row, 'quantity_needed', section, row_no, '0'),
+                'action': choice(row, 'action', Modifier.ACTION_CHOICES, section, row_no, 'add'),
+                'target': ingredient_ref(row, 'target', section, row_no),
+            }))
+        for row_no, row in enumerate(data.get('menu_items', []), start=1):
+            section = 'menu_items'
+            name = text(row, 'name', section, row_no)
+            if row.get('_recipe_only'):
+                values = None
+                if name not in menu_items:
+                    error('recipes', f"of '{name}'", "unknown product")
+            else:
+                values = {
+                    'price': price(row, section, row_no),
+                    'category': choice(row, 'category', MenuItem.CATEGORY_CHOICES, section, row_no, 'coffee'),
+                    **{field: _bool(row.get(field, field == 'is_sized')) for field in MENU_ITEM_FIELDS[2:]},
+                }
+            recipe = None
+            if 'recipe' in row:
+                recipe = {}
+                for line_no, line in enumerate(row['recipe'], start=1):
+                    where = f"'{name}' recipe line {line_no}"
+                    ingredient = ingredient_ref(line, 'ingredient', section, where, required=True)
+                    quantity = decimal(line, 'quantity', section, where)
+                    if ingredient in recipe:
+                        error(section, where, f"'{ingredient}' is listed twice")
+                    recipe[ingredient] = (quantity, _bool(line.get('scales_with_size', True)))
+            parsed[section].append((name, values, recipe))
+
+        for section, rows in parsed.items():
+            seen = set()
+            for row_no, (name, *_) in enumerate(rows, start=1):
+                if name in seen:
+                    error(section, row_no, f"'{name}' appears twice in the file")
+                seen.add(name)
+        if errors:
+            raise ValidationError(errors)
+
+        # Ingredients first: modifiers and recipes point at them
+        ingredient_diff = _Diff(INGREDIENT_FIELDS)
+        for name, values in parsed['ingredients']:
+            ingredient_diff.apply(ingredients, Ingredient, name, values)
+        ingredient_diff.save(Ingredient)
+
+        modifier_diff = _Diff(MODIFIER_FIELDS)
+        for name, values in parsed['modifiers']:
+            values = dict(values)
+            for key in ('ingredient', 'target'):
+                ref = values.pop(key)
+                values[f'{key}_id'] = ingredients[ref].pk if ref else None
+            modifier_diff.apply(modifiers, Modifier, name, values)
+        modifier_diff.save(Modifier)
+
+        item_diff = _Diff(MENU_ITEM_FIELDS)
+        recipes = []
+        for name, values, recipe in parsed['menu_items']:
+            item = menu_items[name] if values is None else item_diff.apply(menu_items, MenuItem, name, values)
+            if recipe is not None:
+                recipes.append((item, recipe))
+        item_diff.save(MenuItem)
+
+        # Recipes: the file's lines are the whole recipe of each product it lists
+        recipe_stats = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        current = defaultdict(dict)
+        for line in Recipe.objects.filter(menu_item__in=[item.pk for item, _ in recipes]):
+            current[line.menu_item_id][line.ingredient_id] = line
+        new_lines, changed_lines, stale_ids = [], [], []
+        for item, recipe in recipes:
+            existing = current.get(item.pk, {})
+            for ingredient_name, (quantity, scales) in recipe.items():
+                ingredient_id = ingredients[ingredient_name].pk
+                line = existing.pop(ingredient_id, None)
+                if line is None:
+                    new_lines.append(Recipe(
+                        menu_item=item, ingredient_id=ingredient_id, quantity_needed=quantity, scales_with_size=scales,
+                    ))
+                elif line.quantity_needed != quantity or line.scales_with_size != scales:
+                    line.quantity_needed, line.scales_with_size = quantity, scales
+                    changed_lines.append(line)
+                else:
+                    recipe_stats['unchanged'] += 1
+            stale_ids.extend(line.pk for line in existing.values())
+        Recipe.objects.bulk_create(new_lines)
+        Recipe.objects.bulk_update(changed_lines, ['quantity_needed', 'scales_with_size'], batch_size=500)
+        if stale_ids:
+            Recipe.objects.filter(pk__in=stale_ids).delete()
+        recipe_stats.update(created=len(new_lines), updated=len(changed_lines), deleted=len(stale_ids))
+
+        stats = {
+            'ingredients': ingredient_diff.stats(),
+            'modifiers': modifier_diff.stats(),
+            'menu_items': item_diff.stats(),
+            'recipes': recipe_stats,
+        }
+        touched = any(
+            counts['created'] or counts['updated'] or counts.get('deleted') for counts in stats.values()
+        )
+        if dry_run:
+            transaction.set_rollback(True)
+        elif touched:
+            # Bulk writes send no post_save: one invalidation for the whole import
+            rules.invalidate()
+            sellable.invalidate()
+            menu_search.invalidate()
+            menu.changed()
+    return stats
@@ -0,0 +1,222 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import replica
+
+# Upper bounds (seconds) of the prep-time histogram buckets, the last bucket is "longer than 1h"
+BUCKET_BOUNDS = [15, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 2700, 3600]
+
+# When a histogram holds more samples than this, all counts are halved,
+# so old rushes fade out and the percentiles follow the current pace
+DECAY_AT = 500
+
+FLUSH_INTERVAL = 60          # seconds between writes of the histograms to the DB
+DEFAULT_PREP_SECONDS = 180   # used until we have seen real drinks
+MAX_READY_GAP = 900          # gaps between "ready" clicks longer than this are idle time, not work
+QUEUE_RESYNC = 30            # seconds between recounts of the queue: other workers move it too
+STARTED_TTL = 7200           # a "Start" older than this was finished elsewhere (another worker) or never
+EWMA_ALPHA = 0.2
+
+
+class PrepTimeHistogram:
+    """Fixed-bucket histogram: O(1) insert, percentiles in O(number of buckets)."""
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0.0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = sum(self.counts)
+
+    def add(self, seconds):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += 1
+        if self.total > DECAY_AT:
+            self.counts = [c / 2 for c in self.counts]
+            self.total /= 2
+
+    def percentile(self, q):
+        if not self.total:
+            return None
+        rank = self.total * q
+        seen = 0.0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKET_BOUNDS[i - 1] if i > 0 else 0
+                high = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else BUCKET_BOUNDS[-1] * 2
+                # Linear interpolation inside the bucket
+                return round(low + (high - low) * (rank - seen) / count)
+            seen += count
+        return BUCKET_BOUNDS[-1]
+
+    def summary(self):
+        return {
+            'samples': round(self.total),
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class BaristaMetrics:
+    """
+    In-memory throughput engine fed by order status transitions.
+    Every event costs O(1): a bucket increment per key plus a couple of counters,
+    no scanning of the orders table. Histograms are persisted to PrepTimeStat
+    every FLUSH_INTERVAL seconds and loaded back on the first use after a restart.
+    Each worker only sees its own events, so the queue depth is recounted every
+    QUEUE_RESYNC seconds (one indexed COUNT) and stale "Start" times are dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = None
+        self._dirty = set()
+        self._started = {}           # order_id -> when the barista pressed "Start"
+        self._queue_depth = None     # orders in pending/preparing
+        self._depth_counted_at = None
+        self._ready_interval = None  # EWMA of seconds between finished orders
+        self._last_ready_at = None
+        self._last_flush = time.monotonic()
+
+    # --- loading ---
+
+    def _ensure_loaded(self):
+        if self._histograms is not None:
+            return
+        from .models import PrepTimeStat
+
+        # From the primary even when first used by a report page: the engine serves the tills
+        with replica.primary():
+            self._histograms = {
+                stat.key: PrepTimeHistogram(stat.counts) for stat in PrepTimeStat.objects.all()
+            }
+        # Counted on startup and every QUEUE_RESYNC seconds, maintained from events in between
+        self._count_queue()
+
+    def _count_queue(self):
+        from .models import Order
+
+        with replica.primary():
+            self._queue_depth = Order.objects.filter(status__in=['pending', 'preparing']).count()
+        self._depth_counted_at = time.monotonic()
+
+    def _evict_started(self, now):
+        # Kept in "Start" order, so the stale ones are at the front
+        while self._started:
+            order_id, started_at = next(iter(self._started.items()))
+            if (now - started_at).total_seconds() <= STARTED_TTL:
+                break
+            del self._started[order_id]
+
+    def _histogram(self, key):
+        if key not in self._histograms:
+            self._histograms[key] = PrepTimeHistogram()
+        self._dirty.add(key)
+        return self._histograms[key]
+
+    # --- events ---
+
+    def order_created(self):
+        with self._lock:
+            if self._histograms is None:
+                # The startup count already includes the order we were told about
+                self._ensure_loaded()
+                return
+            self._queue_depth += 1
+
+    def record_transitions(self, orders, new_status, at, menu_items=None):
+        """
+        orders: list of (order_id, old_status, created_at).
+        menu_items: {order_id: [(menu_item_id, category), ...]}, needed for "ready" events.
+        """
+        menu_items = menu_items or {}
+        with self._lock:
+            self._ensure_loaded()
+            finished = 0
+            for order_id, old_status, created_at in orders:
+                if new_status == 'preparing':
+                    self._started.pop(order_id, None)
+                    self._started[order_id] = at
+                    continue
+                if new_status != 'ready' or old_status not in ('pending', 'preparing'):
+                    continue
+
+                finished += 1
+                self._queue_depth = max(self._queue_depth - 1, 0)
+                started_at = self._started.pop(order_id, None) or created_at
+                prep_seconds = max((at - started_at).total_seconds(), 0)
+                wait_seconds = max((at - created_at).total_seconds(), 0)
+
+                self._histogram('prep:all').add(prep_seconds)
+                self._histogram('wait:all').add(wait_seconds)
+                for menu_item_id, category in set(menu_items.get(order_id, [])):
+                    self._histogram(f'prep:station:{category}').add(prep_seconds)
+                    self._histogram(f'prep:item:{menu_item_id}').add(prep_seconds)
+
+            if new_status == 'preparing':
+                self._evict_started(at)
+            if finished:
+                # A bulk "ready" counts as several orders finished over the same gap
+                if self._last_ready_at is not None:
+                    gap = (at - self._last_ready_at).total_seconds()
+                    if 0 < gap <= MAX_READY_GAP:
+                        interval = gap / finished
+                        if self._ready_interval is None:
+                            self._ready_interval = interval
+                        else:
+                            self._ready_interval += EWMA_ALPHA * (interval - self._ready_interval)
+                self._last_ready_at = at
+
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    # --- reading ---
+
+    def estimated_wait(self):
+        """Seconds a new order will wait: the queue ahead of it plus its own prep time."""
+        with self._lock:
+            self._ensure_loaded()
+            if time.monotonic() - self._depth_counted_at >= QUEUE_RESYNC:
+                self._count_queue()
+            prep = self._histograms.get('prep:all')
+            own_prep = (prep.percentile(0.5) if prep else None) or DEFAULT_PREP_SECONDS
+            per_order = self._ready_interval or own_prep
+            return {
+                'queue_depth': self._queue_depth,
+                'wait_seconds': round(self._queue_depth * per_order + own_prep),
+            }
+
+    def snapshot(self):
+        with self._lock:
+            self._ensure_loaded()
+            return {key: hist.summary() for key, hist in sorted(self._histograms.items())}
+
+    # --- persistence ---
+
+    def flush(self):
+        from .models import PrepTimeStat
+
+        with self._lock:
+            if not self._dirty:
+                self._last_flush = time.monotonic()
+                return
+            dirty = {key: list(self._histograms[key].counts) for key in self._dirty}
+            self._dirty = set()
+            self._last_flush = time.monotonic()
+
+        now = timezone.now()
+        with replica.primary(), transaction.atomic():
+            existing = {s.key: s for s in PrepTimeStat.objects.filter(key__in=dirty)}
+            for stat in existing.values():
+                stat.counts = dirty[stat.key]
+                stat.updated_at = now
+            PrepTimeStat.objects.bulk_update(existing.values(), ['counts', 'updated_at'])
+            PrepTimeStat.objects.bulk_create([
+                PrepTimeStat(key=key, counts=counts, updated_at=now)
+                for key, counts in dirty.items() if key not in existing
+            ])
+
+
+metrics = BaristaMetrics()
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0012_order_status_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrepTimeStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True, verbose_name='Metric')),
+                ('counts', models.JSONField(default=list, verbose_name='Bucket Counts')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Updated at')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0013_prep_time_stat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='cogs',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Cost of Goods Sold'),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField(verbose_name='Received at')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=10, verbose_name='Quantity')),
+                ('remaining', models.DecimalField(decimal_places=3, max_digits=10, verbose_name='Remaining')),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Unit Cost')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='coffee.ingredient')),
+                ('supply_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cost_layers', to='coffee.supplyitem')),
+            ],
+            options={
+                'ordering': ['received_at', 'id'],
+                'indexes': [models.Index(fields=['ingredient', 'received_at'], name='coffee_cost_ingredi_fb055f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:29
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def close_duplicate_shifts(apps, schema_editor):
+    # Keep only the newest open shift, the rest were opened by the old check-then-create race
+    Shift = apps.get_model('coffee', 'Shift')
+    db = schema_editor.connection.alias
+    active = list(Shift.objects.using(db).filter(is_active=True).order_by('-opened_at', '-id').values_list('id', flat=True))
+    if len(active) > 1:
+        Shift.objects.using(db).filter(pk__in=active[1:]).update(is_active=False, closed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0014_cost_layers_and_cogs'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_shifts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shift',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='unique_active_shift'),
+        ),
+    ]
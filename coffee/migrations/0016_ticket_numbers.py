@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0015_unique_active_shift'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('scope', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('value', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='ticket_number',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ticket #'),
+        ),
+    ]
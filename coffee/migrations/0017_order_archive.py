@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0016_ticket_numbers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True, verbose_name='File')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+                ('order_count', models.IntegerField(default=0, verbose_name='Orders')),
+                ('size_bytes', models.BigIntegerField(default=0, verbose_name='Size (bytes)')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('menu_item_name', models.CharField(max_length=100, verbose_name='Product')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenue')),
+                ('cogs', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='COGS')),
+                ('menu_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='coffee.menuitem')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('order_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('shift_id', models.BigIntegerField(blank=True, null=True)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='coffee.archivesegment')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'menu_item_name'), name='unique_daily_rollup'),
+        ),
+    ]
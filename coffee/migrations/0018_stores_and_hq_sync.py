@@ -0,0 +1,150 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:38
+
+import coffee.stores
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_local_store(apps, schema_editor):
+    # Everything recorded so far belongs to this install's store
+    Store = apps.get_model('coffee', 'Store')
+    db = schema_editor.connection.alias
+    code = getattr(settings, 'STORE_CODE', 'main')
+    store, _ = Store.objects.using(db).get_or_create(code=code, defaults={'name': code})
+    for name in ('Shift', 'Order', 'Ingredient', 'Supply'):
+        apps.get_model('coffee', name).objects.using(db).filter(store__isnull=True).update(store=store)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0017_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HQOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_code', models.CharField(max_length=30, verbose_name='Store')),
+                ('source_id', models.BigIntegerField(verbose_name='Order # in store')),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('preparing', 'Preparing'), ('ready', 'Ready'), ('completed', 'Completed')], max_length=20)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('shift_id', models.BigIntegerField(blank=True, null=True)),
+                ('ticket_number', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HQOrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('menu_item_name', models.CharField(max_length=100)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('size', models.CharField(default='M', max_length=1)),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('cogs', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HQStockLevel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_code', models.CharField(max_length=30, verbose_name='Store')),
+                ('source_id', models.BigIntegerField()),
+                ('ingredient_name', models.CharField(max_length=100)),
+                ('unit', models.CharField(max_length=10)),
+                ('amount', models.DecimalField(decimal_places=3, default=0, max_digits=10)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HQSupplyLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_code', models.CharField(max_length=30, verbose_name='Store')),
+                ('source_id', models.BigIntegerField()),
+                ('received_at', models.DateTimeField()),
+                ('ingredient_name', models.CharField(max_length=100)),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('cost', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Store',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.SlugField(max_length=30, unique=True, verbose_name='Code')),
+                ('name', models.CharField(max_length=100, verbose_name='Name')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Active')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('feed', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='hqsupplyline',
+            constraint=models.UniqueConstraint(fields=('store_code', 'source_id'), name='unique_hq_supply_line'),
+        ),
+        migrations.AddConstraint(
+            model_name='hqstocklevel',
+            constraint=models.UniqueConstraint(fields=('store_code', 'source_id'), name='unique_hq_stock_level'),
+        ),
+        migrations.AddField(
+            model_name='hqorderline',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='coffee.hqorder'),
+        ),
+        migrations.AddConstraint(
+            model_name='hqorder',
+            constraint=models.UniqueConstraint(fields=('store_code', 'source_id'), name='unique_hq_order'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ingredients', to='coffee.store', verbose_name='Store'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='coffee.store'),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='shifts', to='coffee.store', verbose_name='Store'),
+        ),
+        migrations.AddField(
+            model_name='supply',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='supplies', to='coffee.store', verbose_name='Store'),
+        ),
+        # The default only matters for new rows, added after the backfill so the migration never calls it
+        migrations.RunPython(assign_local_store, migrations.RunPython.noop, hints={'model_name': 'store'}),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='store',
+            field=models.ForeignKey(blank=True, default=coffee.stores.current_store_id, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ingredients', to='coffee.store', verbose_name='Store'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='store',
+            field=models.ForeignKey(blank=True, default=coffee.stores.current_store_id, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='coffee.store'),
+        ),
+        migrations.AlterField(
+            model_name='shift',
+            name='store',
+            field=models.ForeignKey(blank=True, default=coffee.stores.current_store_id, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='shifts', to='coffee.store', verbose_name='Store'),
+        ),
+        migrations.AlterField(
+            model_name='supply',
+            name='store',
+            field=models.ForeignKey(blank=True, default=coffee.stores.current_store_id, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='supplies', to='coffee.store', verbose_name='Store'),
+        ),
+    ]
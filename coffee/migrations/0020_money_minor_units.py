@@ -0,0 +1,109 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:49
+
+from decimal import Decimal
+
+import coffee.money
+from django.db import migrations, router
+from django.db.models import F
+from django.db.models.functions import Round
+
+MONEY_FIELDS = {
+    'Shift': ['total_sales'],
+    'MenuItem': ['price'],
+    'Modifier': ['price'],
+    'Order': ['total_price'],
+    'OrderItem': ['price', 'cogs'],
+    'ArchivedOrder': ['total_price'],
+    'DailySalesRollup': ['revenue', 'cogs'],
+    'HQOrder': ['total_price'],
+    'HQOrderLine': ['price', 'cogs'],
+}
+
+
+def _rescale(apps, schema_editor, expression):
+    db = schema_editor.connection.alias
+    for name, fields in MONEY_FIELDS.items():
+        model = apps.get_model('coffee', name)
+        if router.allow_migrate_model(db, model):
+            model.objects.using(db).update(**{field: expression(field) for field in fields})
+
+
+def tenge_to_tiyn(apps, schema_editor):
+    # ROUND: SQLite keeps decimals as REAL, 0.29 * 100 is 28.999...
+    _rescale(apps, schema_editor, lambda field: Round(F(field) * 100))
+
+
+def tiyn_to_tenge(apps, schema_editor):
+    _rescale(apps, schema_editor, lambda field: F(field) * Decimal('0.01'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0019_order_created_at_index'),
+    ]
+
+    operations = [
+        # Values are rescaled while the columns are still decimal, then the columns become integers
+        migrations.RunPython(tenge_to_tiyn, tiyn_to_tenge),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='total_price',
+            field=coffee.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='dailysalesrollup',
+            name='cogs',
+            field=coffee.money.MoneyField(default=0, verbose_name='COGS'),
+        ),
+        migrations.AlterField(
+            model_name='dailysalesrollup',
+            name='revenue',
+            field=coffee.money.MoneyField(default=0, verbose_name='Revenue'),
+        ),
+        migrations.AlterField(
+            model_name='hqorder',
+            name='total_price',
+            field=coffee.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='hqorderline',
+            name='cogs',
+            field=coffee.money.MoneyField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='hqorderline',
+            name='price',
+            field=coffee.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='price',
+            field=coffee.money.MoneyField(verbose_name='Base Price'),
+        ),
+        migrations.AlterField(
+            model_name='modifier',
+            name='price',
+            field=coffee.money.MoneyField(default=0, verbose_name='Price'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total_price',
+            field=coffee.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='cogs',
+            field=coffee.money.MoneyField(blank=True, null=True, verbose_name='Cost of Goods Sold'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='price',
+            field=coffee.money.MoneyField(default=0, verbose_name='Price at Sale'),
+        ),
+        migrations.AlterField(
+            model_name='shift',
+            name='total_sales',
+            field=coffee.money.MoneyField(default=0, verbose_name='Total Sales'),
+        ),
+    ]
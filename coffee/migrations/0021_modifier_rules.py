@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_rules(apps, schema_editor):
+    db = schema_editor.connection.alias
+    # Milk modifiers always stood in for the recipe's milk (Order.finish_order, COGS)
+    Modifier = apps.get_model('coffee', 'Modifier')
+    Modifier.objects.using(db).filter(type='milk').update(action='replace')
+    # Counted ingredients (cups, pastries) were scaled by size too: 1.3 cups for a large drink
+    Recipe = apps.get_model('coffee', 'Recipe')
+    Recipe.objects.using(db).filter(ingredient__unit__iregex=r'^(pcs?|шт\.?)$').update(scales_with_size=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0020_money_minor_units'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modifier',
+            name='action',
+            field=models.CharField(choices=[('add', 'Add ingredient'), ('replace', 'Replace ingredient'), ('remove', 'Remove ingredient')], default='add', max_length=10, verbose_name='Action'),
+        ),
+        migrations.AddField(
+            model_name='modifier',
+            name='target',
+            field=models.ForeignKey(blank=True, help_text='Empty with Replace: every milk ingredient of the recipe', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='coffee.ingredient', verbose_name='Replaces / Removes'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='scales_with_size',
+            field=models.BooleanField(default=True, verbose_name='Scales with Size'),
+        ),
+        migrations.RunPython(seed_rules, migrations.RunPython.noop),
+    ]
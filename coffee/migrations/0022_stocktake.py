@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:59
+
+import coffee.stores
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0021_modifier_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stocktake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counted_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Counted at')),
+                ('note', models.CharField(blank=True, max_length=200, verbose_name='Note')),
+                ('store', models.ForeignKey(blank=True, default=coffee.stores.current_store_id, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stocktakes', to='coffee.store', verbose_name='Store')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StocktakeLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counted', models.DecimalField(decimal_places=3, max_digits=10, verbose_name='Counted')),
+                ('book_amount', models.DecimalField(decimal_places=3, default=0, editable=False, max_digits=10, verbose_name='Book Amount')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stocktake_lines', to='coffee.ingredient', verbose_name='Ingredient')),
+                ('stocktake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='coffee.stocktake')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stocktakeline',
+            constraint=models.UniqueConstraint(fields=('stocktake', 'ingredient'), name='unique_stocktake_ingredient'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0022_stocktake'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='supply',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Supply Date'),
+        ),
+    ]
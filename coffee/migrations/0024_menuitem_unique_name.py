@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:12
+
+from django.db import migrations, models
+
+
+def rename_duplicate_items(apps, schema_editor):
+    # Products used to share names freely; the later ones get a " (2)", " (3)" suffix
+    db = schema_editor.connection.alias
+    MenuItem = apps.get_model('coffee', 'MenuItem')
+    taken = set()
+    for item in MenuItem.objects.using(db).order_by('id'):
+        name, n = item.name, 1
+        while name in taken:
+            n += 1
+            suffix = f" ({n})"
+            name = item.name[:100 - len(suffix)] + suffix
+        taken.add(name)
+        if name != item.name:
+            item.name = name
+            item.save(using=db, update_fields=['name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0023_supply_created_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_items, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 21:40
+
+from django.db import migrations, models
+
+
+def sync_completed_flag(apps, schema_editor):
+    # The barista screen and the admin action used to complete orders without setting the flag
+    db = schema_editor.connection.alias
+    Order = apps.get_model('coffee', 'Order')
+    Order.objects.using(db).filter(status='completed', is_completed=False).update(is_completed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coffee', '0024_menuitem_unique_name'),
+    ]
+
+    operations = [
+        # Existing orders count as written off: the till took their stock at intake and completed
+        # ones had it taken by finish_order; taking it again on completion would count it twice
+        migrations.AddField(
+            model_name='order',
+            name='stock_written_off',
+            field=models.BooleanField(default=True, verbose_name='Stock written off'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='stock_written_off',
+            field=models.BooleanField(default=False, verbose_name='Stock written off'),
+        ),
+        migrations.RunPython(sync_completed_flag, migrations.RunPython.noop),
+    ]
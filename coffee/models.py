@@ -1,5 +1,4 @@
 from django.db import models, transaction
-from decimal import Decimal
 from django.core.exceptions import ValidationError
 from django.db.models import Sum
 from django.core.mail import send_mail
@@ -7,14 +6,35 @@ from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 
+from .money import MoneyField, line_price
+from .stores import current_store_id
+
+class Store(models.Model):
+    # One coffee shop. Each store normally has its own database (coffee/stores.py)
+    code = models.SlugField(max_length=30, unique=True, verbose_name="Code")
+    name = models.CharField(max_length=100, verbose_name="Name")
+    is_active = models.BooleanField(default=True, verbose_name="Active")
+
+    def __str__(self):
+        return self.name
+
 class Shift(models.Model):
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, null=True, blank=True, default=current_store_id, related_name='shifts', verbose_name="Store")
     opened_at = models.DateTimeField(auto_now_add=True, verbose_name="Opened at")
     closed_at = models.DateTimeField(null=True, blank=True, verbose_name="Closed at")
     is_active = models.BooleanField(default=True, verbose_name="Active")
     
-    total_sales = models.DecimalField(max_digits=10, decimal_places=0, default=0, verbose_name="Total Sales")
+    total_sales = MoneyField(default=0, verbose_name="Total Sales")
     order_count = models.IntegerField(default=0, verbose_name="Order Count")
 
+    class Meta:
+        constraints = [
+            # At most one open shift; also serves as the index for the active-shift lookup
+            models.UniqueConstraint(
+                fields=['is_active'], condition=models.Q(is_active=True), name='unique_active_shift'
+            ),
+        ]
+
     def __str__(self):
         status = "Open" if self.is_active else "Closed"
         return f"Shift #{self.id} ({status})"
@@ -27,6 +47,7 @@ class Supplier(models.Model):
         return self.name
 
 class Ingredient(models.Model):
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, null=True, blank=True, default=current_store_id, related_name='ingredients', verbose_name="Store")
     name = models.CharField(max_length=100, verbose_name="Name")
     unit = models.CharField(max_length=10, verbose_name="Unit (ml/g)")
     amount = models.DecimalField(max_digits=10, decimal_places=3, default=0, verbose_name="Stock Amount")
@@ -40,7 +61,8 @@ class Ingredient(models.Model):
         return f"{self.name} ({self.amount} {self.unit})"
 
 class Supply(models.Model):
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Supply Date")
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, null=True, blank=True, default=current_store_id, related_name='supplies', verbose_name="Store")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Supply Date")
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, verbose_name="Supplier")
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Total Cost")
 
@@ -61,10 +83,12 @@ class SupplyItem(models.Model):
     cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Total Item Cost")
 
     def clean(self):
+        if self.quantity is not None and self.quantity <= 0:
+            raise ValidationError("Quantity must be positive!")
         if not self.unit_price and not self.cost:
             raise ValidationError("Please fill in 'Unit Price' OR 'Total Item Cost'!")
 
-    def save(self, *args, **kwargs):
+    def fill_prices(self):
         if self.unit_price and not self.cost:
             self.cost = self.unit_price * self.quantity
         elif self.cost and not self.unit_price:
@@ -72,25 +96,76 @@ class SupplyItem(models.Model):
         elif self.cost and self.unit_price:
             self.cost = self.unit_price * self.quantity
 
+    def save(self, *args, **kwargs):
+        self.fill_prices()
+
+        from . import stock
+
         with transaction.atomic():
+            # Deltas, not the amount read into self.ingredient: orders may have used stock since
+            deltas = {self.ingredient_id: self.quantity}
             if self.pk:
-                old_instance = SupplyItem.objects.select_for_update().get(pk=self.pk)
-                self.ingredient.amount -= old_instance.quantity
-            
-            self.ingredient.amount += self.quantity
-            self.ingredient.reorder_sent = False
-            self.ingredient.save()
-            
+                old_ingredient_id, old_quantity = SupplyItem.objects.select_for_update().values_list(
+                    'ingredient_id', 'quantity'
+                ).get(pk=self.pk)
+                deltas[old_ingredient_id] = deltas.get(old_ingredient_id, 0) - old_quantity
+            stock.apply(deltas, restock=True)
+
             super().save(*args, **kwargs)
             self.supply.update_total()
 
+            from .costing import sync_supply_layers
+            sync_supply_layers(self.supply, [self])
+
     def delete(self, *args, **kwargs):
+        from . import stock
+
         with transaction.atomic():
-            self.ingredient.amount -= self.quantity
-            self.ingredient.save()
+            stock.apply({self.ingredient_id: -self.quantity})
+            self.cost_layers.all().delete()
             super().delete(*args, **kwargs)
             self.supply.update_total()
 
+class CostLayer(models.Model):
+    # One purchase lot of an ingredient; orders consume `remaining` (see coffee.costing)
+    ingredient = models.ForeignKey(Ingredient, related_name='cost_layers', on_delete=models.CASCADE)
+    supply_item = models.ForeignKey(SupplyItem, related_name='cost_layers', on_delete=models.SET_NULL, null=True, blank=True)
+    received_at = models.DateTimeField(verbose_name="Received at")
+    quantity = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Quantity")
+    remaining = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Remaining")
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, verbose_name="Unit Cost")
+
+    class Meta:
+        ordering = ['received_at', 'id']
+        indexes = [models.Index(fields=['ingredient', 'received_at'])]
+
+    def __str__(self):
+        return f"{self.ingredient.name}: {self.remaining}/{self.quantity} @ {self.unit_cost}"
+
+class Stocktake(models.Model):
+    # A physical count of the shelves; coffee/variance.py compares it with what the orders say was used
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, null=True, blank=True, default=current_store_id, related_name='stocktakes', verbose_name="Store")
+    counted_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="Counted at")
+    note = models.CharField(max_length=200, blank=True, verbose_name="Note")
+
+    def __str__(self):
+        return f"Stocktake #{self.id} ({timezone.localtime(self.counted_at):%d.%m.%Y %H:%M})"
+
+class StocktakeLine(models.Model):
+    stocktake = models.ForeignKey(Stocktake, related_name='lines', on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, related_name='stocktake_lines', on_delete=models.CASCADE, verbose_name="Ingredient")
+    counted = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Counted")
+    # Ingredient.amount when the count was entered; the stock is then corrected to `counted`
+    book_amount = models.DecimalField(max_digits=10, decimal_places=3, default=0, editable=False, verbose_name="Book Amount")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stocktake', 'ingredient'], name='unique_stocktake_ingredient'),
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient.name}: {self.counted}"
+
 class MenuItem(models.Model):
     CATEGORY_CHOICES = [
         ('coffee', 'Coffee'),
@@ -101,8 +176,9 @@ class MenuItem(models.Model):
         ('other', 'Other'),
     ]
     
-    name = models.CharField(max_length=100)
-    price = models.DecimalField(max_digits=8, decimal_places=2, verbose_name="Base Price")
+    # Unique: orders from older tills and the menu import find products by name
+    name = models.CharField(max_length=100, unique=True)
+    price = MoneyField(verbose_name="Base Price")
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, default='coffee', verbose_name="Category")
     
     is_sized = models.BooleanField(default=True, verbose_name="Has Sizes (S/M/L)")
@@ -119,6 +195,8 @@ class Recipe(models.Model):
     menu_item = models.ForeignKey(MenuItem, related_name='recipes', on_delete=models.CASCADE)
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     quantity_needed = models.DecimalField(max_digits=10, decimal_places=3, verbose_name="Quantity Needed (M)")
+    # Cups, lids, a croissant: one per portion whatever the size
+    scales_with_size = models.BooleanField(default=True, verbose_name="Scales with Size")
 
     def __str__(self):
         return f"{self.ingredient.name} for {self.menu_item.name}"
@@ -131,62 +209,66 @@ class Modifier(models.Model):
         ('ice', 'Ice'),
     ]
 
+    # What the modifier does to the recipe, see coffee/rules.py
+    ACTION_CHOICES = [
+        ('add', 'Add ingredient'),
+        ('replace', 'Replace ingredient'),
+        ('remove', 'Remove ingredient'),
+    ]
+
     name = models.CharField(max_length=100, verbose_name="Name")
-    price = models.DecimalField(max_digits=6, decimal_places=2, default=0, verbose_name="Price")
+    price = MoneyField(default=0, verbose_name="Price")
     
     type = models.CharField(max_length=20, choices=TYPE_CHOICES, default='other', verbose_name="Type")
     
     ingredient = models.ForeignKey(Ingredient, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Inventory Deduction")
     quantity_needed = models.DecimalField(max_digits=10, decimal_places=3, default=0, verbose_name="Quantity Needed")
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default='add', verbose_name="Action")
+    target = models.ForeignKey(Ingredient, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Replaces / Removes", help_text="Empty with Replace: every milk ingredient of the recipe")
 
     def __str__(self):
         return f"{self.name} ({self.get_type_display()})"
 
+class TicketCounter(models.Model):
+    # Last issued ticket number per scope ('shift:12' or 'day:2024-05-01'), see coffee/tickets.py
+    scope = models.CharField(max_length=40, primary_key=True)
+    value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope}: {self.value}"
+
 class Order(models.Model):
-    created_at = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, default='pending') 
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('preparing', 'Preparing'),
+        ('ready', 'Ready'),
+        ('completed', 'Completed'),
+    ]
+
+    # Allowed barista workflow moves: current status -> possible next statuses
+    STATUS_TRANSITIONS = {
+        'pending': {'preparing', 'ready'},
+        'preparing': {'ready'},
+        'ready': {'completed'},
+        'completed': set(),
+    }
+
+    store = models.ForeignKey(Store, on_delete=models.PROTECT, null=True, blank=True, default=current_store_id, related_name='orders')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    ticket_number = models.PositiveIntegerField(null=True, blank=True, verbose_name="Ticket #")
     is_completed = models.BooleanField(default=False)
-    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # The till takes the ingredients at intake; orders typed into the admin only when completed
+    stock_written_off = models.BooleanField(default=False, verbose_name="Stock written off")
+    total_price = MoneyField(default=0)
     shift = models.ForeignKey(Shift, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
 
-    @transaction.atomic
     def finish_order(self):
-        if self.is_completed:
-            return
-
-        order_items = self.items.select_related('menu_item').prefetch_related(
-            'menu_item__recipes__ingredient', 
-            'modifiers__ingredient'
-        )
-
-        for item in order_items:
-            has_alternative_milk = item.modifiers.filter(type='milk').exists()
-
-            size_map = {'S': Decimal('0.7'), 'M': Decimal('1.0'), 'L': Decimal('1.3')}
-            multiplier = size_map.get(item.size, Decimal('1.0'))
-
-            for recipe in item.menu_item.recipes.all():
-                if has_alternative_milk and recipe.ingredient.is_milk:
-                    continue 
-
-                needed = recipe.quantity_needed * multiplier * item.quantity
-                Ingredient.objects.filter(pk=recipe.ingredient.pk).update(
-                    amount=models.F('amount') - needed
-                )
-
-            for mod in item.modifiers.all():
-                if mod.ingredient:
-                    if mod.type == 'milk':
-                         needed_mod = mod.quantity_needed * multiplier * item.quantity
-                    else:
-                         needed_mod = mod.quantity_needed * item.quantity
-                    
-                    Ingredient.objects.filter(pk=mod.ingredient.pk).update(
-                        amount=models.F('amount') - needed_mod
-                    )
-
-        self.is_completed = True
-        self.save()
+        """Completes the order the same way as the admin action and the barista screen (services.complete_orders)."""
+        from .services import complete_orders
+
+        complete_orders([self.pk])
+        self.refresh_from_db(fields=['status', 'is_completed', 'stock_written_off'])
         
     def _send_official_email(self, ing):
         try:
@@ -240,12 +322,155 @@ class OrderItem(models.Model):
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     size = models.CharField(max_length=1, choices=SIZE_CHOICES, default='M')
-    price = models.DecimalField(max_digits=10, decimal_places=0, default=0, verbose_name="Price at Sale")
+    price = MoneyField(default=0, verbose_name="Price at Sale")
+    cogs = MoneyField(null=True, blank=True, verbose_name="Cost of Goods Sold")
     modifiers = models.ManyToManyField(Modifier, blank=True)
 
     @property
     def final_price(self):
-        size_prices = {'S': Decimal('0.8'), 'M': Decimal('1.0'), 'L': Decimal('1.25')}
-        base = self.menu_item.price * size_prices.get(self.size, Decimal('1.0'))
-        mods_price = self.modifiers.aggregate(total=Sum('price'))['total'] or 0
-        return (base + mods_price) * self.quantity
\ No newline at end of file
+        mod_prices = self.modifiers.values_list('price', flat=True)
+        return line_price(self.menu_item.price, self.size, mod_prices, self.quantity, self.menu_item.is_sized)
+
+class OrderStatusEvent(models.Model):
+    order = models.ForeignKey(Order, related_name='status_events', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="From")
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="To")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="Changed at")
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+class PrepTimeStat(models.Model):
+    # Persisted histogram of coffee.metrics (key like 'prep:item:4', 'prep:station:coffee')
+    key = models.CharField(max_length=100, unique=True, verbose_name="Metric")
+    counts = models.JSONField(default=list, verbose_name="Bucket Counts")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="Updated at")
+
+    def __str__(self):
+        return self.key
+
+
+class ArchiveSegment(models.Model):
+    # Append-only file of zlib-compressed orders (coffee/archive.py)
+    path = models.CharField(max_length=255, unique=True, verbose_name="File")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Created at")
+    order_count = models.IntegerField(default=0, verbose_name="Orders")
+    size_bytes = models.BigIntegerField(default=0, verbose_name="Size (bytes)")
+    sha256 = models.CharField(max_length=64, blank=True, verbose_name="SHA-256")
+
+    def __str__(self):
+        return self.path
+
+
+class ArchivedOrder(models.Model):
+    # Index entry: where an archived order lives inside its segment
+    order_id = models.BigIntegerField(primary_key=True)
+    segment = models.ForeignKey(ArchiveSegment, related_name='orders', on_delete=models.PROTECT)
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    created_at = models.DateTimeField(db_index=True)
+    shift_id = models.BigIntegerField(null=True, blank=True)
+    total_price = MoneyField(default=0)
+
+    def __str__(self):
+        return f"Archived order #{self.order_id}"
+
+
+class DailySalesRollup(models.Model):
+    # Sales of archived orders per day and product, so analytics still sees the history
+    date = models.DateField(verbose_name="Date")
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.SET_NULL, null=True, blank=True)
+    menu_item_name = models.CharField(max_length=100, verbose_name="Product")
+    quantity = models.IntegerField(default=0, verbose_name="Sold")
+    revenue = MoneyField(default=0, verbose_name="Revenue")
+    cogs = MoneyField(default=0, verbose_name="COGS")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'menu_item_name'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.menu_item_name}: {self.quantity}"
+
+
+class SyncCursor(models.Model):
+    # Store side of the HQ sync: last id of each change feed that HQ has accepted
+    feed = models.CharField(max_length=30, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.feed}: {self.last_id}"
+
+
+class SyncChange(models.Model):
+    # Store side of the HQ sync: rows that changed after they may have been shipped
+    # (restored orders, edited or deleted supply lines), sent again on the 'changes' feed
+    feed = models.CharField(max_length=30)
+    source_id = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.feed} #{self.source_id}"
+
+
+# --- HQ consolidated data (coffee/hq.py), lives in the 'hq' database when configured ---
+
+class HQOrder(models.Model):
+    store_code = models.CharField(max_length=30, verbose_name="Store")
+    source_id = models.BigIntegerField(verbose_name="Order # in store")
+    created_at = models.DateTimeField(db_index=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_price = MoneyField(default=0)
+    shift_id = models.BigIntegerField(null=True, blank=True)
+    ticket_number = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store_code', 'source_id'], name='unique_hq_order'),
+        ]
+
+    def __str__(self):
+        return f"{self.store_code} #{self.source_id}"
+
+
+class HQOrderLine(models.Model):
+    order = models.ForeignKey(HQOrder, related_name='lines', on_delete=models.CASCADE)
+    menu_item_name = models.CharField(max_length=100)
+    quantity = models.PositiveIntegerField(default=1)
+    size = models.CharField(max_length=1, default='M')
+    price = MoneyField(default=0)
+    cogs = MoneyField(null=True, blank=True)
+
+
+class HQSupplyLine(models.Model):
+    store_code = models.CharField(max_length=30, verbose_name="Store")
+    source_id = models.BigIntegerField()
+    received_at = models.DateTimeField()
+    ingredient_name = models.CharField(max_length=100)
+    quantity = models.DecimalField(max_digits=10, decimal_places=3)
+    cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store_code', 'source_id'], name='unique_hq_supply_line'),
+        ]
+
+
+class HQStockLevel(models.Model):
+    store_code = models.CharField(max_length=30, verbose_name="Store")
+    source_id = models.BigIntegerField()
+    ingredient_name = models.CharField(max_length=100)
+    unit = models.CharField(max_length=10)
+    amount = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store_code', 'source_id'], name='unique_hq_stock_level'),
+        ]
@@ -0,0 +1,105 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+
+# Money is stored and computed as an int number of minor units (tiyn, 1/100 of a tenge).
+# Pricing an order or summing a shift is plain int arithmetic: no Decimal objects per row,
+# no float rounding. Conversion to tenge happens only at the edges: forms, templates, JSON.
+
+MINOR = 100
+CENT = Decimal('0.01')
+
+# Price of a size as a percentage of the base price (the cashier cart shows the same numbers)
+SIZE_PRICE_PERCENT = {'S': 70, 'M': 100, 'L': 130}
+
+
+def to_minor(value):
+    """Tenge (Decimal, str, int, float) -> int tiyn, rounded half up."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, int):
+        return value * MINOR
+    try:
+        amount = Decimal(str(value).replace(',', '.').replace(' ', '').strip())
+    except InvalidOperation:
+        raise ValueError(f"Not an amount: {value!r}")
+    return int((amount * MINOR).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_major(minor):
+    """Int tiyn -> Decimal tenge with two places (for JSON and exports)."""
+    if minor is None:
+        return None
+    return (Decimal(minor) / MINOR).quantize(CENT)
+
+
+def format_money(minor, places=None):
+    """'1 250' for whole tenge, '1 250.50' otherwise; places=0 or 2 forces the format."""
+    if minor is None:
+        return ''
+    whole, cents = divmod(abs(minor), MINOR)
+    if places == 0:
+        whole, cents = divmod(abs(minor) + MINOR // 2, MINOR)[0], 0
+    sign = '-' if minor < 0 else ''
+    text = f"{whole:,}".replace(',', ' ')
+    if cents or places == 2:
+        text += f".{cents:02d}"
+    return sign + text
+
+
+def scale(minor, percent):
+    """minor * percent / 100, rounded half up, in ints."""
+    return (minor * percent + 50) // 100
+
+
+def line_price(base, size='M', modifier_prices=(), quantity=1, sized=True):
+    """Price of one order line: base scaled by size, plus modifiers, times quantity."""
+    unit = scale(base, SIZE_PRICE_PERCENT.get(size, 100)) if sized else base
+    return (unit + sum(modifier_prices)) * quantity
+
+
+class MoneyFormField(forms.DecimalField):
+    """Entered and shown in tenge, cleaned to int tiyn."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('decimal_places', 2)
+        super().__init__(**kwargs)
+
+    def prepare_value(self, value):
+        if isinstance(value, int):
+            return to_major(value)
+        return value
+
+    def clean(self, value):
+        # Parsed and validated in tenge (so 10.555 is an error, not a silent rounding), then converted
+        amount = super().clean(value)
+        return None if amount is None else to_minor(amount)
+
+    def has_changed(self, initial, data):
+        return super().has_changed(self.prepare_value(initial), data)
+
+
+class MoneyField(models.BigIntegerField):
+    """Amount in minor units (int). Assigning a Decimal is a bug, not a conversion."""
+
+    description = "Amount of money in minor units"
+
+    def to_python(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, (Decimal, float)):
+            if value != int(value):
+                raise ValidationError(f"Money is stored in minor units, got {value!r}", code='invalid')
+            return int(value)
+        return super().to_python(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, (Decimal, float)) and value != int(value):
+            raise TypeError(f"Money is stored in minor units, got {value!r}")
+        return super().get_prep_value(value)
+
+    def formfield(self, **kwargs):
+        # Skip IntegerField.formfield: its bigint min/max are tiyn limits, the form works in tenge
+        return models.Field.formfield(self, **{'form_class': MoneyFormField, **kwargs})
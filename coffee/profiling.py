@@ -0,0 +1,191 @@
+import cProfile
+import json
+import re
+import shutil
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.utils import timezone
+
+QUERY_PARAM = '_profile'
+HEADER = 'HTTP_X_PROFILE_TOKEN'
+TOKEN_SALT = 'coffee.profiling'
+TOKEN_MAX_AGE = 24 * 3600
+SAMPLE_INTERVAL = 0.001
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def make_token():
+    """Token for the X-Profile-Token header, e.g. for profiling from a tablet without a staff login."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def should_profile(request):
+    # Cheap checks first: normal requests pay one dict lookup each
+    if getattr(request, '_profiling', False):
+        return False
+    token = request.META.get(HEADER)
+    if token:
+        try:
+            signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=TOKEN_MAX_AGE)
+            return True
+        except signing.BadSignature:
+            return False
+    if QUERY_PARAM in request.GET:
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
+    return False
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread, counts identical stacks (collapsed format for flame graphs)."""
+
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class QueryRecorder:
+    """execute_wrapper that keeps each SQL statement with its duration and the app code that issued it."""
+
+    def __init__(self):
+        self.queries = []
+        self._root = str(settings.BASE_DIR)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            caller = next(
+                (f"{Path(f.filename).name}:{f.lineno} {f.name}"
+                 for f in reversed(traceback.extract_stack()[:-1])
+                 if f.filename.startswith(self._root) and 'site-packages' not in f.filename),
+                '?',
+            )
+            self.queries.append({
+                'sql': sql,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+                'caller': caller,
+            })
+
+
+def _store(request, profiler, sampler, recorder, elapsed, status):
+    root = profile_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r'[^a-zA-Z0-9]+', '-', request.path).strip('-') or 'root'
+    target = root / f"{timezone.now():%Y%m%d-%H%M%S-%f}-{slug}"
+    target.mkdir()
+
+    profiler.dump_stats(target / 'profile.pstats')
+    (target / 'stacks.txt').write_text(
+        '\n'.join(f"{stack} {count}" for stack, count in sampler.stacks.most_common()), encoding='utf-8'
+    )
+    (target / 'queries.json').write_text(json.dumps(recorder.queries, indent=1), encoding='utf-8')
+    (target / 'meta.json').write_text(json.dumps({
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': status,
+        'ms': round(elapsed * 1000, 1),
+        'queries': len(recorder.queries),
+        'sql_ms': round(sum(q['ms'] for q in recorder.queries), 1),
+        'samples': sum(sampler.stacks.values()),
+    }), encoding='utf-8')
+
+    # Ring buffer: only the newest PROFILE_KEEP profiles stay on disk
+    keep = getattr(settings, 'PROFILE_KEEP', 50)
+    for old in sorted(p for p in root.iterdir() if p.is_dir())[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+    return target.name
+
+
+def run_profiled(request, handler, *args, **kwargs):
+    request._profiling = True
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    recorder = QueryRecorder()
+
+    started = time.perf_counter()
+    sampler.start()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        profiler.enable()
+        try:
+            response = handler(request, *args, **kwargs)
+        finally:
+            profiler.disable()
+            sampler.stop()
+    elapsed = time.perf_counter() - started
+
+    name = _store(request, profiler, sampler, recorder, elapsed, getattr(response, 'status_code', None))
+    response['X-Profile-Id'] = name
+    return response
+
+
+class ProfilingMiddleware:
+    """Profiles a request when it carries a signed X-Profile-Token header or ?_profile (staff only)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+        return run_profiled(request, self.get_response)
+
+
+def profile_view(view):
+    """Same as the middleware but for a single view."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not should_profile(request):
+            return view(request, *args, **kwargs)
+        return run_profiled(request, view, *args, **kwargs)
+
+    return wrapper
+
+
+def list_profiles():
+    root = profile_dir()
+    if not root.exists():
+        return []
+    profiles = []
+    for path in sorted((p for p in root.iterdir() if p.is_dir()), reverse=True):
+        try:
+            meta = json.loads((path / 'meta.json').read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        meta['name'] = path.name
+        profiles.append(meta)
+    return profiles
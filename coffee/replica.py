@@ -0,0 +1,174 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+# Read replica for reporting.
+# The replica is a plain SQLite snapshot of the primary taken with the online backup API,
+# refreshed lazily: a reporting request that finds it older than REPLICA_MAX_LAG seconds
+# starts a new snapshot in a background thread and reads the previous one meanwhile, so
+# neither the tills nor the analysts wait for it (only the very first snapshot is taken
+# inline). The new file replaces the old one with os.replace(); each thread compares the
+# file's inode and mtime with the ones its connection opened when entering reporting() and
+# reconnects when they differ.
+# Only coffee models are routed (coffee.routers.ReplicaRouter), sessions and users stay on
+# the primary, so a fresh login is never "missing" on the replica.
+
+REPLICA = 'replica'
+
+_reading = contextvars.ContextVar('coffee_replica_reading', default=False)
+_refresh_lock = threading.Lock()
+_refreshing = None  # background refresh thread
+
+
+def enabled():
+    return REPLICA in settings.DATABASES and getattr(settings, 'USE_REPLICA', True)
+
+
+def reading():
+    return _reading.get()
+
+
+def max_lag():
+    return getattr(settings, 'REPLICA_MAX_LAG', 60)
+
+
+def replica_path():
+    return Path(connections[REPLICA].settings_dict['NAME'])
+
+
+def primary_path():
+    return Path(connections['default'].settings_dict['NAME'])
+
+
+def snapshot(source, target, pages=-1, pause=0.0, progress=None):
+    """
+    Consistent copy of the SQLite database `source` into the file `target`.
+    pages=-1 copies in one step (shortest possible read lock on a small DB);
+    a positive value copies in steps and sleeps `pause` between them so writers get in.
+    Either way the result is a transaction-consistent image, SQLite restarts the copy
+    if the source changes mid-way through another connection.
+    """
+    src = sqlite3.connect(source, timeout=30)
+    dst = sqlite3.connect(target)
+    try:
+        with dst:
+            src.backup(dst, pages=pages, progress=progress, sleep=pause)
+    finally:
+        dst.close()
+        src.close()
+
+
+def lag():
+    """Seconds since the replica snapshot was taken, None if there is no replica yet."""
+    try:
+        return time.time() - os.stat(replica_path()).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def file_id():
+    """(inode, mtime) of the replica file like stamps.read(), None if there is none yet."""
+    try:
+        st = os.stat(replica_path())
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def refresh():
+    """Takes a new snapshot and swaps it in atomically; open readers keep the old file."""
+    target = replica_path()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    started = time.time()
+    try:
+        snapshot(str(primary_path()), str(tmp))
+        # The file's mtime is the snapshot time, that is what lag() measures
+        os.utime(tmp, (started, started))
+        os.replace(tmp, target)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return time.time() - started
+
+
+def _refresh_in_background():
+    global _refreshing
+    try:
+        refresh()
+    finally:
+        _refreshing = None
+
+
+def ensure_fresh():
+    current = lag()
+    if current is not None and current <= max_lag():
+        return
+    global _refreshing
+    with _refresh_lock:
+        # Another thread may have refreshed while we waited
+        current = lag()
+        if current is None:
+            # Nothing to read yet: the first snapshot is taken inline
+            refresh()
+        elif current > max_lag() and _refreshing is None:
+            _refreshing = threading.Thread(target=_refresh_in_background, name='coffee-replica', daemon=True)
+            _refreshing.start()
+
+
+def _reconnect_if_replaced():
+    conn = connections[REPLICA]
+    current = file_id()
+    if conn.connection is not None and getattr(conn, 'coffee_file_id', None) != current:
+        conn.close()
+    if conn.connection is None:
+        # Connects lazily to this file or a newer one; a newer one only costs one more reconnect
+        conn.coffee_file_id = current
+
+
+@contextmanager
+def reporting():
+    """Coffee model reads inside this block go to the replica (at most REPLICA_MAX_LAG old)."""
+    if not enabled():
+        yield
+        return
+    ensure_fresh()
+    _reconnect_if_replaced()
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+@contextmanager
+def primary():
+    """
+    Reads inside this block go to the primary even within reporting(). For the process-wide
+    caches (rule book, sellable portions, barista metrics): built from a snapshot they would
+    be kept and served to the tills long after the snapshot went stale.
+    """
+    token = _reading.set(False)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def reporting_view(view):
+    """For read-only report pages: everything the view reads comes from the replica."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with reporting():
+            return view(request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,367 @@
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, TruncDate, TruncMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .money import MINOR
+
+# Analytics periods.
+# Every figure is a grouped query over a created_at range (indexed), merged with the
+# archive (ArchivedOrder / DailySalesRollup, see coffee/archive.py) for the same range.
+# Finished reports are cached by (period, last closed shift): closing a shift is what makes
+# history change. Periods that include "now" also expire after REPORT_LIVE_TTL seconds.
+# Money figures are int tiyn (coffee/money.py); only the chart series are converted to tenge.
+
+PERIOD_LABELS = {
+    'today': 'Today',
+    '7': 'Last 7 Days',
+    '30': 'Last Month',
+    'all': 'All History',
+    'custom': 'Custom',
+}
+
+
+class Period(NamedTuple):
+    key: str
+    start: Optional[datetime]  # inclusive, None = since the beginning
+    end: Optional[datetime]    # exclusive, None = up to now
+    label: str
+
+    def previous(self):
+        if self.start is None or self.end is None:
+            return None
+        length = self.end - self.start
+        return Period(self.key, self.start - length, self.start, f"Previous {length.days or 1} day(s)")
+
+    def is_live(self):
+        return self.end is None or self.end > timezone.now()
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def parse_period(params):
+    """?period=today|7|30|all, or ?period=custom&from=YYYY-MM-DD&to=YYYY-MM-DD (both inclusive)."""
+    key = params.get('period', '7')
+    today = timezone.localdate()
+    tomorrow = _midnight(today + timedelta(days=1))
+
+    if key == 'custom':
+        first, last = parse_date(params.get('from') or ''), parse_date(params.get('to') or '')
+        if first and last and first <= last:
+            return Period(key, _midnight(first), _midnight(last + timedelta(days=1)), f"{first:%d.%m.%Y} – {last:%d.%m.%Y}")
+        key = '7'
+    if key == 'today':
+        return Period(key, _midnight(today), tomorrow, PERIOD_LABELS[key])
+    if key == 'all':
+        return Period(key, None, None, PERIOD_LABELS[key])
+    days = 30 if key == '30' else 7
+    return Period('30' if key == '30' else '7', _midnight(today - timedelta(days=days - 1)), tomorrow, PERIOD_LABELS[str(days)])
+
+
+def _range(period, field='created_at'):
+    lookups = {}
+    if period.start is not None:
+        lookups[f'{field}__gte'] = period.start
+    if period.end is not None:
+        lookups[f'{field}__lt'] = period.end
+    return lookups
+
+
+def _date_range(period):
+    """Same range for DailySalesRollup, which only knows local dates."""
+    lookups = {}
+    if period.start is not None:
+        lookups['date__gte'] = timezone.localtime(period.start).date()
+    if period.end is not None:
+        lookups['date__lt'] = timezone.localtime(period.end).date()
+    return lookups
+
+
+def _totals(period):
+    from .models import ArchivedOrder, DailySalesRollup, Order, OrderItem
+
+    live = Order.objects.filter(status='completed', **_range(period)).aggregate(
+        orders=Count('id'), revenue=Sum('total_price')
+    )
+    archived = ArchivedOrder.objects.filter(**_range(period)).aggregate(
+        orders=Count('order_id'), revenue=Sum('total_price')
+    )
+    items = OrderItem.objects.filter(
+        order__status='completed', **_range(period, 'order__created_at')
+    ).aggregate(n=Sum('quantity'))['n'] or 0
+    items += DailySalesRollup.objects.filter(**_date_range(period)).aggregate(n=Sum('quantity'))['n'] or 0
+
+    orders = live['orders'] + archived['orders']
+    revenue = (live['revenue'] or 0) + (archived['revenue'] or 0)
+    return {
+        'orders': orders,
+        'revenue': revenue,
+        'items': items,
+        'average_check': round(revenue / orders) if orders else 0,
+    }
+
+
+def _by_item(period):
+    from .models import DailySalesRollup, OrderItem
+
+    rows = defaultdict(lambda: {'sold_count': 0, 'revenue': 0, 'cogs': 0, 'costed': False})
+    for name, sold, revenue, cogs in OrderItem.objects.filter(
+        order__status='completed', **_range(period, 'order__created_at')
+    ).values_list('menu_item__name').annotate(Sum('quantity'), Sum('price'), Sum('cogs')):
+        row = rows[name]
+        row['sold_count'] += sold or 0
+        row['revenue'] += revenue or 0
+        row['cogs'] += cogs or 0
+        row['costed'] |= cogs is not None
+    for name, sold, revenue, cogs in DailySalesRollup.objects.filter(**_date_range(period)).values_list(
+        'menu_item_name'
+    ).annotate(Sum('quantity'), Sum('revenue'), Sum('cogs')):
+        row = rows[name]
+        row['sold_count'] += sold or 0
+        row['revenue'] += revenue or 0
+        row['cogs'] += cogs or 0
+        row['costed'] |= bool(cogs)
+
+    top_items = sorted(
+        ({'menu_item__name': name, 'sold_count': row['sold_count']} for name, row in rows.items()),
+        key=lambda row: -row['sold_count'],
+    )[:10]
+    item_margins = []
+    for name, row in sorted(rows.items(), key=lambda r: -r[1]['revenue']):
+        if not row['costed']:
+            continue
+        margin = row['revenue'] - row['cogs']
+        item_margins.append({
+            'menu_item__name': name, 'revenue': row['revenue'], 'cogs': row['cogs'], 'margin': margin,
+            'margin_pct': round(margin * 100 / row['revenue'], 1) if row['revenue'] else 0,
+        })
+    return top_items, item_margins[:10]
+
+
+def _by_category(period):
+    from .models import DailySalesRollup, MenuItem, OrderItem
+
+    revenue = Counter()
+    for category, total in OrderItem.objects.filter(
+        order__status='completed', **_range(period, 'order__created_at')
+    ).values_list('menu_item__category').annotate(Sum('price')):
+        revenue[category] += total or 0
+    for category, total in DailySalesRollup.objects.filter(**_date_range(period)).values_list(
+        'menu_item__category'
+    ).annotate(Sum('revenue')):
+        revenue[category] += total or 0
+
+    labels = dict(MenuItem.CATEGORY_CHOICES)
+    return [
+        {'category': labels.get(category, 'Other'), 'revenue': total}
+        for category, total in revenue.most_common()
+    ]
+
+
+def _by_hour(period):
+    from .models import ArchivedOrder, Order
+
+    tz = timezone.get_current_timezone()
+    hours = {hour: {'hour': hour, 'orders': 0, 'revenue': 0} for hour in range(24)}
+    for model, count_field, filters in (
+        (Order, 'id', {'status': 'completed'}),
+        (ArchivedOrder, 'order_id', {}),
+    ):
+        for hour, orders, revenue in model.objects.filter(**filters, **_range(period)).annotate(
+            hour=ExtractHour('created_at', tzinfo=tz)
+        ).values_list('hour').annotate(Count(count_field), Sum('total_price')):
+            hours[hour]['orders'] += orders
+            hours[hour]['revenue'] += revenue or 0
+    return list(hours.values())
+
+
+def _timeline(period, by_hour):
+    """Revenue chart: per hour for one day, per day up to a quarter, per month beyond that."""
+    from .models import ArchivedOrder, Order
+
+    if period.start is not None and period.end is not None and period.end - period.start <= timedelta(days=1):
+        return [f"{row['hour']:02d}:00" for row in by_hour], [row['revenue'] / MINOR for row in by_hour]
+
+    monthly = period.start is None or period.end - period.start > timedelta(days=92)
+    trunc = TruncMonth if monthly else TruncDate
+    tz = timezone.get_current_timezone()
+    revenue = Counter()
+    for model, filters in ((Order, {'status': 'completed'}), (ArchivedOrder, {})):
+        for bucket, total in model.objects.filter(**filters, **_range(period)).annotate(
+            bucket=trunc('created_at', tzinfo=tz)
+        ).values_list('bucket').annotate(Sum('total_price')):
+            revenue[bucket] += total or 0
+
+    buckets = sorted(revenue)
+    if not monthly and period.start is not None:
+        # Days without sales still get a point on the chart
+        day = timezone.localtime(period.start).date()
+        last = timezone.localtime(period.end).date()
+        buckets = []
+        while day < last:
+            buckets.append(day)
+            day += timedelta(days=1)
+    fmt = '%m.%Y' if monthly else '%d.%m'
+    return [b.strftime(fmt) for b in buckets], [revenue.get(b, 0) / MINOR for b in buckets]
+
+
+def _shift_margins(period):
+    from .models import OrderItem
+
+    rows = list(OrderItem.objects.filter(
+        order__status='completed', order__shift__isnull=False, cogs__isnull=False,
+        **_range(period, 'order__created_at')
+    ).values('order__shift_id').annotate(revenue=Sum('price'), cogs=Sum('cogs')).order_by('-order__shift_id')[:15])
+    for row in rows:
+        row['margin'] = row['revenue'] - row['cogs']
+        row['margin_pct'] = round(row['margin'] * 100 / row['revenue'], 1) if row['revenue'] else 0
+    return rows
+
+
+def _change(current, previous):
+    if not previous:
+        return None
+    return round((current - previous) * 100 / previous, 1)
+
+
+def build_report(period, compare=False):
+    totals = _totals(period)
+    top_items, item_margins = _by_item(period)
+    by_hour = _by_hour(period)
+    chart_labels, chart_data = _timeline(period, by_hour)
+    report = {
+        'totals': totals,
+        'top_items': top_items,
+        'item_margins': item_margins,
+        'by_category': _by_category(period),
+        'by_hour': by_hour,
+        'chart_labels': chart_labels,
+        'chart_data': chart_data,
+        'shift_margins': _shift_margins(period),
+        'previous': None,
+    }
+    previous = period.previous() if compare else None
+    if previous:
+        before = _totals(previous)
+        report['previous'] = dict(
+            before,
+            label=previous.label,
+            revenue_change=_change(totals['revenue'], before['revenue']),
+            orders_change=_change(totals['orders'], before['orders']),
+        )
+    return report
+
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def build_heatmap(period, category=None):
+    """
+    Weekday x hour grid of orders, revenue and items sold, for staffing.
+    Live data is one grouped query (ISO weekday and hour extracted in SQL), archived
+    orders add one more; neither depends on how many rows the period covers.
+    """
+    from .models import ArchivedOrder, OrderItem
+
+    tz = timezone.get_current_timezone()
+    cells = [[{'orders': 0, 'revenue': 0, 'items': 0} for _ in range(24)] for _ in range(7)]
+
+    lines = OrderItem.objects.filter(order__status='completed', **_range(period, 'order__created_at'))
+    if category:
+        lines = lines.filter(menu_item__category=category)
+    for weekday, hour, orders, revenue, items in lines.annotate(
+        weekday=ExtractIsoWeekDay('order__created_at', tzinfo=tz), hour=ExtractHour('order__created_at', tzinfo=tz)
+    ).values_list('weekday', 'hour').annotate(Count('order_id', distinct=True), Sum('price'), Sum('quantity')):
+        cell = cells[weekday - 1][hour]
+        cell['orders'] += orders
+        cell['revenue'] += revenue or 0
+        cell['items'] += items or 0
+
+    if not category:
+        # Archived orders only kept their totals: orders and revenue, no items
+        for weekday, hour, orders, revenue in ArchivedOrder.objects.filter(**_range(period)).annotate(
+            weekday=ExtractIsoWeekDay('created_at', tzinfo=tz), hour=ExtractHour('created_at', tzinfo=tz)
+        ).values_list('weekday', 'hour').annotate(Count('order_id'), Sum('total_price')):
+            cell = cells[weekday - 1][hour]
+            cell['orders'] += orders
+            cell['revenue'] += revenue or 0
+
+    busiest = max((cell['orders'] for row in cells for cell in row), default=0)
+    for row in cells:
+        for cell in row:
+            # 0-100, for shading on the analytics page
+            cell['level'] = round(cell['orders'] * 100 / busiest) if busiest else 0
+    return {
+        'weekdays': WEEKDAYS,
+        'rows': [{'weekday': WEEKDAYS[i], 'cells': row} for i, row in enumerate(cells)],
+        'busiest': busiest,
+    }
+
+class ReportCache:
+    """Small LRU of finished reports, shared by the threads of one worker."""
+
+    def __init__(self, size=32):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = ReportCache(getattr(settings, 'REPORT_CACHE_SIZE', 32))
+
+
+def last_closed_shift_id():
+    from .models import Shift
+
+    return Shift.objects.filter(is_active=False).order_by('-closed_at', '-id').values_list('id', flat=True).first()
+
+
+def period_report(period, compare=False):
+    key = (period.key, period.start, period.end, compare, last_closed_shift_id())
+    report = cache.get(key)
+    if report is None:
+        report = build_report(period, compare)
+        ttl = getattr(settings, 'REPORT_LIVE_TTL', 30) if period.is_live() else None
+        cache.put(key, report, ttl)
+    return report
+
+
+def heatmap(period, category=None):
+    key = ('heatmap', period.key, period.start, period.end, category, last_closed_shift_id())
+    result = cache.get(key)
+    if result is None:
+        result = build_heatmap(period, category)
+        ttl = getattr(settings, 'REPORT_LIVE_TTL', 30) if period.is_live() else None
+        cache.put(key, result, ttl)
+    return result
@@ -0,0 +1,55 @@
+from . import replica, stores
+
+# Models of the HQ consolidated database (coffee/hq.py)
+HQ_MODELS = {'hqorder', 'hqorderline', 'hqsupplyline', 'hqstocklevel'}
+
+
+class StoreRouter:
+    """HQ models go to the HQ database, store data to the store picked with stores.using()."""
+
+    def _db(self, model):
+        if model._meta.app_label != 'coffee':
+            return None
+        if model._meta.model_name in HQ_MODELS:
+            return stores.hq_alias()
+        return stores.routed_alias()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica.REPLICA:
+            return None
+        if app_label != 'coffee':
+            return db != stores.HQ_ALIAS
+        if model_name in HQ_MODELS:
+            return db == stores.hq_alias()
+        return db != stores.HQ_ALIAS
+
+
+class ReplicaRouter:
+    """Coffee reads go to the replica inside replica.reporting(), all writes stay on the primary."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'coffee' and replica.reading():
+            return replica.REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data, just older: objects read from the replica may point at primary rows
+        databases = {'default', replica.REPLICA}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica.REPLICA:
+            # The snapshot copies the schema from the primary
+            return False
+        return None
@@ -0,0 +1,173 @@
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from . import menu, replica
+from .inventory import SIZE_MULTIPLIERS
+
+# Ingredient rules of an order line, the single source for every stock and cost path
+# (order creation, Order.finish_order, services, COGS, sellable portions / forecast).
+#
+# A line uses its recipe scaled by size (lines marked scales_with_size), then each selected
+# modifier applies its action:
+#   add      the modifier's ingredient is added; milk modifiers scale with size, others don't
+#   replace  recipe lines of the target ingredient (every milk ingredient when no target is set)
+#            are dropped and the modifier's ingredient is used instead: its own quantity x size,
+#            or the dropped quantity when the modifier has none
+#   remove   recipe lines of the target (or of the modifier's own ingredient) are dropped
+#
+# The rules are compiled once per menu version into plain dicts; the result for a
+# (menu item, size, modifiers) combination is memoized, so pricing a whole cart's stock
+# usage is dictionary lookups and no queries.
+
+
+class RuleBook:
+    """Compiled recipes and modifier actions of one menu version."""
+
+    def __init__(self, version, sized, recipes, modifiers, milk, ingredients):
+        self.version = version
+        self.sized = sized              # menu_item_id -> is_sized
+        self.recipes = recipes          # menu_item_id -> ((ingredient_id, quantity, is_milk, scales), ...)
+        self.modifiers = modifiers      # modifier_id -> (action, type, ingredient_id, target_id, quantity)
+        self.milk = milk                # ids of ingredients flagged is_milk
+        self.ingredients = ingredients  # ingredient_id -> (name, unit)
+        self._memo = {}
+
+    def unit(self, menu_item_id, size='M', modifier_ids=()):
+        """((ingredient_id, quantity), ...) used by one portion."""
+        key = (menu_item_id, size, tuple(sorted(modifier_ids)))
+        result = self._memo.get(key)
+        if result is None:
+            result = self._memo[key] = self._resolve(menu_item_id, size, key[2])
+        return result
+
+    def _resolve(self, menu_item_id, size, modifier_ids):
+        multiplier = SIZE_MULTIPLIERS.get(size, Decimal('1.0')) if self.sized.get(menu_item_id, True) else Decimal('1.0')
+        lines = [
+            [ing, qty * multiplier if scales else qty, is_milk]
+            for ing, qty, is_milk, scales in self.recipes.get(menu_item_id, ())
+        ]
+        extras = []
+
+        mods = [self.modifiers[pk] for pk in modifier_ids if pk in self.modifiers]
+        # Removals and substitutions work on the recipe, before any add-on is counted
+        for action, mod_type, ingredient_id, target_id, quantity in sorted(mods, key=lambda m: m[0] == 'add'):
+            if action == 'remove':
+                target = target_id or ingredient_id
+                lines = [line for line in lines if line[0] != target]
+            elif action == 'replace':
+                hit = (lambda line: line[0] == target_id) if target_id else (lambda line: line[2])
+                replaced = sum((line[1] for line in lines if hit(line)), Decimal(0))
+                lines = [line for line in lines if not hit(line)]
+                if ingredient_id:
+                    extras.append((ingredient_id, quantity * multiplier if quantity else replaced))
+            elif ingredient_id:
+                # Milk add-ons follow the cup size, syrups and toppings are per drink
+                extras.append((ingredient_id, quantity * multiplier if mod_type == 'milk' else quantity))
+
+        used = defaultdict(Decimal)
+        for ing, qty, _ in lines:
+            used[ing] += qty
+        for ing, qty in extras:
+            used[ing] += qty
+        return tuple((ing, qty) for ing, qty in used.items() if qty)
+
+    def consumption(self, menu_item_id, size='M', modifier_ids=(), quantity=1):
+        return {ing: qty * quantity for ing, qty in self.unit(menu_item_id, size, modifier_ids)}
+
+    def cart(self, lines):
+        """lines: [(menu_item_id, size, modifier_ids, quantity)] -> {ingredient_id: total quantity}."""
+        used = defaultdict(Decimal)
+        for menu_item_id, size, modifier_ids, quantity in lines:
+            for ing, qty in self.unit(menu_item_id, size, modifier_ids):
+                used[ing] += qty * quantity
+        return used
+
+    def has_recipe(self, menu_item_id):
+        return bool(self.recipes.get(menu_item_id))
+
+
+def compile_rules(version):
+    from .models import Ingredient, MenuItem, Modifier, Recipe
+
+    # Always from the primary, also inside replica.reporting(): the book is shared by the order
+    # paths of the whole process and kept until the menu version moves
+    with replica.primary():
+        ingredients, milk = {}, set()
+        for pk, name, unit, is_milk in Ingredient.objects.values_list('id', 'name', 'unit', 'is_milk'):
+            ingredients[pk] = (name, unit)
+            if is_milk:
+                milk.add(pk)
+
+        recipes = defaultdict(list)
+        for menu_item_id, ingredient_id, quantity, scales in Recipe.objects.values_list(
+            'menu_item_id', 'ingredient_id', 'quantity_needed', 'scales_with_size'
+        ):
+            recipes[menu_item_id].append((ingredient_id, quantity, ingredient_id in milk, scales))
+
+        modifiers = {
+            pk: (action, mod_type, ingredient_id, target_id, quantity)
+            for pk, action, mod_type, ingredient_id, target_id, quantity in Modifier.objects.values_list(
+                'id', 'action', 'type', 'ingredient_id', 'target_id', 'quantity_needed'
+            )
+        }
+        sized = dict(MenuItem.objects.values_list('id', 'is_sized'))
+        return RuleBook(version, sized, {k: tuple(v) for k, v in recipes.items()}, modifiers, milk, ingredients)
+
+
+class RuleRegistry:
+    """Process-local RuleBook, recompiled when the menu version moves (see coffee/menu.py)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._book = None
+
+    def current(self):
+        version = menu.version()
+        book = self._book
+        if book is not None and book.version == version:
+            return book
+        with self._lock:
+            if self._book is None or self._book.version != version:
+                self._book = compile_rules(version)
+            return self._book
+
+    def invalidate(self):
+        """Same-process edits: don't wait for the stamp (it only moves on commit)."""
+        self._book = None
+
+    def milk_flag_changed(self, ingredient_id, is_milk):
+        book = self._book
+        return book is not None and (ingredient_id in book.milk) != is_milk
+
+
+rules = RuleRegistry()
+
+
+def order_lines(order_ids):
+    """{order_id: [(menu_item_id, size, modifier_ids, quantity)]} in two queries."""
+    from .models import OrderItem
+
+    modifiers = defaultdict(list)
+    for item_id, modifier_id in OrderItem.modifiers.through.objects.filter(
+        orderitem__order_id__in=order_ids
+    ).values_list('orderitem_id', 'modifier_id'):
+        modifiers[item_id].append(modifier_id)
+    lines = defaultdict(list)
+    for pk, order_id, menu_item_id, size, quantity in OrderItem.objects.filter(
+        order_id__in=order_ids
+    ).values_list('id', 'order_id', 'menu_item_id', 'size', 'quantity'):
+        lines[order_id].append((menu_item_id, size, modifiers[pk], quantity))
+    return lines
+
+
+def item_modifiers(order_item_ids):
+    """{order_item_id: [modifier_id]} in one query."""
+    from .models import OrderItem
+
+    modifiers = defaultdict(list)
+    for order_item_id, modifier_id in OrderItem.modifiers.through.objects.filter(
+        orderitem_id__in=order_item_ids
+    ).values_list('orderitem_id', 'modifier_id'):
+        modifiers[order_item_id].append(modifier_id)
+    return modifiers
@@ -0,0 +1,147 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from . import menu, replica
+
+# Menu search for the cashier's search box and quick keys.
+#
+# Names are folded to one rough Latin spelling before indexing and before matching: Cyrillic
+# is transliterated, then letters that sound alike are merged and doubled letters collapsed.
+# So "латте", "Latte" and "LATTE" are the same word, "капучино" finds "Cappuccino" and
+# "Қымыз" finds "Kymyz". Two in-memory indexes are built once per menu version
+# (coffee/menu.py), like the rule book:
+#   prefixes  every prefix of every word -> products: "lat" finds "Iced Latte"
+#   trigrams  every 3-letter piece of the whole name -> products: "atte" still finds it;
+#             the candidates are intersected and checked against the folded name
+# A lookup is a couple of dict hits and a set intersection over a few hundred products.
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh',
+    'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Kazakh letters
+    'ә': 'a', 'ғ': 'g', 'қ': 'k', 'ң': 'n', 'ө': 'o', 'ұ': 'u', 'ү': 'u', 'һ': 'h', 'і': 'i',
+}
+_TABLE = str.maketrans(TRANSLIT)
+# Applied in this order after transliteration
+SOUNDS = (('ph', 'f'), ('ch', 'k'), ('ck', 'k'), ('c', 'k'), ('w', 'v'), ('y', 'i'))
+_DOUBLES = re.compile(r'(.)\1+')
+_WORD = re.compile(r'[a-z0-9]+')
+MAX_PREFIX = 20
+DEFAULT_LIMIT = 10
+
+
+def fold(text):
+    """Search spelling of a name or query: Latin, lowercase, no accents, see SOUNDS."""
+    text = unicodedata.normalize('NFKD', text.casefold().translate(_TABLE))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    for sound, letter in SOUNDS:
+        text = text.replace(sound, letter)
+    return _DOUBLES.sub(r'\1', text)
+
+
+def _words(text):
+    return _WORD.findall(fold(text))
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class MenuSearchIndex:
+    """Folded names, word prefixes and trigrams of one menu version."""
+
+    def __init__(self, version, items):
+        self.version = version
+        self.items = items                  # menu_item_id -> {'id', 'name', 'price', 'category'}
+        self.folded = {}                    # menu_item_id -> folded name, words joined by one space
+        self.prefixes = defaultdict(set)    # word prefix -> {menu_item_id}
+        self.trigrams = defaultdict(set)    # trigram of the folded name -> {menu_item_id}
+        for pk, item in items.items():
+            words = _words(item['name'])
+            self.folded[pk] = ' '.join(words)
+            for word in words:
+                for end in range(1, min(len(word), MAX_PREFIX) + 1):
+                    self.prefixes[word[:end]].add(pk)
+            for gram in _trigrams(self.folded[pk]):
+                self.trigrams[gram].add(pk)
+
+    def _matches(self, word):
+        if len(word) <= MAX_PREFIX and word in self.prefixes:
+            found = set(self.prefixes[word])
+        else:
+            found = set()
+        if len(word) >= 3:
+            grams = sorted(_trigrams(word), key=lambda gram: len(self.trigrams.get(gram, ())))
+            candidates = set(self.trigrams.get(grams[0], ()))
+            for gram in grams[1:]:
+                candidates &= self.trigrams.get(gram, set())
+                if not candidates:
+                    break
+            found |= {pk for pk in candidates if word in self.folded[pk]}
+        return found
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Products whose name contains every word of `query`, best matches first."""
+        words = _words(query)
+        if not words:
+            return []
+        found = None
+        for word in sorted(words, key=len, reverse=True):
+            found = self._matches(word) if found is None else found & self._matches(word)
+            if not found:
+                return []
+
+        phrase = ' '.join(words)
+
+        def rank(pk):
+            name = self.folded[pk]
+            if name == phrase:
+                return 0
+            if name.startswith(phrase):
+                return 1
+            # Every query word starts a word of the name ("ic lat" -> "Iced Latte")
+            if all(word in self.prefixes and pk in self.prefixes[word] for word in words):
+                return 2
+            return 3
+
+        ranked = sorted(found, key=lambda pk: (rank(pk), len(self.folded[pk]), self.folded[pk]))
+        return [self.items[pk] for pk in ranked[:limit]]
+
+
+def build_index(version):
+    from .models import MenuItem
+
+    # Shared by the whole process, so never built from the reporting snapshot
+    with replica.primary():
+        items = {
+            item['id']: item for item in MenuItem.objects.values('id', 'name', 'price', 'category')
+        }
+    return MenuSearchIndex(version, items)
+
+
+class SearchRegistry:
+    """Process-local MenuSearchIndex, rebuilt when the menu version moves."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def current(self):
+        version = menu.version()
+        index = self._index
+        if index is not None and index.version == version:
+            return index
+        with self._lock:
+            if self._index is None or self._index.version != version:
+                self._index = build_index(version)
+            return self._index
+
+    def invalidate(self):
+        self._index = None
+
+
+menu_search = SearchRegistry()
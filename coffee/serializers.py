@@ -1,7 +1,14 @@
 from rest_framework import serializers
 from .models import MenuItem
+from .money import to_major
 
 class MenuItemSerializer(serializers.ModelSerializer):
+    # Stored in tiyn, exposed in tenge like menu_api
+    price = serializers.SerializerMethodField()
+
     class Meta:
         model = MenuItem
-        fields = ['id', 'name', 'price']
\ No newline at end of file
+        fields = ['id', 'name', 'price']
+
+    def get_price(self, obj):
+        return to_major(obj.price)
\ No newline at end of file
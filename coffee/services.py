@@ -1,6 +1,15 @@
+from decimal import Decimal, InvalidOperation
+
 from django.db import transaction
+from django.db.models import Value, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
-from .models import Order
+from django.utils import timezone
+from .models import Order, OrderItem, OrderStatusEvent, Ingredient, Supply, SupplyItem, Stocktake, StocktakeLine
+from .metrics import metrics
+from . import hq, stock
+from .costing import sync_supply_layers
+from .rules import order_lines, rules
 
 # НОВАЯ ФУНКЦИЯ: Робот-закупщик
 def check_and_reorder(ingredient):
@@ -27,47 +36,328 @@ def check_and_reorder(ingredient):
         print("="*40 + "\n")
 
 def process_order_and_deduct_ingredients(order_id):
-    SIZE_MULTIPLIERS = {'S': 0.7, 'M': 1.0, 'L': 1.3}
-
     with transaction.atomic():
         order = Order.objects.get(id=order_id)
-        
+
+        # Расход по тем же правилам, что и при создании заказа (coffee/rules.py)
+        used = rules.current().cart(order_lines([order.id])[order.id])
+        stock.flush()
+        ingredients = Ingredient.objects.select_related('supplier').in_bulk(list(used))
+
         # Список ингредиентов, которые мы трогали в этом заказе (чтобы проверить их)
         affected_ingredients = set()
 
-        for item in order.items.all():
-            qty = item.quantity
-            mult = SIZE_MULTIPLIERS.get(item.size, 1.0)
-            
-            replacement_milk = item.modifiers.filter(category='milk').first()
-
-            for recipe in item.menu_item.recipes.all():
-                total_needed = recipe.quantity_needed * mult * qty
-                
-                if recipe.ingredient.is_milk and replacement_milk:
-                    target_ingredient = replacement_milk.ingredient
-                else:
-                    target_ingredient = recipe.ingredient
-
-                if target_ingredient.amount >= total_needed:
-                    target_ingredient.amount -= total_needed
-                    target_ingredient.save()
-                    affected_ingredients.add(target_ingredient) # Запоминаем для проверки
-                else:
-                    raise ValidationError(f"Недостаточно {target_ingredient.name}!")
-
-            for mod in item.modifiers.exclude(category='milk'):
-                total_mod_needed = mod.quantity_needed * qty
-                if mod.ingredient.amount >= total_mod_needed:
-                    mod.ingredient.amount -= total_mod_needed
-                    mod.ingredient.save()
-                    affected_ingredients.add(mod.ingredient) # Запоминаем
-                else:
-                    raise ValidationError(f"Кончилась добавка {mod.name}!")
+        for ingredient_id, total_needed in used.items():
+            target_ingredient = ingredients[ingredient_id]
+            if target_ingredient.amount >= total_needed:
+                target_ingredient.amount -= total_needed
+                affected_ingredients.add(target_ingredient) # Запоминаем для проверки
+            else:
+                raise ValidationError(f"Недостаточно {target_ingredient.name}!")
+        stock.apply({ingredient_id: -needed for ingredient_id, needed in used.items()})
         
         order.is_completed = True
         order.save()
 
         # ПОСЛЕ успешного списания запускаем проверку каждого ингредиента
         for ing in affected_ingredients:
-            check_and_reorder(ing)
\ No newline at end of file
+            check_and_reorder(ing)
+
+def transition_orders(order_ids, new_status):
+    """
+    Moves a batch of orders to `new_status` following Order.STATUS_TRANSITIONS.
+    All-or-nothing: one UPDATE for the whole batch plus one bulk insert of history rows.
+    Returns the list of updated order ids.
+    """
+    if new_status not in dict(Order.STATUS_CHOICES):
+        raise ValidationError(f"Unknown status '{new_status}'")
+
+    order_ids = {int(pk) for pk in order_ids}
+    if not order_ids:
+        return []
+
+    allowed_from = [
+        status for status, targets in Order.STATUS_TRANSITIONS.items() if new_status in targets
+    ]
+
+    with transaction.atomic():
+        rows = list(Order.objects.filter(pk__in=order_ids).values_list('id', 'status', 'created_at'))
+        current = {pk: status for pk, status, _ in rows}
+
+        missing = order_ids - current.keys()
+        if missing:
+            raise ValidationError(f"Orders not found: {sorted(missing)}")
+
+        rejected = {pk: status for pk, status in current.items() if status not in allowed_from}
+        if rejected:
+            details = ", ".join(f"#{pk} ({status})" for pk, status in sorted(rejected.items()))
+            raise ValidationError(f"Cannot move to '{new_status}': {details}")
+
+        # The status guard protects us from a concurrent click that already moved the order
+        fields = {'status': new_status}
+        if new_status == 'completed':
+            fields['is_completed'] = True
+        updated = Order.objects.filter(pk__in=order_ids, status__in=allowed_from).update(**fields)
+        if updated != len(order_ids):
+            raise ValidationError("Orders were changed by someone else, refresh and try again")
+        if new_status == 'completed':
+            write_off_stock(order_ids)
+
+        now = timezone.now()
+        OrderStatusEvent.objects.bulk_create([
+            OrderStatusEvent(order_id=pk, from_status=status, to_status=new_status, created_at=now)
+            for pk, status in current.items()
+        ])
+
+        menu_items = {}
+        if new_status == 'ready':
+            for order_id, menu_item_id, category in OrderItem.objects.filter(
+                order_id__in=order_ids
+            ).values_list('order_id', 'menu_item_id', 'menu_item__category'):
+                menu_items.setdefault(order_id, []).append((menu_item_id, category))
+
+        transaction.on_commit(
+            lambda: metrics.record_transitions(rows, new_status, now, menu_items)
+        )
+
+    return sorted(order_ids)
+
+
+def write_off_stock(order_ids):
+    """
+    Takes the ingredients of the orders whose stock wasn't written off yet (orders typed into
+    the admin; the till does it at intake), one UPDATE for all of them.
+    """
+    with transaction.atomic():
+        pending = list(
+            Order.objects.filter(pk__in=order_ids, stock_written_off=False).values_list('id', flat=True)
+        )
+        if not pending:
+            return
+        lines = order_lines(pending)
+        used = rules.current().cart([line for pk in pending for line in lines.get(pk, [])])
+        stock.apply({ingredient_id: -needed for ingredient_id, needed in used.items()})
+        Order.objects.filter(pk__in=pending).update(stock_written_off=True)
+
+
+def complete_orders(order_ids):
+    """
+    Finishes orders wherever they are in the workflow: the admin action, the order form and
+    Order.finish_order all come here.
+    Pending/preparing orders go through 'ready' first, so the history and prep metrics stay
+    consistent with the barista screen. Two batched transitions, already completed ones are skipped.
+    Returns the ids that were completed.
+    """
+    with transaction.atomic():
+        open_orders = dict(
+            Order.objects.filter(pk__in=order_ids).exclude(status='completed').values_list('id', 'status')
+        )
+        not_ready = [pk for pk, status in open_orders.items() if status != 'ready']
+        if not_ready:
+            transition_orders(not_ready, 'ready')
+        return transition_orders(open_orders, 'completed')
+
+
+def recalculate_supply_totals(supply_ids):
+    """Supply.total_cost from its lines for many supplies in one UPDATE. Returns the number updated."""
+    line_sum = SupplyItem.objects.filter(supply=OuterRef('pk')).values('supply').annotate(total=Sum('cost')).values('total')
+    return Supply.objects.filter(pk__in=supply_ids).update(total_cost=Coalesce(Subquery(line_sum), Value(Decimal(0))))
+
+
+def _to_decimal(value, field, line_no):
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(str(value).replace(',', '.').strip())
+    except InvalidOperation:
+        raise ValidationError(f"Line {line_no}: '{value}' is not a valid {field}")
+
+
+def receive_supply_items(supply, items, deleted=()):
+    """
+    Saves supply lines in bulk (admin inline, invoice import).
+    Instead of SupplyItem.save() per line (lock + ingredient save + re-aggregation every time)
+    this does: one read of the old quantities, one UPDATE for all touched ingredients,
+    bulk_create / bulk_update of the lines and a single total recalculation.
+    """
+    items = list(items)
+    deleted = [item for item in deleted if item.pk]
+
+    errors = []
+    for line_no, item in enumerate(items, start=1):
+        if item.quantity is None or item.quantity <= 0:
+            errors.append(f"Line {line_no}: quantity must be positive")
+        elif not item.unit_price and not item.cost:
+            errors.append(f"Line {line_no}: fill in 'Unit Price' OR 'Total Item Cost'")
+        else:
+            item.fill_prices()
+    if errors:
+        raise ValidationError(errors)
+
+    # Old state of edited/deleted lines: their quantities have to be taken back from stock
+    known_ids = [item.pk for item in items if item.pk] + [item.pk for item in deleted]
+    old_lines = {
+        pk: (ingredient_id, quantity)
+        for pk, ingredient_id, quantity in SupplyItem.objects.filter(pk__in=known_ids)
+        .values_list('id', 'ingredient_id', 'quantity')
+    }
+
+    deltas = {}
+    for pk, (ingredient_id, quantity) in old_lines.items():
+        deltas[ingredient_id] = deltas.get(ingredient_id, 0) - quantity
+    for item in items:
+        deltas[item.ingredient_id] = deltas.get(item.ingredient_id, 0) + item.quantity
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+
+    with transaction.atomic():
+        # One UPDATE for every ingredient of the invoice
+        stock.apply(deltas, restock=True)
+
+        new_items = [item for item in items if not item.pk]
+        changed_items = [item for item in items if item.pk]
+        for item in new_items:
+            item.supply = supply
+        SupplyItem.objects.bulk_create(new_items)
+        SupplyItem.objects.bulk_update(changed_items, ['ingredient', 'quantity', 'unit_price', 'cost'])
+        # bulk_update sends no signals (deletes do, see signals.supply_line_changed)
+        hq.record_changes('supplies', [item.pk for item in changed_items])
+        if deleted:
+            SupplyItem.objects.filter(pk__in=[item.pk for item in deleted]).delete()
+
+        supply.update_total()
+        sync_supply_layers(supply, items, deleted)
+
+    return supply
+
+
+def _ingredient_resolver(lines):
+    """Maps the 'ingredient' cell of import lines (a name or an id) to an ingredient id, in two queries."""
+    names = {str(line.get('ingredient', '')).strip() for line in lines}
+    by_name = {i.name: i.pk for i in Ingredient.objects.filter(name__in=names)}
+    ids = {int(n) for n in names if n.isdigit()}
+    by_id = set(Ingredient.objects.filter(pk__in=ids).values_list('id', flat=True))
+    return lambda key: by_name.get(key) or (int(key) if key.isdigit() and int(key) in by_id else None)
+
+
+def intake_supply(supplier, lines):
+    """
+    Creates a Supply from invoice lines:
+    [{'ingredient': <name or id>, 'quantity': ..., 'unit_price': ..., 'cost': ...}, ...]
+    """
+    resolve = _ingredient_resolver(lines)
+
+    items, errors = [], []
+    for line_no, line in enumerate(lines, start=1):
+        key = str(line.get('ingredient', '')).strip()
+        ingredient_id = resolve(key)
+        if ingredient_id is None:
+            errors.append(f"Line {line_no}: unknown ingredient '{key}'")
+            continue
+        try:
+            items.append(SupplyItem(
+                ingredient_id=ingredient_id,
+                quantity=_to_decimal(line.get('quantity'), 'quantity', line_no),
+                unit_price=_to_decimal(line.get('unit_price'), 'unit price', line_no),
+                cost=_to_decimal(line.get('cost'), 'cost', line_no),
+            ))
+        except ValidationError as e:
+            errors.extend(e.messages)
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        supply = Supply.objects.create(supplier=supplier)
+        return receive_supply_items(supply, items)
+
+
+def save_stocktake_lines(stocktake, items, deleted=()):
+    """
+    Saves counted quantities in bulk and sets the stock to what was counted.
+    A new line remembers the book amount it replaced (for the variance report) and moves
+    Ingredient.amount by counted - book; an edited line moves it by the correction,
+    a deleted line gives the adjustment back. One UPDATE for all touched ingredients.
+    """
+    items = list(items)
+    deleted = [item for item in deleted if item.pk]
+
+    errors = []
+    seen = set()
+    for line_no, item in enumerate(items, start=1):
+        if item.counted is None or item.counted < 0:
+            errors.append(f"Line {line_no}: counted quantity can't be negative")
+        if item.ingredient_id in seen:
+            errors.append(f"Line {line_no}: ingredient is counted twice")
+        seen.add(item.ingredient_id)
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        known_ids = [item.pk for item in items if item.pk] + [item.pk for item in deleted]
+        old_lines = {
+            pk: (ingredient_id, counted, book_amount)
+            for pk, ingredient_id, counted, book_amount in StocktakeLine.objects.filter(pk__in=known_ids)
+            .values_list('id', 'ingredient_id', 'counted', 'book_amount')
+        }
+        new_items = [item for item in items if not item.pk]
+        # Lines that count a different ingredient than before start from that ingredient's book amount
+        recounted = [item for item in items if not item.pk or old_lines[item.pk][0] != item.ingredient_id]
+        stock.flush()
+        book = dict(
+            Ingredient.objects.select_for_update()
+            .filter(pk__in=[item.ingredient_id for item in recounted])
+            .values_list('id', 'amount')
+        )
+
+        deltas = {}
+        for pk, (ingredient_id, counted, book_amount) in old_lines.items():
+            # Undo the old adjustment first: the stock goes back to its book amount plus later movements
+            deltas[ingredient_id] = deltas.get(ingredient_id, 0) - (counted - book_amount)
+        for item in items:
+            if item.pk and old_lines[item.pk][0] == item.ingredient_id:
+                item.book_amount = old_lines[item.pk][2]
+            else:
+                item.book_amount = book.get(item.ingredient_id, Decimal(0))
+            deltas[item.ingredient_id] = deltas.get(item.ingredient_id, 0) + (item.counted - item.book_amount)
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+
+        stock.apply(deltas)
+
+        for item in new_items:
+            item.stocktake = stocktake
+        StocktakeLine.objects.bulk_create(new_items)
+        StocktakeLine.objects.bulk_update([item for item in items if item.pk], ['ingredient', 'counted', 'book_amount'])
+        if deleted:
+            StocktakeLine.objects.filter(pk__in=[item.pk for item in deleted]).delete()
+
+    return stocktake
+
+
+def record_stocktake(lines, counted_at=None, note=''):
+    """
+    Creates a Stocktake from count sheet lines:
+    [{'ingredient': <name or id>, 'counted': ...}, ...]
+    """
+    resolve = _ingredient_resolver(lines)
+
+    items, errors = [], []
+    for line_no, line in enumerate(lines, start=1):
+        key = str(line.get('ingredient', '')).strip()
+        ingredient_id = resolve(key)
+        if ingredient_id is None:
+            errors.append(f"Line {line_no}: unknown ingredient '{key}'")
+            continue
+        try:
+            counted = _to_decimal(line.get('counted'), 'counted quantity', line_no)
+        except ValidationError as e:
+            errors.extend(e.messages)
+            continue
+        if counted is None:
+            errors.append(f"Line {line_no}: counted quantity is missing")
+            continue
+        items.append(StocktakeLine(ingredient_id=ingredient_id, counted=counted))
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        stocktake = Stocktake.objects.create(counted_at=counted_at or timezone.now(), note=note)
+        return save_stocktake_lines(stocktake, items)
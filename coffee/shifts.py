@@ -0,0 +1,72 @@
+import threading
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import stamps
+
+STAMP = 'active-shift'
+
+
+class ActiveShiftRegistry:
+    """
+    Process-local cache of the open shift id.
+    The DB guarantees at most one active shift (partial unique constraint);
+    every open/close bumps a stamp file, so other workers notice the change
+    with a stat() instead of querying Shift on every order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shift_id = None
+        self._stamp = None
+        self._loaded = False
+
+    def get_id(self):
+        stamp = stamps.read(STAMP)
+        if self._loaded and stamp == self._stamp:
+            return self._shift_id
+
+        from .models import Shift
+
+        with self._lock:
+            # Read the stamp before the query: a change in between just means one more reload later
+            self._shift_id = Shift.objects.filter(is_active=True).values_list('id', flat=True).first()
+            self._stamp = stamp
+            self._loaded = True
+            return self._shift_id
+
+    def invalidate(self):
+        self._loaded = False
+        stamps.bump(STAMP)
+
+    def open(self):
+        from .models import Shift
+
+        try:
+            with transaction.atomic():
+                return Shift.objects.create(is_active=True)
+        except IntegrityError:
+            # Two managers pressed "Open" at the same time: the unique constraint lets only one win
+            raise ValidationError('Shift already open!')
+
+    def close(self):
+        from .models import Shift
+
+        with transaction.atomic():
+            shift = Shift.objects.filter(is_active=True).first()
+            if not shift:
+                raise ValidationError('No active shift found!')
+            # Calculate totals only for completed orders
+            orders = shift.orders.filter(status='completed')
+            shift.total_sales = orders.aggregate(Sum('total_price'))['total_price__sum'] or 0
+            shift.order_count = orders.count()
+            shift.is_active = False
+            shift.closed_at = timezone.now()
+            shift.save()
+        return shift
+
+
+active_shift = ActiveShiftRegistry()
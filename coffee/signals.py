@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Ingredient, MenuItem, Modifier, Recipe, Shift, SupplyItem
+from . import hq, menu
+from .inventory import sellable
+from .rules import rules
+from .search import menu_search
+from .shifts import active_shift
+from .replica import REPLICA
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, **kwargs):
+    amounts = {instance.pk: instance.amount}
+    transaction.on_commit(lambda: sellable.stock_changed(amounts))
+    if rules.milk_flag_changed(instance.pk, instance.is_milk):
+        # Milk substitution targets changed: recompile this process now, the others via the stamp
+        rules.invalidate()
+        sellable.invalidate()
+        menu.changed()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=MenuItem)
+def menu_changed(sender, **kwargs):
+    rules.invalidate()
+    sellable.invalidate()
+    menu_search.invalidate()
+    menu.changed()
+
+
+@receiver([post_save, post_delete], sender=Modifier)
+def modifier_changed(sender, **kwargs):
+    rules.invalidate()
+    menu.changed()
+
+
+@receiver([post_save, post_delete], sender=Shift)
+def shift_changed(sender, **kwargs):
+    transaction.on_commit(active_shift.invalidate)
+
+
+@receiver(post_save, sender=SupplyItem)
+@receiver(post_delete, sender=SupplyItem)
+def supply_line_changed(sender, instance, created=False, **kwargs):
+    # New lines go out with the 'supplies' watermark; edits and deletions may be below it
+    if not created:
+        hq.record_changes('supplies', [instance.pk])
+
+
+@receiver(connection_created)
+def replica_read_only(sender, connection, **kwargs):
+    if connection.alias == REPLICA:
+        connection.cursor().execute('PRAGMA query_only = ON')
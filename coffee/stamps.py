@@ -0,0 +1,30 @@
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# Cross-process "something changed" markers.
+# SQLite means one machine, so a tiny file per topic is enough for all workers:
+# bump() replaces the file (new inode + mtime), read() is a single stat() call, no DB query.
+
+
+def _path(name):
+    root = Path(getattr(settings, 'COFFEE_STAMP_DIR', settings.BASE_DIR / '.stamps'))
+    root.mkdir(parents=True, exist_ok=True)
+    return root / name
+
+
+def bump(name):
+    path = _path(name)
+    tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp.write_text(str(time.time_ns()))
+    os.replace(tmp, path)
+
+
+def read(name):
+    try:
+        st = os.stat(_path(name))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
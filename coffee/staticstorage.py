@@ -0,0 +1,57 @@
+import gzip
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # optional, gzip alone is fine
+    brotli = None
+
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.html', '.txt', '.xml', '.ico', '.ttf', '.otf'}
+MIN_SIZE = 256
+
+
+def _compress_file(path):
+    """Writes path.gz (and path.br when brotli is installed) next to the file, if it pays off."""
+    data = path.read_bytes()
+    written = []
+    variants = [('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', lambda raw: brotli.compress(raw, quality=11)))
+    for suffix, compress in variants:
+        packed = compress(data)
+        target = path.with_name(path.name + suffix)
+        # Not worth a second file (and a second lookup) for a few saved bytes
+        if len(packed) < len(data) * 0.95:
+            target.write_bytes(packed)
+            written.append(target)
+        elif target.exists():
+            target.unlink()
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic post-processing: fingerprinted names (style.3f2a...css) from the manifest storage,
+    plus precompressed .gz/.br variants for coffee.asgi_static to send as they are.
+    """
+
+    # A file missing from the manifest falls back to its plain name instead of a 500
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names.add(name)
+                if hashed_name:
+                    names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for name in sorted(names):
+            path = Path(self.path(name))
+            if path.suffix.lower() in COMPRESSIBLE and path.exists() and path.stat().st_size >= MIN_SIZE:
+                _compress_file(path)
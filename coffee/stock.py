@@ -0,0 +1,114 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, Value, When
+
+# Every change of Ingredient.amount goes through apply(): order intake, Order.finish_order,
+# supply lines, stocktakes. The same few hot ingredients (milk, coffee beans) are touched by
+# nearly every order, so the deltas are summed per ingredient and written with one
+# UPDATE ... CASE for all of them.
+#
+# Inside the admission writer's batch (coffee/admission.py) apply() only records the delta and
+# batch() writes the sum of the whole batch just before its COMMIT: sixteen orders needing milk
+# are one row update in one transaction instead of sixteen, and every caller gets its answer
+# once that COMMIT is durable. Elsewhere (admin, management commands) the delta is written at
+# once, inside the caller's transaction: the stock moves atomically with the order or supply line
+# that caused it, and another thread couldn't write while this transaction holds the database.
+#
+# Recorded deltas are kept as transaction.on_commit() entries, so Django's savepoint bookkeeping
+# drops the deltas of a request that failed and rolled back its savepoint (as in menu.changed()).
+
+_local = threading.local()
+
+
+class _Pending:
+    """Deltas recorded in the batch, not written yet."""
+
+    def __init__(self, deltas, restock):
+        self.deltas = deltas
+        self.restock = restock
+
+    def __call__(self):
+        pass
+
+
+class _Written:
+    """Deltas written in this transaction; after the commit the sellable portions follow them."""
+
+    def __init__(self, pending, touched):
+        self.pending = pending
+        self.touched = touched
+
+    def __call__(self):
+        from .inventory import sellable
+
+        sellable.refresh_ingredients(self.touched)
+
+
+def _write(deltas, restock):
+    from .models import Ingredient
+
+    Ingredient.objects.filter(pk__in=deltas).update(
+        amount=Case(*[When(pk=pk, then=F('amount') + delta) for pk, delta in deltas.items()]),
+        # A delivery re-arms the reorder robot (services.check_and_reorder)
+        reorder_sent=Case(
+            *[When(pk=pk, then=Value(False)) for pk in restock],
+            default=F('reorder_sent'),
+            output_field=BooleanField(),
+        ),
+    )
+
+
+def apply(deltas, restock=False):
+    """
+    Adds {ingredient_id: delta} to the stock (negative deltas consume it).
+    restock=True marks a delivery: ingredients that went up may be reordered again.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    restock = {pk for pk, delta in deltas.items() if delta > 0} if restock else set()
+
+    connection = transaction.get_connection()
+    if getattr(_local, 'deferred', False) and connection.in_atomic_block:
+        transaction.on_commit(_Pending(deltas, restock))
+        return
+    with transaction.atomic():
+        _write(deltas, restock)
+        transaction.on_commit(_Written((), set(deltas)))
+
+
+def flush():
+    """Writes the deltas recorded so far in this transaction; call before reading Ingredient.amount."""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return
+    callbacks = [func for _, func, _ in connection.run_on_commit]
+    # A _Written entry of a rolled back savepoint is gone with its UPDATE, so its deltas count as pending again
+    written = {id(entry) for func in callbacks if isinstance(func, _Written) for entry in func.pending}
+    pending = [func for func in callbacks if isinstance(func, _Pending) and id(func) not in written]
+    if not pending:
+        return
+
+    totals, restock = defaultdict(int), set()
+    for entry in pending:
+        for pk, delta in entry.deltas.items():
+            totals[pk] += delta
+        restock |= entry.restock
+    totals = {pk: delta for pk, delta in totals.items() if delta}
+    if totals:
+        _write(totals, restock & totals.keys())
+    transaction.on_commit(_Written(pending, set(totals)))
+
+
+@contextmanager
+def batch():
+    """Defers apply() inside the block and writes the coalesced deltas at its end (before COMMIT)."""
+    _local.deferred = True
+    try:
+        yield
+        flush()
+    finally:
+        _local.deferred = False
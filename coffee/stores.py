@@ -0,0 +1,76 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import router, transaction
+
+# Stores.
+# A till process serves one store: STORE_CODE, data in the 'default' database.
+# Several stores can also be served from one install: each gets its own database alias
+# 'store_<code>' and coffee.routers.StoreRouter sends coffee models there inside using(code).
+# HQ models (coffee/hq.py) always go to the 'hq' alias when it exists.
+
+ALIAS_PREFIX = 'store_'
+HQ_ALIAS = 'hq'
+
+_routed = contextvars.ContextVar('coffee_store', default=None)
+_store_ids = {}  # (db alias, store code) -> Store pk
+_lock = threading.Lock()
+
+
+def local_code():
+    return getattr(settings, 'STORE_CODE', 'main')
+
+
+def current_code():
+    return _routed.get() or local_code()
+
+
+def routed_alias():
+    """Database alias of the store selected with using(), None for the local store."""
+    code = _routed.get()
+    if code:
+        alias = ALIAS_PREFIX + code
+        if alias in settings.DATABASES:
+            return alias
+    return None
+
+
+def store_aliases():
+    """{code: alias} of every store this install can reach, the local one included."""
+    aliases = {local_code(): 'default'}
+    for alias in settings.DATABASES:
+        if alias.startswith(ALIAS_PREFIX):
+            aliases[alias[len(ALIAS_PREFIX):]] = alias
+    return aliases
+
+
+def hq_alias():
+    return HQ_ALIAS if HQ_ALIAS in settings.DATABASES else 'default'
+
+
+@contextmanager
+def using(code):
+    """Coffee model queries inside this block run against the database of store `code`."""
+    token = _routed.set(code)
+    try:
+        yield
+    finally:
+        _routed.reset(token)
+
+
+def current_store_id():
+    """Default for the store FKs: the Store row of the current store, created on first use."""
+    from .models import Store
+
+    code = current_code()
+    alias = router.db_for_write(Store)
+    key = (alias, code)
+    if key in _store_ids:
+        return _store_ids[key]
+    with _lock:
+        store, _ = Store.objects.using(alias).get_or_create(code=code, defaults={'name': code})
+    # Remembered once committed: a transaction that rolls back takes a new Store row with it
+    transaction.on_commit(lambda: _store_ids.setdefault(key, store.pk), using=alias)
+    return store.pk
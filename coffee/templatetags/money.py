@@ -0,0 +1,13 @@
+from django import template
+
+from ..money import format_money
+
+register = template.Library()
+
+
+@register.filter
+def money(minor, places=None):
+    """{{ order.total_price|money }} -> '1 250' (tiyn are shown only when there are any)."""
+    if minor in (None, ''):
+        return ''
+    return format_money(int(minor), None if places is None else int(places))
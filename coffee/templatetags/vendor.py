@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+
+from django import template
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+register = template.Library()
+
+LOCK_FILE = Path(__file__).resolve().parents[1] / 'static' / 'vendor' / 'vendor.json'
+
+
+def vendor_url(name):
+    """Vendored copy of a file pinned in vendor.json, or its pinned CDN URL until it was downloaded."""
+    path = f"vendor/{name}"
+    if finders.find(path):
+        try:
+            return static(path)
+        except ValueError:
+            # Downloaded but not collected yet: the manifest has no entry for it
+            pass
+    return json.loads(LOCK_FILE.read_text(encoding='utf-8'))[name]['url']
+
+
+@register.simple_tag
+def vendor_script(name):
+    """{% vendor_script 'chart.umd.js' %} -> <script src=...> (see manage.py vendor_static)."""
+    return format_html('<script src="{}"></script>', vendor_url(name))
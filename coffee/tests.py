@@ -1,3 +1,1123 @@
-from django.test import TestCase
+import contextvars
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import Future
+from contextlib import closing
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connection, router, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import admission, archive, backups, hq, menu, menu_io, money, shifts, stamps, stock, stores
+from .costing import LayerQueue, assign_cogs, recompute_all
+from .inventory import SellableIndex, sellable
+from .metrics import QUEUE_RESYNC, STARTED_TTL, BaristaMetrics
+from .models import (
+    ArchivedOrder, ArchiveSegment, CostLayer, DailySalesRollup, HQOrder, HQOrderLine, HQSupplyLine, Ingredient,
+    MenuItem, Modifier, Order, OrderItem, OrderStatusEvent, Recipe, Shift, Stocktake, StocktakeLine, Supplier, Supply,
+    SupplyItem, SyncChange, TicketCounter,
+)
+from .rules import rules
+from .search import MenuSearchIndex, fold, menu_search
+from .services import complete_orders, receive_supply_items, transition_orders
+from .shifts import active_shift
+from .tickets import next_ticket
+from .variance import stock_variance, theoretical_usage
+from .views import api_create_order
+
+# Stamp files, archive segments, backups and profiles of the test run go to a temporary directory
+_dirs = None
+_settings = None
+
+
+def setUpModule():
+    global _dirs, _settings
+    _dirs = tempfile.TemporaryDirectory(prefix='coffee-tests-')
+    root = Path(_dirs.name)
+    _settings = override_settings(
+        COFFEE_STAMP_DIR=root / 'stamps',
+        ARCHIVE_DIR=root / 'archive',
+        BACKUP_DIR=root / 'backups',
+        PROFILE_DIR=root / 'profiles',
+    )
+    _settings.enable()
+
+
+def tearDownModule():
+    _settings.disable()
+    _dirs.cleanup()
+
+
+class CoffeeTestMixin:
+    """Drops the process-local caches, which outlive the rows of the previous test."""
+
+    def setUp(self):
+        super().setUp()
+        stores._store_ids.clear()
+        rules.invalidate()
+        sellable.invalidate()
+        menu_search.invalidate()
+        active_shift.invalidate()
+
+    def make_product(self, name='Latte', price=1200, **recipe):
+        """A product with a recipe {ingredient name: quantity per M portion}, stock 1000 of each."""
+        item = MenuItem.objects.create(name=name, price=price)
+        for ingredient_name, quantity in (recipe or {'Milk': 200}).items():
+            ingredient, _ = Ingredient.objects.get_or_create(
+                name=ingredient_name, defaults={'unit': 'ml', 'amount': 1000}
+            )
+            Recipe.objects.create(menu_item=item, ingredient=ingredient, quantity_needed=quantity)
+        return item
+
+
+# --- admission control (coffee/admission.py) ---
+
+def job(func):
+    return (contextvars.copy_context(), func, Future(), time.monotonic())
+
+
+class WriteQueueTests(CoffeeTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.writer = admission.WriteQueue()
+
+    def test_batch_is_one_transaction_with_a_savepoint_per_request(self):
+        def create(ticket, fail=False):
+            def func():
+                Order.objects.create(total_price=0, ticket_number=ticket)
+                if fail:
+                    raise ValidationError('no')
+                return ticket
+            return func
+
+        batch = [job(create(1)), job(create(2, fail=True)), job(create(3))]
+        self.writer._commit(batch)
+
+        self.assertEqual(batch[0][2].result(), 1)
+        self.assertRaises(ValidationError, batch[1][2].result)
+        self.assertEqual(batch[2][2].result(), 3)
+        # The failed request rolled back its own savepoint only
+        self.assertEqual(sorted(Order.objects.values_list('ticket_number', flat=True)), [1, 3])
+        self.assertEqual(self.writer.metrics.batches, {3: 1})
+        self.assertEqual(self.writer.metrics.retried, 0)
+
+    def test_failed_commit_retries_each_request_alone(self):
+        runs, committed = [], []
+
+        def create(ticket):
+            def func():
+                runs.append(ticket)
+                Order.objects.create(total_price=0, ticket_number=ticket)
+                transaction.on_commit(lambda: committed.append(ticket))
+                return ticket
+            return func
+
+        real_commit = connection.commit
+        commits = []
+
+        def locked_once():
+            commits.append(True)
+            if len(commits) == 1:
+                raise OperationalError('database is locked')
+            return real_commit()
+
+        batch = [job(create(1)), job(create(2))]
+        with mock.patch.object(connection, 'commit', side_effect=locked_once):
+            self.writer._commit(batch)
+
+        self.assertEqual([future.result() for _, _, future, _ in batch], [1, 2])
+        # Each view ran twice, its on_commit side effects happened once
+        self.assertEqual(runs, [1, 2, 1, 2])
+        self.assertEqual(committed, [1, 2])
+        self.assertEqual(sorted(Order.objects.values_list('ticket_number', flat=True)), [1, 2])
+        self.assertEqual(self.writer.metrics.retried, 1)
+
+    def test_retried_order_is_counted_once(self):
+        item = self.make_product()
+        Shift.objects.create(is_active=True)
+        user = User.objects.create_user('cashier')
+        request = RequestFactory().post(
+            '/api/order/create/', json.dumps({'items': [{'id': item.id}]}), content_type='application/json'
+        )
+        request.user = user
+
+        real_commit = connection.commit
+        commits = []
+
+        def locked_once():
+            commits.append(True)
+            if len(commits) == 1:
+                raise OperationalError('database is locked')
+            return real_commit()
+
+        batch = [job(lambda: api_create_order.__wrapped__(request)) for _ in range(2)]
+        with mock.patch('coffee.views.metrics') as metrics, \
+                mock.patch.object(connection, 'commit', side_effect=locked_once):
+            metrics.estimated_wait.return_value = {'queue_depth': 0, 'wait_seconds': 0}
+            self.writer._commit(batch)
+
+        for _, _, future, _ in batch:
+            self.assertTrue(json.loads(future.result().content)['success'])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(metrics.order_created.call_count, 2)
+        self.assertEqual(Ingredient.objects.get(name='Milk').amount, Decimal('600'))
+
+    def test_view_runs_inline_inside_a_transaction(self):
+        threads = []
+
+        @admission.write_view
+        def view(request):
+            threads.append(threading.current_thread())
+            return 'done'
+
+        request = RequestFactory().post('/')
+        with transaction.atomic():
+            self.assertEqual(view(request), 'done')
+        self.assertEqual(threads, [threading.current_thread()])
+
+        # Outside one it goes through the writer thread
+        self.assertEqual(view(request), 'done')
+        self.assertEqual(threads[-1].name, 'coffee-writer')
+
+
+# --- completing orders (services.complete_orders) ---
+
+def form_data(form):
+    """POST data that submits `form` (admin page, inline, management form) unchanged."""
+    data = {}
+    for name in form.fields:
+        value = form[name].value()
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = [getattr(v, 'pk', v) for v in value]
+        data[form.add_prefix(name)] = getattr(value, 'pk', value)
+    return data
+
+
+class CompleteOrdersTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200)
+        self.milk = Ingredient.objects.get(name='Milk')
+
+    def admin_order(self, status='pending'):
+        order = Order.objects.create(total_price=1200, status=status)
+        OrderItem.objects.create(order=order, menu_item=self.latte, quantity=2, size='M', price=1200)
+        return order
+
+    def test_admin_action_and_finish_order_do_the_same(self):
+        first, second = self.admin_order(), self.admin_order('preparing')
+
+        self.assertEqual(complete_orders([first.pk]), [first.pk])
+        second.finish_order()
+
+        for order in (first, second):
+            order.refresh_from_db()
+            self.assertEqual(order.status, 'completed')
+            self.assertTrue(order.is_completed)
+            self.assertTrue(order.stock_written_off)
+            # Through 'ready', like the barista screen
+            self.assertEqual(
+                list(order.status_events.order_by('pk').values_list('to_status', flat=True))[-2:],
+                ['ready', 'completed'],
+            )
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.amount, Decimal('200'))
+
+    def test_stock_is_written_off_once(self):
+        order = self.admin_order()
+        complete_orders([order.pk])
+        complete_orders([order.pk])
+        order.finish_order()
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.amount, Decimal('600'))
+
+    def test_till_orders_are_not_written_off_again(self):
+        order = self.admin_order()
+        Order.objects.filter(pk=order.pk).update(stock_written_off=True)
+        transition_orders([order.pk], 'ready')
+        transition_orders([order.pk], 'completed')
+        order.refresh_from_db()
+        self.assertTrue(order.is_completed)
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.amount, Decimal('1000'))
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_admin_form_goes_through_the_state_machine(self):
+        admin_user = User.objects.create_superuser('boss', 'boss@example.com', 'x')
+        self.client.force_login(admin_user)
+        order = self.admin_order()
+        url = f'/admin/coffee/order/{order.pk}/change/'
+        page = self.client.get(url)
+        data = form_data(page.context['adminform'].form)
+        for inline in page.context['inline_admin_formsets']:
+            data.update(form_data(inline.formset.management_form))
+            for inline_form in inline.formset.forms:
+                data.update(form_data(inline_form))
+
+        # 'ready' -> 'pending' is not a workflow move: refused, nothing changes
+        order.status = 'ready'
+        order.save()
+        data['status'] = 'pending'
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'ready')
+
+        data['status'] = 'completed'
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'completed')
+        self.assertTrue(order.is_completed)
+        self.assertEqual(list(order.status_events.values_list('to_status', flat=True)), ['completed'])
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.amount, Decimal('600'))
+
+
+# --- barista metrics (coffee/metrics.py) ---
+
+class BaristaMetricsTests(CoffeeTestMixin, TestCase):
+
+    def test_queue_depth_follows_other_workers(self):
+        engine = BaristaMetrics()
+        Order.objects.create(total_price=0)
+        self.assertEqual(engine.estimated_wait()['queue_depth'], 1)
+
+        # Created by another worker: this one only notices on the next recount
+        Order.objects.create(total_price=0)
+        self.assertEqual(engine.estimated_wait()['queue_depth'], 1)
+        engine._depth_counted_at -= QUEUE_RESYNC
+        self.assertEqual(engine.estimated_wait()['queue_depth'], 2)
+
+    def test_stale_starts_are_dropped(self):
+        engine = BaristaMetrics()
+        now = timezone.now()
+        engine.record_transitions([(1, 'pending', now)], 'preparing', now - timedelta(seconds=STARTED_TTL + 60))
+        engine.record_transitions([(2, 'pending', now)], 'preparing', now)
+        self.assertEqual(list(engine._started), [2])
+
+
+# --- stores and the HQ feed (coffee/stores.py, coffee/hq.py) ---
+
+class StoreRoutingTests(SimpleTestCase):
+
+    def test_store_models_follow_using_and_hq_models_stay_on_hq(self):
+        north = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        with mock.patch.dict(settings.DATABASES, {'store_north': north}):
+            self.assertEqual(stores.store_aliases(), {stores.local_code(): 'default', 'north': 'store_north'})
+            self.assertEqual(router.db_for_write(Order), 'default')
+            with stores.using('north'):
+                self.assertEqual(stores.current_code(), 'north')
+                self.assertEqual(router.db_for_write(Order), 'store_north')
+                self.assertEqual(router.db_for_read(TicketCounter), 'store_north')
+                # No 'hq' alias configured: HQ tables live in the default database
+                self.assertEqual(router.db_for_write(HQOrder), 'default')
+            with stores.using('west'):
+                self.assertIsNone(stores.routed_alias())
+
+
+class HQSyncTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200)
+        self.milk = Ingredient.objects.get(name='Milk')
+        self.supply = Supply.objects.create(supplier=Supplier.objects.create(name='Dairy', contact_info='-'))
+
+    def sync(self):
+        return hq.sync_store(stores.local_code())
+
+    def hq_order(self, order):
+        return HQOrder.objects.get(store_code=stores.local_code(), source_id=order.pk)
+
+    def order(self):
+        order = Order.objects.create(total_price=1200, status='completed')
+        OrderItem.objects.create(order=order, menu_item=self.latte, quantity=1, size='M', price=1200)
+        return order
+
+    def test_new_orders_and_status_changes(self):
+        order = Order.objects.create(total_price=1200)
+        OrderItem.objects.create(order=order, menu_item=self.latte, quantity=2, size='M', price=1200)
+        stats = self.sync()
+        self.assertEqual(stats['orders'], 1)
+        self.assertEqual(self.hq_order(order).status, 'pending')
+        self.assertEqual(self.hq_order(order).lines.get().quantity, 2)
+
+        transition_orders([order.pk], 'ready')
+        self.sync()
+        self.assertEqual(self.hq_order(order).status, 'ready')
+        # Nothing new: an empty batch and no duplicates
+        self.assertEqual(self.sync()['orders'], 0)
+        self.assertEqual(HQOrderLine.objects.count(), 1)
+
+    def test_applying_a_delta_twice_changes_nothing(self):
+        self.order()
+        SupplyItem.objects.create(supply=self.supply, ingredient=self.milk, quantity=1000, cost=5000)
+        delta = hq.decode(hq.encode(hq.build_delta()))
+        hq.apply_delta(delta)
+        hq.apply_delta(delta)
+        self.assertEqual((HQOrder.objects.count(), HQOrderLine.objects.count()), (1, 1))
+        self.assertEqual(HQSupplyLine.objects.count(), 1)
+
+    def test_edited_and_deleted_supply_lines_are_sent_again(self):
+        kept = SupplyItem.objects.create(supply=self.supply, ingredient=self.milk, quantity=1000, cost=5000)
+        gone = SupplyItem.objects.create(supply=self.supply, ingredient=self.milk, quantity=500, cost=2500)
+        self.sync()
+        self.assertEqual(HQSupplyLine.objects.count(), 2)
+
+        kept.quantity = 800
+        kept.cost = 4000
+        kept.save()
+        gone.delete()
+        self.sync()
+        line = HQSupplyLine.objects.get()
+        self.assertEqual((line.source_id, line.quantity, line.cost), (kept.pk, Decimal('800'), Decimal('4000')))
+        # Shipped changes are dropped on the store side
+        self.assertFalse(SyncChange.objects.exists())
+
+        receive_supply_items(self.supply, [SupplyItem(pk=kept.pk, ingredient=self.milk, quantity=900, cost=4500)])
+        self.sync()
+        self.assertEqual(HQSupplyLine.objects.get().quantity, Decimal('900'))
+
+    def test_order_restored_from_the_archive_is_sent_again(self):
+        old = self.order()
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=100))
+        self.assertEqual(archive.archive_orders(timedelta(days=90)), 1)
+        new = self.order()
+        self.sync()
+        self.assertFalse(HQOrder.objects.filter(source_id=old.pk).exists())
+
+        archive.restore_order(old.pk)
+        self.sync()
+        self.assertEqual(self.hq_order(old).lines.get().price, 1200)
+        self.assertEqual(HQOrder.objects.count(), 2)
+        self.assertTrue(self.hq_order(new))
+
+
+# --- order workflow (Order.STATUS_TRANSITIONS, services.transition_orders) ---
+
+class TransitionOrdersTests(CoffeeTestMixin, TestCase):
+
+    def test_moves_follow_the_workflow_and_leave_history(self):
+        order = Order.objects.create(total_price=0)
+        self.assertEqual(transition_orders([order.pk], 'preparing'), [order.pk])
+        transition_orders([str(order.pk)], 'ready')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'ready')
+        self.assertEqual(
+            list(order.status_events.order_by('pk').values_list('from_status', 'to_status')),
+            [('pending', 'preparing'), ('preparing', 'ready')],
+        )
+
+    def test_bulk_move_is_all_or_nothing(self):
+        pending = Order.objects.create(total_price=0)
+        done = Order.objects.create(total_price=0, status='completed')
+        with self.assertRaisesMessage(ValidationError, f"#{done.pk} (completed)"):
+            transition_orders([pending.pk, done.pk], 'ready')
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'pending')
+        self.assertFalse(OrderStatusEvent.objects.exists())
+
+    def test_bulk_move_writes_one_event_per_order(self):
+        orders = [Order.objects.create(total_price=0) for _ in range(3)]
+        ids = [order.pk for order in orders]
+        with self.assertNumQueries(6):
+            # savepoint, read, guarded UPDATE, bulk INSERT of events, items for the prep metrics, release
+            transition_orders(ids, 'ready')
+        self.assertEqual(Order.objects.filter(pk__in=ids, status='ready').count(), 3)
+        self.assertEqual(OrderStatusEvent.objects.filter(to_status='ready').count(), 3)
+
+    def test_rejects_unknown_status_and_missing_orders(self):
+        order = Order.objects.create(total_price=0)
+        with self.assertRaisesMessage(ValidationError, "Unknown status"):
+            transition_orders([order.pk], 'lost')
+        with self.assertRaisesMessage(ValidationError, "Orders not found"):
+            transition_orders([order.pk, order.pk + 100], 'ready')
+        self.assertEqual(transition_orders([], 'ready'), [])
+
+    def test_barista_endpoint(self):
+        self.client.force_login(User.objects.create_user('barista'))
+        orders = [Order.objects.create(total_price=0) for _ in range(2)]
+        response = self.client.post(
+            '/api/orders/status/', json.dumps({'order_ids': [o.pk for o in orders], 'status': 'preparing'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json(), {'success': True, 'updated': [o.pk for o in orders]})
+        response = self.client.post(
+            f'/api/order/{orders[0].pk}/update/', json.dumps({'status': 'completed'}), content_type='application/json'
+        )
+        self.assertFalse(response.json()['success'])
+
+
+# --- sellable portions (coffee/inventory.py) ---
+
+class SellableIndexTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200)
+        self.tea = MenuItem.objects.create(name='Tea', price=500, is_sized=False)
+        self.milk = Ingredient.objects.get(name='Milk')
+        self.index = SellableIndex()
+
+    def test_portions_per_size(self):
+        self.assertEqual(self.index.portions(self.latte.pk, 'S'), 7)   # 1000 / 140
+        self.assertEqual(self.index.portions(self.latte.pk, 'M'), 5)
+        self.assertEqual(self.index.portions(self.latte.pk, 'L'), 3)   # 1000 / 260
+        # No recipe: nothing limits it
+        self.assertIsNone(self.index.portions(self.tea.pk))
+
+    def test_changes_since_a_token(self):
+        token, everything = self.index.changes_since()
+        self.assertEqual(set(everything), {self.latte.pk, self.tea.pk})
+        self.assertEqual(self.index.changes_since(token), (token, {}))
+
+        self.index.stock_changed({self.milk.pk: Decimal('400')})
+        token2, changed = self.index.changes_since(token)
+        self.assertEqual(changed, {self.latte.pk: {'S': 2, 'M': 2, 'L': 1}})
+        self.assertNotEqual(token2, token)
+
+        # A token of another process (or from before a restart) gets the full list
+        _, changed = self.index.changes_since('deadbeef-1')
+        self.assertEqual(set(changed), {self.latte.pk, self.tea.pk})
+
+    def test_cart_needs_enough_portions_of_each_product(self):
+        Shift.objects.create(is_active=True)
+        self.client.force_login(User.objects.create_user('cashier'))
+
+        def order(count):
+            return self.client.post(
+                '/api/order/create/', json.dumps({'items': [{'id': self.latte.pk}] * count}),
+                content_type='application/json',
+            ).json()
+
+        self.assertEqual(order(6), {'success': False, 'error': 'Only 5 x Latte left'})
+        self.assertTrue(order(5)['success'])
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.amount, 0)
+
+
+# --- cost of goods sold (coffee/costing.py) ---
+
+class LayerQueueTests(SimpleTestCase):
+
+    def queue(self, method):
+        queue = LayerQueue(method)
+        queue.add(CostLayer(remaining=Decimal(10), unit_cost=Decimal(1)))
+        queue.add(CostLayer(remaining=Decimal(10), unit_cost=Decimal(2)))
+        return queue
+
+    def test_fifo_takes_the_oldest_lot_first(self):
+        queue = self.queue('fifo')
+        self.assertEqual(queue.consume(Decimal(15)), Decimal(20))   # 10 x 1 + 5 x 2
+        self.assertEqual(queue.consume(Decimal(5)), Decimal(10))
+        # Below zero on paper: the latest purchase price
+        self.assertEqual(queue.consume(Decimal(3)), Decimal(6))
+
+    def test_average_uses_the_weighted_cost(self):
+        queue = self.queue('average')
+        self.assertEqual(queue.consume(Decimal(15)), Decimal('22.5'))
+        self.assertEqual(queue.consume(Decimal(5)), Decimal('7.5'))
+
+
+class AssignCogsTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200)
+        milk = Ingredient.objects.get(name='Milk')
+        supply = Supply.objects.create(supplier=Supplier.objects.create(name='Dairy', contact_info='-'))
+        # 100 ml at 0.50, then 1000 ml at 1.00
+        SupplyItem.objects.create(supply=supply, ingredient=milk, quantity=100, cost=50)
+        SupplyItem.objects.create(supply=supply, ingredient=milk, quantity=1000, cost=1000)
+
+    def sell(self):
+        order = Order.objects.create(total_price=1200)
+        item = OrderItem.objects.create(order=order, menu_item=self.latte, quantity=1, size='M', price=1200)
+        assign_cogs([item])
+        item.refresh_from_db()
+        return item.cogs
+
+    def test_fifo(self):
+        self.assertEqual(self.sell(), 15000)   # 100 x 0.50 + 100 x 1.00, in tiyn
+        self.assertEqual(self.sell(), 20000)
+        self.assertEqual(
+            list(CostLayer.objects.values_list('remaining', flat=True)), [Decimal(0), Decimal(700)]
+        )
+
+    @override_settings(COGS_METHOD='average')
+    def test_average(self):
+        self.assertEqual(self.sell(), 19091)   # 200 x 1050 / 1100
+
+    def test_recompute_matches_the_live_path(self):
+        live = [self.sell(), self.sell()]
+        OrderItem.objects.update(cogs=None)
+        self.assertEqual(recompute_all(), 2)
+        self.assertEqual(list(OrderItem.objects.order_by('pk').values_list('cogs', flat=True)), live)
+
+
+# --- shifts (coffee/shifts.py) ---
+
+class ShiftTests(CoffeeTestMixin, TestCase):
+
+    def test_only_one_shift_can_be_open(self):
+        shift = active_shift.open()
+        with self.assertRaisesMessage(ValidationError, 'Shift already open!'):
+            active_shift.open()
+        # The partial unique index holds even without the registry
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Shift.objects.create(is_active=True)
+        self.assertEqual(list(Shift.objects.values_list('pk', flat=True)), [shift.pk])
+
+    def test_close_sums_completed_orders_and_allows_a_new_shift(self):
+        shift = active_shift.open()
+        Order.objects.create(shift=shift, total_price=1200, status='completed')
+        Order.objects.create(shift=shift, total_price=900, status='completed')
+        Order.objects.create(shift=shift, total_price=500)
+
+        closed = active_shift.close()
+        self.assertEqual((closed.total_sales, closed.order_count, closed.is_active), (2100, 2, False))
+        with self.assertRaisesMessage(ValidationError, 'No active shift found!'):
+            active_shift.close()
+        self.assertNotEqual(active_shift.open().pk, shift.pk)
+
+    def test_registry_follows_the_stamp(self):
+        self.assertIsNone(active_shift.get_id())
+        shift = Shift.objects.create(is_active=True)
+        # Another worker opened it: cached until the stamp moves (on commit, see signals.shift_changed)
+        self.assertIsNone(active_shift.get_id())
+        stamps.bump(shifts.STAMP)
+        self.assertEqual(active_shift.get_id(), shift.pk)
+
+    def test_shift_endpoint(self):
+        self.client.force_login(User.objects.create_user('manager'))
+        self.assertEqual(self.client.post('/api/shift/open/').json(), {'success': True})
+        self.assertEqual(
+            self.client.post('/api/shift/open/').json(), {'success': False, 'error': 'Shift already open!'}
+        )
+        self.assertTrue(self.client.post('/api/shift/close/').json()['success'])
+
+
+# --- ticket numbers (coffee/tickets.py) ---
+
+class TicketTests(CoffeeTestMixin, TestCase):
+
+    def test_numbers_count_up_per_shift(self):
+        self.assertEqual([next_ticket(1) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(next_ticket(2), 1)
+        self.assertEqual(next_ticket(1), 4)
+
+    @override_settings(TICKET_MAX=3)
+    def test_numbers_wrap_around(self):
+        self.assertEqual([next_ticket(1) for _ in range(5)], [1, 2, 3, 1, 2])
+
+    @override_settings(TICKET_RESET='day')
+    def test_daily_reset_ignores_the_shift(self):
+        self.assertEqual([next_ticket(1), next_ticket(2)], [1, 2])
+        self.assertEqual(TicketCounter.objects.get().scope, f"day:{timezone.localdate().isoformat()}")
+
+    def test_failed_order_does_not_burn_a_number(self):
+        with self.assertRaises(ValidationError), transaction.atomic():
+            next_ticket(1)
+            raise ValidationError('sold out')
+        self.assertEqual(next_ticket(1), 1)
+
+    def test_store_database_gets_the_counter(self):
+        with mock.patch('coffee.tickets.router.db_for_write', return_value='default') as db_for_write:
+            next_ticket(1)
+        db_for_write.assert_called_once_with(TicketCounter)
+
+
+# --- order archive (coffee/archive.py) ---
+
+class ArchiveTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200)
+        self.syrup = Modifier.objects.create(name='Vanilla', price=200)
+
+    def old_order(self, days=100, status='completed'):
+        order = Order.objects.create(total_price=1400, status=status, ticket_number=7, is_completed=True)
+        item = OrderItem.objects.create(order=order, menu_item=self.latte, size='L', price=1400, cogs=310)
+        item.modifiers.add(self.syrup)
+        OrderStatusEvent.objects.create(order=order, from_status='ready', to_status='completed')
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+        return order
+
+    def test_round_trip(self):
+        order = self.old_order()
+        created_at = Order.objects.get(pk=order.pk).created_at
+
+        self.assertEqual(archive.archive_orders(timedelta(days=90)), 1)
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        segment = ArchiveSegment.objects.get()
+        self.assertTrue(archive.verify_segment(segment))
+        rollup = DailySalesRollup.objects.get()
+        self.assertEqual((rollup.menu_item_name, rollup.quantity, rollup.revenue, rollup.cogs), ('Latte', 1, 1400, 310))
+
+        restored = archive.restore_order(order.pk)
+        restored.refresh_from_db()
+        self.assertEqual(
+            (restored.created_at, restored.status, restored.total_price, restored.ticket_number),
+            (created_at, 'completed', 1400, 7),
+        )
+        item = restored.items.get()
+        self.assertEqual((item.size, item.price, item.cogs), ('L', 1400, 310))
+        self.assertEqual(list(item.modifiers.all()), [self.syrup])
+        self.assertEqual(restored.status_events.get().to_status, 'completed')
+        # Live again: no longer in the index nor counted in the rollups
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertEqual(DailySalesRollup.objects.get().quantity, 0)
+
+    def test_only_old_completed_orders_are_archived(self):
+        self.old_order(days=10)
+        self.old_order(status='ready')
+        self.assertEqual(archive.archive_orders(timedelta(days=90)), 0)
+        self.assertFalse(ArchiveSegment.objects.exists())
+
+    def test_segments_never_overwrite_each_other(self):
+        self.old_order()
+        archive.archive_orders(timedelta(days=90))
+        self.old_order()
+        archive.archive_orders(timedelta(days=90))
+        paths = list(ArchiveSegment.objects.values_list('path', flat=True))
+        self.assertEqual(len(set(paths)), 2)
+        self.assertTrue(all(archive.verify_segment(segment) for segment in ArchiveSegment.objects.all()))
+
+    def test_tampered_segment_fails_verification(self):
+        self.old_order()
+        archive.archive_orders(timedelta(days=90))
+        segment = ArchiveSegment.objects.get()
+        with (archive.archive_dir() / segment.path).open('ab') as f:
+            f.write(b'x')
+        self.assertFalse(archive.verify_segment(segment))
+
+
+# --- backups (coffee/backups.py) ---
+
+class BackupTests(SimpleTestCase):
+    """Against a scratch SQLite file: the test database itself lives in memory."""
+
+    def setUp(self):
+        self.primary = Path(_dirs.name) / f'primary-{self._testMethodName}.sqlite3'
+        with closing(sqlite3.connect(self.primary)) as db, db:
+            db.execute('CREATE TABLE sale (amount INTEGER)')
+            db.executemany('INSERT INTO sale VALUES (?)', [(n,) for n in range(1000)])
+        patcher = mock.patch('coffee.backups.primary_path', return_value=self.primary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [path.unlink() for path in backups.list_backups()])
+
+    def sales(self):
+        with closing(sqlite3.connect(self.primary)) as db:
+            return db.execute('SELECT COUNT(*) FROM sale').fetchone()[0]
+
+    def test_backup_verify_restore(self):
+        result = backups.create_backup(pages=4, pause=0)
+        self.assertGreater(result['steps'], 1)
+        backups.verify_backup(result['path'])
+        self.assertEqual(backups.resolve(), result['path'])
+
+        with closing(sqlite3.connect(self.primary)) as db, db:
+            db.execute('DELETE FROM sale')
+        backups.restore_backup(result['path'])
+        self.assertEqual(self.sales(), 1000)
+
+    def test_backups_never_overwrite_each_other(self):
+        first = backups.create_backup()['path']
+        second = backups.create_backup()['path']
+        self.assertNotEqual(first, second)
+        self.assertEqual(backups.list_backups(), [second, first])
+
+    def test_damaged_backup_is_refused(self):
+        path = backups.create_backup()['path']
+        with path.open('ab') as f:
+            f.write(b'x')
+        with self.assertRaisesMessage(ValidationError, 'checksum mismatch'):
+            backups.restore_backup(path)
+        Path(f"{path}.sha256").unlink()
+        with self.assertRaisesMessage(ValidationError, 'checksum file is missing'):
+            backups.verify_backup(path)
+        self.assertEqual(self.sales(), 1000)
+
+    def test_rotation_keeps_the_newest(self):
+        paths = [backups.create_backup()['path'] for _ in range(3)]
+        self.assertEqual(backups.rotate(keep=2), [paths[0].name])
+        self.assertEqual(backups.list_backups(), paths[:0:-1])
+        self.assertFalse(Path(f"{paths[0]}.sha256").exists())
+
+
+# --- money in tiyn (coffee/money.py) ---
+
+class MoneyTests(SimpleTestCase):
+
+    def test_conversions(self):
+        self.assertEqual(money.to_minor('1 250,5'), 125050)
+        self.assertEqual(money.to_minor(Decimal('0.005')), 1)      # half up
+        self.assertEqual(money.to_minor(12), 1200)
+        self.assertIsNone(money.to_minor(''))
+        with self.assertRaises(ValueError):
+            money.to_minor('twelve')
+        self.assertEqual(money.to_major(125050), Decimal('1250.50'))
+
+    def test_formatting(self):
+        self.assertEqual(money.format_money(125000), '1 250')
+        self.assertEqual(money.format_money(125050), '1 250.50')
+        self.assertEqual(money.format_money(125050, places=0), '1 251')
+        self.assertEqual(money.format_money(100000, places=2), '1 000.00')
+        self.assertEqual(money.format_money(-5000), '-50')
+
+    def test_line_prices_are_int_arithmetic(self):
+        self.assertEqual(money.line_price(99900, 'L', [20000]), 149870)   # 999 x 1.3 rounded + 200
+        self.assertEqual(money.line_price(1050, 'S'), 735)
+        self.assertEqual(money.line_price(1050, 'S', sized=False), 1050)
+        self.assertEqual(money.line_price(1000, 'M', [150, 50], quantity=3), 3600)
+
+    def test_fields_refuse_fractions_of_a_tiyn(self):
+        field = money.MoneyFormField()
+        self.assertEqual(field.clean('10.55'), 1055)
+        with self.assertRaises(ValidationError):
+            field.clean('10.555')
+        with self.assertRaises(TypeError):
+            Order._meta.get_field('total_price').get_prep_value(Decimal('12.5'))
+
+
+class OrderPricingTests(CoffeeTestMixin, TestCase):
+
+    def test_order_total_matches_the_cart(self):
+        latte = self.make_product('Latte', price=99900, Milk=200)
+        syrup = Modifier.objects.create(name='Vanilla', price=20000)
+        Shift.objects.create(is_active=True)
+        self.client.force_login(User.objects.create_user('cashier'))
+        response = self.client.post('/api/order/create/', json.dumps({'items': [
+            {'id': latte.pk, 'size': 'L', 'modifiers': [syrup.pk]},
+            {'id': latte.pk, 'size': 'S'},
+        ]}), content_type='application/json').json()
+        order = Order.objects.get(pk=response['order_id'])
+        self.assertEqual(sorted(order.items.values_list('price', flat=True)), [69930, 149870])
+        self.assertEqual(order.total_price, 149870 + 69930)
+
+
+# --- ingredient rules (coffee/rules.py) ---
+
+class RuleBookTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        def ingredient(name, **fields):
+            return Ingredient.objects.create(name=name, unit='ml', **fields)
+
+        self.beans = ingredient('Beans')
+        self.milk = ingredient('Milk', is_milk=True)
+        self.oat = ingredient('Oat milk', is_milk=True)
+        self.sugar = ingredient('Sugar')
+        self.syrup = ingredient('Vanilla syrup')
+        self.latte = MenuItem.objects.create(name='Latte', price=1200)
+        Recipe.objects.create(menu_item=self.latte, ingredient=self.beans, quantity_needed=18, scales_with_size=False)
+        Recipe.objects.create(menu_item=self.latte, ingredient=self.milk, quantity_needed=200)
+        Recipe.objects.create(menu_item=self.latte, ingredient=self.sugar, quantity_needed=5)
+
+        def modifier(name, **fields):
+            return Modifier.objects.create(name=name, **fields).pk
+
+        self.oat_swap = modifier('Oat', type='milk', action='replace', ingredient=self.oat)
+        self.vanilla = modifier('Vanilla', type='syrup', ingredient=self.syrup, quantity_needed=10)
+        self.extra_milk = modifier('Extra milk', type='milk', ingredient=self.milk, quantity_needed=50)
+        self.no_sugar = modifier('No sugar', action='remove', target=self.sugar)
+
+    def unit(self, size='M', *modifier_ids):
+        return dict(rules.current().unit(self.latte.pk, size, modifier_ids))
+
+    def test_recipe_scales_with_size(self):
+        self.assertEqual(self.unit('L'), {self.beans.pk: 18, self.milk.pk: 260, self.sugar.pk: Decimal('6.5')})
+
+    def test_modifier_actions(self):
+        # Replace without a target swaps every milk of the recipe, same quantity
+        self.assertEqual(
+            self.unit('S', self.oat_swap), {self.beans.pk: 18, self.oat.pk: 140, self.sugar.pk: Decimal('3.5')}
+        )
+        # Syrups are per drink, milk add-ons follow the cup
+        self.assertEqual(self.unit('L', self.vanilla)[self.syrup.pk], 10)
+        self.assertEqual(self.unit('L', self.extra_milk)[self.milk.pk], 325)
+        self.assertNotIn(self.sugar.pk, self.unit('M', self.no_sugar))
+        # Removals and swaps apply to the recipe before add-ons, whatever the order
+        both = self.unit('M', self.extra_milk, self.oat_swap)
+        self.assertEqual((both[self.oat.pk], both[self.milk.pk]), (200, 50))
+
+    def test_cart_is_lookups_only(self):
+        book = rules.current()
+        lines = [(self.latte.pk, 'M', [self.vanilla], 2), (self.latte.pk, 'L', [], 1)]
+        with self.assertNumQueries(0):
+            used = book.cart(lines * 50)
+        self.assertEqual(used[self.milk.pk], 50 * (2 * 200 + 260))
+        self.assertEqual(used[self.syrup.pk], 50 * 2 * 10)
+
+    def test_book_is_recompiled_after_a_menu_change(self):
+        book = rules.current()
+        self.assertIs(rules.current(), book)
+        Recipe.objects.filter(menu_item=self.latte, ingredient=self.milk).update(quantity_needed=250)
+        self.assertIs(rules.current(), book)
+        stamps.bump(menu.STAMP)
+        self.assertEqual(self.unit()[self.milk.pk], 250)
+
+
+# --- stock variance (coffee/variance.py) ---
+
+class StockVarianceTests(CoffeeTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200)
+        self.milk = Ingredient.objects.get(name='Milk')
+        now = timezone.now()
+        self.start, self.end = now - timedelta(days=3), now + timedelta(hours=1)
+        self.opening = Stocktake.objects.create(counted_at=self.start)
+        StocktakeLine.objects.create(stocktake=self.opening, ingredient=self.milk, counted=1000, book_amount=1000)
+        supply = Supply.objects.create(supplier=Supplier.objects.create(name='Dairy', contact_info='-'))
+        SupplyItem.objects.create(supply=supply, ingredient=self.milk, quantity=500, cost=500)
+
+    def sell(self, at=None):
+        order = Order.objects.create(total_price=1200)
+        OrderItem.objects.create(order=order, menu_item=self.latte, size='M', price=1200)
+        if at:
+            Order.objects.filter(pk=order.pk).update(created_at=at)
+
+    def count(self, counted):
+        stocktake = Stocktake.objects.create(counted_at=self.end)
+        StocktakeLine.objects.create(stocktake=stocktake, ingredient=self.milk, counted=counted, book_amount=900)
+        return stock_variance(stocktake)
+
+    def test_usage_counts_each_order_once(self):
+        self.sell()
+        self.sell()
+        self.sell(at=self.start - timedelta(minutes=1))   # previous period
+        self.sell(at=self.end)                            # next period: the range is half-open
+        self.assertEqual(theoretical_usage(self.start, self.end), {self.milk.pk: 400})
+
+    def test_archived_days_are_counted_in_one_period_only(self):
+        day = timezone.localdate(self.start) + timedelta(days=1)
+        DailySalesRollup.objects.create(date=day, menu_item=self.latte, menu_item_name='Latte', quantity=2)
+        DailySalesRollup.objects.create(
+            date=timezone.localdate(self.end), menu_item=self.latte, menu_item_name='Latte', quantity=5
+        )
+        self.assertEqual(theoretical_usage(self.start, self.end), {self.milk.pk: 400})
+
+    def test_shrinkage_is_flagged_and_valued(self):
+        self.sell()
+        self.sell()
+        self.sell()
+        [row] = self.count(850)
+        # 1000 opening + 500 received - 600 used = 900 expected
+        self.assertEqual((row.opening, row.received, row.usage, row.expected), (1000, 500, 600, 900))
+        self.assertEqual((row.variance, row.percent, row.flag), (-50, Decimal('-8.3'), 'shrinkage'))
+        self.assertEqual(row.cost, -5000)
+        self.assertEqual(row.book_variance, -50)
+
+    def test_small_differences_are_within_tolerance(self):
+        for _ in range(3):
+            self.sell()
+        [row] = self.count(890)
+        self.assertEqual((row.variance, row.flag), (-10, ''))
+
+
+# --- menu import/export (coffee/menu_io.py) ---
+
+class MenuImportTests(CoffeeTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.latte = self.make_product('Latte', Milk=200, Espresso=18)
+        self.oat = Ingredient.objects.create(name='Oat Milk', unit='ml', is_milk=True)
+        Modifier.objects.create(name='Oat', type='milk', price=300, action='replace', ingredient=self.oat)
+
+    def import_menu(self, data, **kwargs):
+        with self.captureOnCommitCallbacks() as callbacks:
+            stats = menu_io.import_menu(data, **kwargs)
+        return stats, callbacks
+
+    def test_export_imports_back_without_changes(self):
+        stats, callbacks = self.import_menu(menu_io.export_menu())
+        self.assertEqual(stats['ingredients'], {'created': 0, 'updated': 0, 'unchanged': 3})
+        self.assertEqual(stats['modifiers'], {'created': 0, 'updated': 0, 'unchanged': 1})
+        self.assertEqual(stats['menu_items'], {'created': 0, 'updated': 0, 'unchanged': 1})
+        self.assertEqual(stats['recipes'], {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 2})
+        # Nothing written: the menu version stays
+        self.assertEqual(callbacks, [])
+
+    def test_only_differences_are_written(self):
+        data = menu_io.export_menu()
+        data['menu_items'][0]['price'] = '13.50'
+        data['menu_items'][0]['recipe'] = [{'ingredient': 'Milk', 'quantity': '250', 'scales_with_size': True}]
+        data['menu_items'].append({'name': 'Flat White', 'price': '14', 'recipe': [
+            {'ingredient': 'Milk', 'quantity': '150'}, {'ingredient': 'Espresso', 'quantity': '36'},
+        ]})
+        stats, _ = self.import_menu(data)
+
+        self.assertEqual(stats['menu_items'], {'created': 1, 'updated': 1, 'unchanged': 0})
+        self.assertEqual(stats['recipes'], {'created': 2, 'updated': 1, 'deleted': 1, 'unchanged': 0})
+        self.latte.refresh_from_db()
+        self.assertEqual(self.latte.price, 1350)
+        self.assertEqual(
+            list(self.latte.recipes.values_list('ingredient__name', 'quantity_needed')), [('Milk', 250)]
+        )
+        self.assertEqual(MenuItem.objects.get(name='Flat White').recipes.count(), 2)
+        # One menu version bump for the whole transaction, however many rows changed
+        self.assertEqual(sum(func is menu._bump for _, func, _ in connection.run_on_commit), 1)
+
+    def test_dry_run_reports_and_rolls_back(self):
+        data = menu_io.export_menu()
+        data['menu_items'].append({
+            'name': 'Mocha', 'price': '15', 'recipe': [{'ingredient': 'Milk', 'quantity': '180'}],
+        })
+        stats, callbacks = self.import_menu(data, dry_run=True)
+        self.assertEqual(stats['menu_items']['created'], 1)
+        self.assertFalse(MenuItem.objects.filter(name='Mocha').exists())
+        self.assertEqual(callbacks, [])
+
+    def test_csv_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            menu_io.write_csv(menu_io.export_menu(), directory)
+            stats, _ = self.import_menu(menu_io.read_file(directory))
+            self.assertEqual(stats['recipes']['unchanged'], 2)
+            self.assertFalse(any(counts['created'] or counts['updated'] for counts in stats.values()))
+
+            # recipes.csv holds whole recipes: a line dropped from it is deleted
+            recipes = Path(directory) / 'recipes.csv'
+            lines = recipes.read_text(encoding='utf-8').splitlines()
+            recipes.write_text('\n'.join(line for line in lines if 'Espresso' not in line) + '\n', encoding='utf-8')
+            (Path(directory) / 'menu_items.csv').unlink()
+            stats, _ = self.import_menu(menu_io.read_file(directory))
+        self.assertEqual(stats['recipes']['deleted'], 1)
+        self.assertEqual(list(self.latte.recipes.values_list('ingredient__name', flat=True)), ['Milk'])
+
+    def test_errors_are_reported_before_anything_is_written(self):
+        data = menu_io.export_menu()
+        data['menu_items'][0]['price'] = '99'
+        data['menu_items'].append({
+            'name': 'Raf', 'price': 'abc', 'recipe': [{'ingredient': 'Cream', 'quantity': '50'}],
+        })
+        with self.assertRaises(ValidationError) as raised:
+            menu_io.import_menu(data)
+        self.assertEqual(len(raised.exception.messages), 2)
+        self.latte.refresh_from_db()
+        self.assertEqual(self.latte.price, 1200)
+
+
+# --- stock deltas (coffee/stock.py) ---
+
+class StockTests(CoffeeTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.milk = Ingredient.objects.create(name='Milk', unit='ml', amount=1000, reorder_sent=True)
+        self.beans = Ingredient.objects.create(name='Beans', unit='g', amount=500, reorder_sent=True)
+
+    def amounts(self):
+        return dict(Ingredient.objects.values_list('name', 'amount'))
+
+    def updates(self, queries):
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+
+    def test_batch_writes_one_update_for_all_deltas(self):
+        with CaptureQueriesContext(connection) as queries:
+            with stock.batch():
+                for _ in range(16):
+                    stock.apply({self.milk.pk: -50, self.beans.pk: -18})
+                self.assertEqual(self.amounts(), {'Milk': 1000, 'Beans': 500})
+        self.assertEqual(len(self.updates(queries)), 1)
+        self.assertEqual(self.amounts(), {'Milk': 200, 'Beans': 212})
+
+    def test_outside_a_batch_the_delta_is_written_at_once(self):
+        stock.apply({self.milk.pk: -50, self.beans.pk: 0})
+        self.assertEqual(self.amounts(), {'Milk': 950, 'Beans': 500})
+
+    def test_rolled_back_savepoint_drops_its_deltas(self):
+        with stock.batch():
+            stock.apply({self.milk.pk: -100})
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    stock.apply({self.milk.pk: -300})
+                    # The savepoint flushed (a read of the stock) before failing: its UPDATE goes too
+                    stock.flush()
+                    raise IntegrityError
+            stock.apply({self.beans.pk: -20})
+        self.assertEqual(self.amounts(), {'Milk': 900, 'Beans': 480})
+
+    def test_flush_then_more_deltas_are_not_written_twice(self):
+        with stock.batch():
+            stock.apply({self.milk.pk: -100})
+            stock.flush()
+            self.assertEqual(self.amounts()['Milk'], 900)
+            stock.apply({self.milk.pk: -50})
+        self.assertEqual(self.amounts()['Milk'], 850)
+
+    def test_restock_rearms_reorder_of_what_went_up(self):
+        with stock.batch():
+            stock.apply({self.milk.pk: 1000, self.beans.pk: -10}, restock=True)
+        self.milk.refresh_from_db()
+        self.beans.refresh_from_db()
+        self.assertEqual((self.milk.amount, self.milk.reorder_sent), (2000, False))
+        self.assertEqual((self.beans.amount, self.beans.reorder_sent), (490, True))
+
+
+# --- menu search (coffee/search.py) ---
+
+class MenuSearchTests(CoffeeTestMixin, TestCase):
+    def index(self, *names):
+        return MenuSearchIndex('1', {
+            pk: {'id': pk, 'name': name, 'price': 1000, 'category': 'coffee'} for pk, name in enumerate(names, 1)
+        })
+
+    def names(self, index, query):
+        return [item['name'] for item in index.search(query)]
+
+    def test_fold_spells_alike_names_alike(self):
+        self.assertEqual(fold('Капучино'), fold('Cappuccino'))
+        self.assertEqual(fold('ЛАТТЕ'), fold('latte'))
+        self.assertEqual(fold('Қымыз'), fold('Kymyz'))
+        self.assertEqual(fold('Frappé'), fold('frappe'))
+
+    def test_prefix_and_infix_matches(self):
+        index = self.index('Latte', 'Iced Latte', 'Raf', 'Cappuccino')
+        self.assertEqual(self.names(index, 'lat'), ['Latte', 'Iced Latte'])
+        self.assertEqual(self.names(index, 'атте'), ['Latte', 'Iced Latte'])
+        self.assertEqual(self.names(index, 'капуч'), ['Cappuccino'])
+        self.assertEqual(self.names(index, 'ic lat'), ['Iced Latte'])
+        self.assertEqual(self.names(index, 'mocha'), [])
+        self.assertEqual(self.names(index, '  '), [])
+
+    def test_exact_and_leading_matches_rank_first(self):
+        index = self.index('Iced Tea', 'Tea Latte', 'Tea', 'Matcha Latte')
+        self.assertEqual(self.names(index, 'tea'), ['Tea', 'Tea Latte', 'Iced Tea'])
+        self.assertEqual(index.search('tea', limit=1)[0]['name'], 'Tea')
+
+    def test_registry_follows_the_menu_version(self):
+        self.make_product('Latte')
+        self.assertEqual(self.names(menu_search.current(), 'latte'), ['Latte'])
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(name='Flat White', price=1400)
+        self.assertEqual(self.names(menu_search.current(), 'flat'), ['Flat White'])
+
+    def test_search_endpoint(self):
+        self.make_product('Капучино', price=1350)
+        response = self.client.get('/api/menu/search/', {'q': 'cappuccino', 'limit': 'x'})
+        self.assertEqual(response.status_code, 200)
+        [result] = response.json()['results']
+        self.assertEqual((result['name'], result['category']), ('Капучино', 'coffee'))
+        self.assertEqual(Decimal(str(result['price'])), Decimal('13.50'))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+
+def _scope(shift_id):
+    # 'shift': numbers restart with every shift, 'day': every calendar day
+    if getattr(settings, 'TICKET_RESET', 'shift') == 'day':
+        return f"day:{timezone.localdate().isoformat()}"
+    return f"shift:{shift_id}"
+
+
+def next_ticket(shift_id):
+    """
+    Allocates the next short ticket number atomically: one upsert that increments
+    the counter row and returns the new value (UPDATE ... RETURNING), so two tills
+    can never get the same number. Called inside the order transaction, so a failed
+    order doesn't burn a number.
+    """
+    from .models import TicketCounter
+
+    # The store database of the order (coffee/stores.py), not necessarily 'default'
+    connection = connections[router.db_for_write(TicketCounter)]
+    table = connection.ops.quote_name(TicketCounter._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ("scope", "value") VALUES (%s, 1) '
+            f'ON CONFLICT ("scope") DO UPDATE SET "value" = {table}."value" + 1 '
+            f'RETURNING "value"',
+            [_scope(shift_id)],
+        )
+        value = cursor.fetchone()[0]
+
+    limit = getattr(settings, 'TICKET_MAX', 999)
+    return (value - 1) % limit + 1
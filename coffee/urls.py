@@ -21,5 +21,12 @@ urlpatterns = [
     
     # !!! ВОТ ЭТОЙ СТРОКИ СКОРЕЕ ВСЕГО НЕ БЫЛО !!!
     path('api/order/<int:order_id>/update/', views.api_update_status, name='api_update_status'),
+    path('api/orders/status/', views.api_bulk_update_status, name='api_bulk_update_status'),
     path('api/menu/', views.menu_api, name='menu_api'),
+    path('api/menu/search/', views.api_menu_search, name='api_menu_search'),
+    path('api/menu/availability/', views.api_menu_availability, name='api_menu_availability'),
+    path('api/metrics/wait/', views.api_wait_time, name='api_wait_time'),
+    path('api/metrics/prep/', views.api_prep_metrics, name='api_prep_metrics'),
+    path('api/metrics/admission/', views.api_admission_metrics, name='api_admission_metrics'),
+    path('api/reports/heatmap/', views.api_sales_heatmap, name='api_sales_heatmap'),
 ]
\ No newline at end of file
@@ -0,0 +1,162 @@
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .money import to_minor
+from .rules import item_modifiers, rules
+
+# Theoretical vs. actual stock.
+# Between two stocktakes an ingredient should go from the first count, plus what was received,
+# minus what the sold drinks needed by their recipes and modifiers. The difference to the new
+# count is waste, spillage, over-pouring or theft (or an unrecorded delivery when positive).
+#
+# Usage is recomputed from the orders themselves, not taken from the live deductions on
+# Ingredient.amount, so a skipped or doubled deduction shows up here instead of hiding in the
+# book amount. Order lines are read once with .iterator(); each line only bumps a counter of its
+# (menu item, size, modifiers) combination, and each distinct combination is expanded into
+# ingredients once at the end (the rule book memoizes the per-portion vector).
+
+DEFAULT_TOLERANCE = 5  # percent of the period's usage
+
+
+class VarianceRow(NamedTuple):
+    ingredient_id: int
+    name: str
+    unit: str
+    opening: Optional[Decimal]     # previous count, None when the ingredient wasn't counted then
+    received: Decimal
+    usage: Decimal                 # theoretical, from orders x rules
+    expected: Optional[Decimal]
+    counted: Decimal
+    variance: Optional[Decimal]    # counted - expected (negative: stock went missing)
+    percent: Optional[Decimal]     # variance as a percentage of usage (or of receipts when nothing sold)
+    book_variance: Decimal         # counted - Ingredient.amount at count time
+    cost: Optional[int]            # variance valued at the latest purchase price, tiyn
+    flag: str                      # '', 'shrinkage' or 'surplus'
+
+
+def tolerance():
+    return Decimal(str(getattr(settings, 'STOCK_VARIANCE_TOLERANCE', DEFAULT_TOLERANCE)))
+
+
+def theoretical_usage(start, end, chunk_size=2000):
+    """{ingredient_id: quantity} the orders of [start, end) needed, in one streaming pass."""
+    from .models import DailySalesRollup, OrderItem
+
+    book = rules.current()
+    portions = Counter()
+
+    rows = OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end).values_list(
+        'id', 'menu_item_id', 'size', 'quantity'
+    ).iterator(chunk_size=chunk_size)
+    chunk = []
+
+    def flush(rows):
+        modifiers = item_modifiers([row[0] for row in rows])
+        for pk, menu_item_id, size, quantity in rows:
+            portions[menu_item_id, size, tuple(sorted(modifiers.get(pk, ())))] += quantity
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    # Archived orders only left daily quantities per product: counted as plain medium portions.
+    # Whole local days, so a period starting or ending mid-day on an archived date is approximate.
+    # Half-open like the orders above: the day of `end` belongs to the next period, never to both.
+    for menu_item_id, quantity in DailySalesRollup.objects.filter(
+        date__gte=timezone.localdate(start), date__lt=timezone.localdate(end), menu_item__isnull=False
+    ).values_list('menu_item_id', 'quantity'):
+        portions[menu_item_id, 'M', ()] += quantity
+
+    used = defaultdict(Decimal)
+    for (menu_item_id, size, modifier_ids), count in portions.items():
+        for ing, qty in book.unit(menu_item_id, size, modifier_ids):
+            used[ing] += qty * count
+    return used
+
+
+def received_between(start, end):
+    from .models import SupplyItem
+
+    return dict(
+        SupplyItem.objects.filter(supply__created_at__gte=start, supply__created_at__lt=end)
+        .values_list('ingredient_id').annotate(total=Sum('quantity')).values_list('ingredient_id', 'total')
+    )
+
+
+def _latest_costs(ingredient_ids):
+    from .models import CostLayer
+
+    costs = {}
+    for ingredient_id, unit_cost in CostLayer.objects.filter(ingredient_id__in=ingredient_ids).order_by(
+        'ingredient_id', '-received_at', '-id'
+    ).values_list('ingredient_id', 'unit_cost'):
+        costs.setdefault(ingredient_id, unit_cost)
+    return costs
+
+
+def previous_stocktake(stocktake):
+    from .models import Stocktake
+
+    return Stocktake.objects.filter(
+        store_id=stocktake.store_id, counted_at__lt=stocktake.counted_at
+    ).order_by('-counted_at', '-id').first()
+
+
+def stock_variance(stocktake, previous=None, chunk_size=2000):
+    """
+    VarianceRow per ingredient counted in `stocktake`, biggest losses first.
+    The period starts at `previous` (default: the store's stocktake before this one); without one
+    only the book variance is known.
+    """
+    from .models import Ingredient
+
+    if previous is None:
+        previous = previous_stocktake(stocktake)
+    counts = dict(stocktake.lines.values_list('ingredient_id', 'counted'))
+    book_amounts = dict(stocktake.lines.values_list('ingredient_id', 'book_amount'))
+    ingredients = {
+        pk: (name, unit) for pk, name, unit in Ingredient.objects.filter(pk__in=counts).values_list('id', 'name', 'unit')
+    }
+
+    if previous is not None:
+        openings = dict(previous.lines.values_list('ingredient_id', 'counted'))
+        received = received_between(previous.counted_at, stocktake.counted_at)
+        usage = theoretical_usage(previous.counted_at, stocktake.counted_at, chunk_size)
+    else:
+        openings, received, usage = {}, {}, {}
+    costs = _latest_costs(counts)
+    limit = tolerance()
+
+    rows = []
+    for ingredient_id, counted in counts.items():
+        name, unit = ingredients.get(ingredient_id, (f"#{ingredient_id}", ''))
+        opening = openings.get(ingredient_id)
+        got = received.get(ingredient_id, Decimal(0))
+        used = usage.get(ingredient_id, Decimal(0))
+        expected = variance = percent = cost = None
+        flag = ''
+        if opening is not None:
+            expected = opening + got - used
+            variance = counted - expected
+            base = used or got
+            percent = (variance * 100 / base).quantize(Decimal('0.1')) if base else None
+            if variance and (percent is None or abs(percent) > limit):
+                flag = 'shrinkage' if variance < 0 else 'surplus'
+            if ingredient_id in costs:
+                cost = to_minor(variance * costs[ingredient_id])
+        rows.append(VarianceRow(
+            ingredient_id, name, unit, opening, got, used, expected, counted, variance, percent,
+            counted - book_amounts[ingredient_id], cost, flag,
+        ))
+
+    rows.sort(key=lambda row: (not row.flag, row.cost if row.cost is not None else 0, row.name))
+    return rows
@@ -3,17 +3,30 @@ from datetime import timedelta  # <--- КРИТИЧЕСКИ ВАЖНО для т
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db.models import Q, Sum, Count, F
+from django.db import transaction
+from django.db.models import Q, Sum, Count
 from django.db.models.functions import TruncDate
+import io
 import json
+import pstats
+from collections import Counter
 
 # Import all models
-from .models import Order, OrderItem, MenuItem, Modifier, Ingredient, Shift
+from .models import Order, OrderItem, MenuItem, Modifier, Shift
+from .services import transition_orders
+from .metrics import metrics
+from .inventory import sellable
+from .costing import assign_cogs
+from .money import line_price
+from .rules import rules
+from . import admission, menu, money, profiling, replica, reports, search, stock
+from .shifts import active_shift
+from .tickets import next_ticket
 
 
 def get_ai_forecast():
@@ -39,17 +52,13 @@ def get_ai_forecast():
         
         avg_daily_demand = round(float(total_sold_on_this_weekday) / 4.0, 1)
 
-        # Stock Analysis
-        if item.recipes.exists():
-            recipe = item.recipes.first()
-            ingredient = recipe.ingredient
-            # How many portions can we make with current stock?
-            current_portions = int(ingredient.amount / recipe.quantity_needed)
-            
+        # Stock Analysis: sellable portions over ALL recipe ingredients (standard size)
+        current_portions = sellable.portions(item.id, 'M')
+        if current_portions is not None:
             # AI Inference Logic
             if current_portions < avg_daily_demand:
                 status = "REORDER NEEDED 🔴"
-                action = f"Buy {ingredient.name}"
+                action = "Restock ingredients"
                 priority = 1
             elif current_portions < (avg_daily_demand * 1.5):
                 status = "Low Stock 🟡"
@@ -79,17 +88,17 @@ def home_view(request):
     return render(request, 'coffee/home.html')
 
 def cashier_view(request):
-    # Order ID logic
-    last_order = Order.objects.last()
-    next_id = last_order.id + 1 if last_order else 1
-    
+    # Product grid and modifiers are fragment-cached per menu version:
+    # the queryset and the callable below are only evaluated on a cache miss
     products = MenuItem.objects.all()
-    modifiers = list(Modifier.objects.values())
+    modifiers = lambda: list(Modifier.objects.values())
+    availability_version, availability = sellable.changes_since()
 
     context = {
-        'next_id': next_id,
+        'menu_version': menu.version(),
         'products': products,
-        'modifiers': modifiers 
+        'modifiers': modifiers,
+        'availability': {'version': availability_version, 'items': availability},
     }
     return render(request, 'coffee/cashier.html', context)
 
@@ -97,20 +106,21 @@ def barista_view(request):
     return render(request, 'coffee/barista.html')
 
 def settings_view(request):
-    active_shift = Shift.objects.filter(is_active=True).first()
+    shift_id = active_shift.get_id()
     
     context = {}
-    if active_shift:
+    if shift_id:
         # Get only completed orders for this shift
-        orders = active_shift.orders.filter(status='completed')
-        
-        # Calculate sum
-        current_total = orders.aggregate(Sum('total_price'))['total_price__sum'] or 0
-        order_count = orders.count()
+        # Sum and count of completed orders for this shift in one query
+        totals = Order.objects.filter(shift_id=shift_id, status='completed').aggregate(
+            total=Sum('total_price'), count=Count('id')
+        )
+        current_total = totals['total'] or 0
+        order_count = totals['count']
         
         context = {
             'shift_status': 'open',
-            'shift_id': active_shift.id,
+            'shift_id': shift_id,
             'current_total': current_total,
             'order_count': order_count
         }
@@ -121,11 +131,11 @@ def settings_view(request):
 
 def archive_view(request):
     # 1. Find active shift
-    active_shift = Shift.objects.filter(is_active=True).first()
+    shift_id = active_shift.get_id()
     
-    if active_shift:
+    if shift_id:
         # 2. If shift exists - get orders ONLY for THIS shift
-        orders = Order.objects.filter(shift=active_shift).order_by('-created_at')
+        orders = Order.objects.filter(shift_id=shift_id).order_by('-created_at')
         shift_status = 'open'
     else:
         # 3. If no shift - show empty (or could show last closed)
@@ -138,42 +148,42 @@ def archive_view(request):
     })
 
 # --- ANALYTICS ---
+@profiling.profile_view
+@replica.reporting_view
 def analytics_view(request):
-    period = request.GET.get('period', '7')
-    
+    period = reports.parse_period(request.GET)
+    compare = request.GET.get('compare') == '1'
+
     # ML Forecast Call (The code provided in previous steps) [cite: 16]
     target_day, ml_forecast = get_ai_forecast()
 
-    # Shift-based logic for the chart [cite: 9, 10]
-    # We take the last X shifts to show performance trends
-    shifts = Shift.objects.filter(is_active=False).order_by('-closed_at')[:15]
-    shifts = reversed(shifts) # Chronological order for the chart
-    
-    chart_labels = []
-    chart_data = []
-    
-    for s in shifts:
-        chart_labels.append(f"Shift #{s.id}")
-        chart_data.append(float(s.total_sales))
-
-    # Top items logic [cite: 12]
-    top_items = OrderItem.objects.values('menu_item__name').annotate(
-        sold_count=Sum('quantity')
-    ).order_by('-sold_count')[:10]
-
-    # Global Totals
-    total_revenue = Shift.objects.aggregate(Sum('total_sales'))['total_sales__sum'] or 0
-    total_orders = Shift.objects.aggregate(Sum('order_count'))['order_count__sum'] or 0
+    # Period figures: grouped queries over the created_at range, cached per period (coffee/reports.py)
+    report = reports.period_report(period, compare)
+    category = request.GET.get('category') or None
+    heatmap = reports.heatmap(period, category)
 
     context = {
         'target_day': target_day,
         'ml_forecast': ml_forecast,
-        'chart_labels': json.dumps(chart_labels),
-        'chart_data': json.dumps(chart_data),
-        'top_items': top_items,
-        'total_revenue': total_revenue,
-        'total_orders': total_orders,
-        'period': period,
+        'chart_labels': json.dumps(report['chart_labels']),
+        'chart_data': json.dumps(report['chart_data']),
+        'top_items': report['top_items'],
+        'item_margins': report['item_margins'],
+        'shift_margins': report['shift_margins'],
+        'by_category': report['by_category'],
+        'by_hour': report['by_hour'],
+        'heatmap': heatmap,
+        'category': category or '',
+        'categories': MenuItem.CATEGORY_CHOICES,
+        'totals': report['totals'],
+        'previous': report['previous'],
+        'total_revenue': report['totals']['revenue'],
+        'total_orders': report['totals']['orders'],
+        'period': period.key,
+        'period_label': period.label,
+        'compare': compare,
+        'date_from': timezone.localtime(period.start).date().isoformat() if period.start else '',
+        'date_to': (timezone.localtime(period.end).date() - timedelta(days=1)).isoformat() if period.end else '',
     }
     return render(request, 'coffee/analytics.html', context)
 
@@ -205,6 +215,7 @@ def api_orders(request):
 
         data.append({
             'id': order.id,
+            'ticket': order.ticket_number or order.id,
             'item_name': display_name, 
             'status': order.status,
             'created_at': order.created_at.isoformat() 
@@ -214,21 +225,36 @@ def api_orders(request):
 
 # 2. Update status (RESTORED)
 @csrf_exempt
+@admission.write_view
 def api_update_status(request, order_id):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            order = Order.objects.get(id=order_id)
-            order.status = data.get('status')
-            order.save()
+            transition_orders([order_id], data.get('status'))
             return JsonResponse({'success': True})
-        except Order.DoesNotExist:
-            return JsonResponse({'success': False, 'error': 'Order not found'})
+        except ValidationError as e:
+            return JsonResponse({'success': False, 'error': e.messages[0]})
     return JsonResponse({'success': False})
 
 
+# 2b. Bulk status update (e.g. "all selected tickets are ready")
+@csrf_exempt
+@admission.write_view
+def api_bulk_update_status(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            updated = transition_orders(data.get('order_ids', []), data.get('status'))
+            return JsonResponse({'success': True, 'updated': updated})
+        except (ValidationError, TypeError, ValueError) as e:
+            error = e.messages[0] if isinstance(e, ValidationError) else 'Invalid order ids'
+            return JsonResponse({'success': False, 'error': error})
+    return JsonResponse({'success': False, 'error': 'Invalid method'})
+
+
 # 3. Create Order
 @csrf_exempt
+@admission.write_view
 def api_create_order(request):
     if request.method == 'POST':
         logs = [] 
@@ -236,67 +262,107 @@ def api_create_order(request):
             data = json.loads(request.body)
             items = data.get('items', [])
             
-            # 1. Check Shift
-            active_shift = Shift.objects.filter(is_active=True).first()
-            if not active_shift:
+            # 1. Check Shift (cached id, no query)
+            shift_id = active_shift.get_id()
+            if not shift_id:
                 return JsonResponse({'success': False, 'error': 'Shift is closed!'})
 
-            # 2. Create Order
-            order = Order.objects.create(total_price=0, status='pending', shift=active_shift)
-            logs.append(f"Order #{order.id} created.")
-
-            final_total = 0
-
-            for item_data in items:
-                menu_item = MenuItem.objects.get(name=item_data['name'])
-                item_price = menu_item.price 
-                logs.append(f"Item: {menu_item.name}")
-
-                # Create Order Item
-                order_item = OrderItem.objects.create(
-                    order=order, menu_item=menu_item, quantity=1, price=item_price
+            # 2. Create Order (all or nothing: a sold-out item rolls the whole cart back)
+            with transaction.atomic():
+                order = Order.objects.create(
+                    total_price=0, status='pending', shift_id=shift_id, ticket_number=next_ticket(shift_id),
+                    stock_written_off=True,  # below, in this transaction
                 )
+                logs.append(f"Order #{order.id} created, ticket #{order.ticket_number}.")
+
+                final_total = 0
+                order_items = []
+                lines = []
+                chosen = {}
+
+                # Rules and modifiers for the whole cart up front: no per-line recipe queries
+                book = rules.current()
+                mod_ids = {int(mod_id) for item_data in items for mod_id in item_data.get('modifiers', [])}
+                mods = Modifier.objects.in_bulk(mod_ids)
+                if mod_ids - mods.keys():
+                    raise ValidationError(f"Unknown modifier #{min(mod_ids - mods.keys())}")
+
+                # Products by id; by (unique) name only for carts from tills that don't send ids
+                item_ids = {int(item_data['id']) for item_data in items if item_data.get('id')}
+                names = {item_data.get('name') for item_data in items if not item_data.get('id')}
+                products = MenuItem.objects.filter(Q(pk__in=item_ids) | Q(name__in=names))
+                by_id = {product.pk: product for product in products}
+                by_name = {product.name: product for product in by_id.values()}
+
+                # Portions of the whole cart per product and size: three lattes need three portions
+                wanted = Counter()
+                for item_data in items:
+                    if item_data.get('id'):
+                        menu_item = by_id.get(int(item_data['id']))
+                    else:
+                        menu_item = by_name.get(item_data.get('name'))
+                    if menu_item is None:
+                        raise ValidationError(f"Unknown product {item_data.get('id') or item_data.get('name')!r}")
+                    size = item_data.get('size', 'M')
+                    wanted[menu_item, size] += 1
+                for (menu_item, size), count in wanted.items():
+                    available = sellable.portions(menu_item.id, size)
+                    if available is not None and available < count:
+                        if available == 0:
+                            raise ValidationError(f"{menu_item.name} is sold out")
+                        raise ValidationError(f"Only {available} x {menu_item.name} left")
+
+                for item_data in items:
+                    if item_data.get('id'):
+                        menu_item = by_id[int(item_data['id'])]
+                    else:
+                        menu_item = by_name[item_data.get('name')]
+                    size = item_data.get('size', 'M')
+                    logs.append(f"Item: {menu_item.name}")
+                    if not book.has_recipe(menu_item.id):
+                        logs.append(f"  !!! WARNING: Recipe is empty (add via Admin Inline)")
+
+                    item_mods = [mods[int(mod_id)] for mod_id in item_data.get('modifiers', [])]
+                    # Integer tiyn: same rounding as the cashier cart (money.line_price)
+                    item_price = line_price(menu_item.price, size, [mod.price for mod in item_mods], sized=menu_item.is_sized)
+
+                    # Create Order Item
+                    order_item = OrderItem.objects.create(
+                        order=order, menu_item=menu_item, quantity=1, size=size, price=item_price
+                    )
+                    if item_mods:
+                        order_item.modifiers.add(*item_mods)
+                    chosen[order_item.pk] = [mod.id for mod in item_mods]
+                    lines.append((menu_item.id, size, chosen[order_item.pk], 1))
+                    final_total += item_price
+                    order_items.append(order_item)
 
                 # === INVENTORY DEDUCTION ===
-                found_recipe = False
-                
-                # Check recipes
-                if menu_item.recipes.exists():
-                    logs.append(f"  -> Recipe found! Deducting:")
-                    for recipe in menu_item.recipes.all():
-                        ing = recipe.ingredient
-                        qty_to_deduct = recipe.quantity_needed
-                        
-                        ing.amount -= qty_to_deduct
-                        ing.save()
-                        logs.append(f"     - {ing.name}: deducted {qty_to_deduct} {ing.unit}")
-                    found_recipe = True
-                else:
-                    logs.append(f"  !!! WARNING: Recipe is empty (add via Admin Inline)")
-
-                # === MODIFIER DEDUCTION ===
-                if 'modifiers' in item_data:
-                    for mod_id in item_data['modifiers']:
-                        mod = Modifier.objects.get(id=mod_id)
-                        order_item.modifiers.add(mod)
-                        item_price += mod.price
-                        
-                        # Deduct modifier ingredient (syrup/milk)
-                        if mod.ingredient:
-                            qty_mod = mod.quantity_needed
-                            mod.ingredient.amount -= qty_mod
-                            mod.ingredient.save()
-                            logs.append(f"     + Add-on {mod.name}: deducted {qty_mod} {mod.ingredient.unit}")
-
-                order_item.price = item_price
-                order_item.save()
-                final_total += item_price
-
-            order.total_price = final_total
-            order.save()
-
-            return JsonResponse({'success': True, 'order_id': order.id, 'debug_logs': logs})
+                # Whole cart in one pass, same rules as Order.finish_order and COGS (coffee/rules.py)
+                used = book.cart(lines)
+                stock.apply({ingredient_id: -needed for ingredient_id, needed in used.items()})
+                for ingredient_id, needed in used.items():
+                    name, unit = book.ingredients.get(ingredient_id, (f"#{ingredient_id}", ''))
+                    logs.append(f"  - {name}: deducted {needed} {unit}")
+
+                order.total_price = final_total
+                order.save(update_fields=['total_price'])
+                assign_cogs(order_items, chosen)
+                # Not before the COMMIT: a batch whose COMMIT failed runs this view again (coffee/admission.py)
+                transaction.on_commit(metrics.order_created)
+
+            wait = metrics.estimated_wait()
+
+            return JsonResponse({
+                'success': True,
+                'order_id': order.id,
+                'ticket': order.ticket_number,
+                'wait_minutes': -(-wait['wait_seconds'] // 60),
+                'debug_logs': logs,
+            })
         
+        except ValidationError as e:
+            return JsonResponse({'success': False, 'error': e.messages[0]})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
 
@@ -310,12 +376,63 @@ def menu_api(request):
         data.append({
             "id": item.id,
             "name": item.name,
-            "price": item.price,
+            "price": money.to_major(item.price),
             "category": item.category,
         })
     return JsonResponse({"menu": data})
 
 
+# 4a. Menu search for the cashier's search box (in-memory index, coffee/search.py)
+def api_menu_search(request):
+    try:
+        limit = min(max(int(request.GET.get('limit', search.DEFAULT_LIMIT)), 1), 50)
+    except ValueError:
+        limit = search.DEFAULT_LIMIT
+    index = search.menu_search.current()
+    results = [
+        {'id': item['id'], 'name': item['name'], 'price': money.to_major(item['price']), 'category': item['category']}
+        for item in index.search(request.GET.get('q', ''), limit)
+    ]
+    return JsonResponse({'version': index.version, 'results': results})
+
+
+# 4b. Sellable portions (cashier polls only what changed since its version)
+def api_menu_availability(request):
+    version, items = sellable.changes_since(request.GET.get('since'))
+    return JsonResponse({'version': version, 'items': items})
+
+
+# 5. Barista throughput
+def api_wait_time(request):
+    wait = metrics.estimated_wait()
+    wait['wait_minutes'] = -(-wait['wait_seconds'] // 60)
+    return JsonResponse(wait)
+
+def api_prep_metrics(request):
+    return JsonResponse({'metrics': metrics.snapshot()})
+
+def api_admission_metrics(request):
+    # Write queue of coffee/admission.py: depth, commit batch sizes, rejections
+    return JsonResponse(admission.writer.metrics.snapshot(admission.writer.depth()))
+
+
+# 6. Weekday x hour sales heatmap (same ?period= / ?category= as the analytics page)
+@replica.reporting_view
+def api_sales_heatmap(request):
+    period = reports.parse_period(request.GET)
+    data = reports.heatmap(period, request.GET.get('category') or None)
+    return JsonResponse({
+        'period': period.key,
+        'label': period.label,
+        'weekdays': data['weekdays'],
+        'hours': list(range(24)),
+        'cells': [
+            [dict(cell, revenue=money.to_major(cell['revenue'])) for cell in row['cells']]
+            for row in data['rows']
+        ],
+    })
+
+
 # --- PLACEHOLDERS ---
 def create_order_view(request): return JsonResponse({"status": "ok"})
 def complete_order_api(request): return JsonResponse({"status": "completed"})
@@ -339,33 +456,59 @@ def logout_view(request):
     return redirect('login')
 
 @csrf_exempt
+@admission.write_view
 def api_manage_shift(request, action):
     if request.method == 'POST':
-        if action == 'open':
-            # Check if one is already open
-            if Shift.objects.filter(is_active=True).exists():
-                return JsonResponse({'success': False, 'error': 'Shift already open!'})
-            
-            Shift.objects.create(is_active=True)
-            return JsonResponse({'success': True})
-
-        elif action == 'close':
-            try:
-                shift = Shift.objects.get(is_active=True)
-                # Calculate totals only for completed orders
-                orders = shift.orders.filter(status='completed') 
-                total = orders.aggregate(Sum('total_price'))['total_price__sum'] or 0
-                count = orders.count()
-                
-                # Close shift
-                shift.total_sales = total
-                shift.order_count = count
-                shift.is_active = False
-                shift.closed_at = timezone.now()
-                shift.save()
-                
-                return JsonResponse({'success': True, 'summary': {'total': total, 'count': count}})
-            except Shift.DoesNotExist:
-                return JsonResponse({'success': False, 'error': 'No active shift found!'})
+        try:
+            if action == 'open':
+                active_shift.open()
+                return JsonResponse({'success': True})
+
+            elif action == 'close':
+                shift = active_shift.close()
+                return JsonResponse({'success': True, 'summary': {'total': money.format_money(shift.total_sales), 'count': shift.order_count}})
+        except ValidationError as e:
+            return JsonResponse({'success': False, 'error': e.messages[0]})
                 
-    return JsonResponse({'success': False, 'error': 'Invalid method'})
\ No newline at end of file
+    return JsonResponse({'success': False, 'error': 'Invalid method'})
+
+
+# --- PROFILER (admin only, see coffee/profiling.py) ---
+
+PROFILE_FILES = {'profile.pstats', 'stacks.txt', 'queries.json', 'meta.json'}
+
+def _profile_path(name):
+    """Directory of one saved profile; 404 for anything that isn't a direct child of profile_dir() ('..', links)."""
+    root = profiling.profile_dir().resolve()
+    path = (root / name).resolve()
+    if path.parent != root or not path.is_dir():
+        raise Http404
+    return path
+
+def profiles_admin(request, name=None):
+    context = {'title': 'Request profiles', 'profiles': profiling.list_profiles(), 'token': profiling.make_token()}
+    if name:
+        path = _profile_path(name)
+        out = io.StringIO()
+        pstats.Stats(str(path / 'profile.pstats'), stream=out).sort_stats('cumulative').print_stats(30)
+        queries = json.loads((path / 'queries.json').read_text(encoding='utf-8'))
+        by_caller = {}
+        for q in queries:
+            row = by_caller.setdefault(q['caller'], {'caller': q['caller'], 'count': 0, 'ms': 0})
+            row['count'] += 1
+            row['ms'] = round(row['ms'] + q['ms'], 3)
+        context.update({
+            'name': name,
+            'stats': out.getvalue(),
+            'queries': queries,
+            'query_callers': sorted(by_caller.values(), key=lambda r: -r['ms']),
+        })
+    return render(request, 'coffee/profiles.html', context)
+
+def profile_file(request, name, filename):
+    if filename not in PROFILE_FILES:
+        raise Http404
+    path = _profile_path(name) / filename
+    if not path.exists():
+        raise Http404
+    return FileResponse(path.open('rb'), as_attachment=True, filename=f"{name}-{filename}")
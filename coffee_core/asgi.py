@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'coffee_core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Static files are answered here, before Django (see coffee/asgi_static.py)
+from coffee.asgi_static import StaticFilesApp  # noqa: E402
+
+application = StaticFilesApp(django_application)
@@ -45,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'coffee.profiling.ProfilingMiddleware',  # ?_profile (staff) или заголовок X-Profile-Token
 ]
 
 ROOT_URLCONF = 'coffee_core.urls'
@@ -77,8 +78,15 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Снимок основной базы для отчётов (coffee/replica.py), только чтение
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+    },
 }
+# Другие точки: 'store_<код>' — база этой точки, 'hq' — сводная база головного офиса (coffee/stores.py)
+DATABASE_ROUTERS = ['coffee.routers.StoreRouter', 'coffee.routers.ReplicaRouter']
 
 
 # Password validation
@@ -116,6 +124,12 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# Сюда собирает collectstatic: имена с хешем + готовые .gz/.br, отдаёт coffee.asgi_static
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'coffee.staticstorage.CompressedManifestStaticFilesStorage'},
+}
 
 # Это скажет Django искать файлы в твоих папках приложений
 STATICFILES_FINDERS = [
@@ -173,4 +187,55 @@ EMAIL_HOST_USER = 'saparnursat727@gmail.com'
 EMAIL_HOST_PASSWORD = 'bcuevdtmniandiwq' 
 
 # Почта администратора (куда приходят копии ошибок)
-X_FRAME_OPTIONS = 'SAMEORIGIN'
\ No newline at end of file
+X_FRAME_OPTIONS = 'SAMEORIGIN'
+# Себестоимость (coffee/costing.py): 'fifo' или 'average' (средневзвешенная)
+COGS_METHOD = 'fifo'
+
+# Инвентаризация (coffee/variance.py): расхождение больше этого процента от расхода помечается
+STOCK_VARIANCE_TOLERANCE = 5
+
+# Профили запросов: кольцевой буфер на диске, смотреть в /admin/profiles/
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_KEEP = 50
+
+# Файлы-метки для сброса кэшей во всех воркерах (coffee/stamps.py)
+COFFEE_STAMP_DIR = BASE_DIR / '.stamps'
+
+# Номера чеков для клиентов (coffee/tickets.py): сброс каждую смену ('shift') или каждый день ('day')
+TICKET_RESET = 'shift'
+TICKET_MAX = 999
+
+# Архив старых заказов (coffee/archive.py): сжатые сегменты, индекс и дневные итоги в БД
+ARCHIVE_DIR = BASE_DIR / 'archive'
+
+# Приём записей в час пик (coffee/admission.py): очередь на одного писателя, групповой коммит
+ADMISSION_CONTROL = True
+ADMISSION_QUEUE = 64     # сколько запросов может ждать; дальше сразу 503 + Retry-After
+ADMISSION_BATCH = 16     # сколько запросов в одной транзакции
+ADMISSION_TIMEOUT = 10   # секунд ожидания в очереди до 503
+ADMISSION_RATE = 10      # запросов в секунду на одну кассу (429 сверх этого)
+ADMISSION_BURST = 30
+
+# Насколько может отставать реплика для аналитики (секунды)
+REPLICA_MAX_LAG = 60
+
+# Резервные копии (manage.py backup): куда, сколько хранить, по сколько страниц копировать за шаг
+BACKUP_DIR = BASE_DIR / 'backups'
+BACKUP_KEEP = 14
+BACKUP_STEP_PAGES = 256
+BACKUP_PAUSE = 0.005
+
+# Код этой точки (кофейни), под ним её данные уходят в головной офис (manage.py sync_hq)
+STORE_CODE = 'main'
+
+# Кэш отчётов аналитики (coffee/reports.py): сколько периодов держать и сколько секунд живут "текущие" периоды
+REPORT_CACHE_SIZE = 32
+REPORT_LIVE_TTL = 30
+
+# Кэш в памяти процесса: фрагменты шаблонов (сетка товаров кассы), ключ — версия меню (coffee/menu.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'coffee',
+    }
+}
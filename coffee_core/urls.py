@@ -1,7 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include  # <--- Не забудь include
+from coffee import views as coffee_views
 
 urlpatterns = [
+    # Профайлер запросов (только для staff, через админку)
+    path('admin/profiles/', admin.site.admin_view(coffee_views.profiles_admin), name='profiles_admin'),
+    path('admin/profiles/<str:name>/', admin.site.admin_view(coffee_views.profiles_admin), name='profile_detail'),
+    path('admin/profiles/<str:name>/<str:filename>', admin.site.admin_view(coffee_views.profile_file), name='profile_file'),
     path('admin/', admin.site.urls),
     path('', include('coffee.urls')),  # <--- Теперь все ссылки из coffee будут работать
 ]
\ No newline at end of file